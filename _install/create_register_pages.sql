@@ -0,0 +1,39 @@
+-- Page boundaries for the Address, Address Site, Locality & Street Locality registers: the pid found at every 1000th
+-- row of each register, in pid order, with that row's offset. The app finds the start of any page with one lookup in
+-- this table then reads fewer than 1000 rows past it, rather than OFFSETting through the whole register.
+-- Run after each load, once the tables are loaded & indexed; it replaces any earlier boundaries.
+
+-- DROP TABLE gnaf.register_page_boundary;
+DROP TABLE IF EXISTS gnaf.register_page_boundary;
+CREATE TABLE gnaf.register_page_boundary (
+ register varchar(32) NOT NULL,
+ row_offset bigint NOT NULL,
+ pid varchar(15) NOT NULL,
+ CONSTRAINT register_page_boundary_pk PRIMARY KEY (register, row_offset)
+);
+
+INSERT INTO gnaf.register_page_boundary (register, row_offset, pid)
+SELECT 'address_detail', row_offset, address_detail_pid
+FROM (SELECT address_detail_pid, row_number() OVER (ORDER BY address_detail_pid) - 1 AS row_offset
+      FROM gnaf.address_detail) r
+WHERE row_offset % 1000 = 0;
+
+INSERT INTO gnaf.register_page_boundary (register, row_offset, pid)
+SELECT 'address_site', row_offset, address_site_pid
+FROM (SELECT address_site_pid, row_number() OVER (ORDER BY address_site_pid) - 1 AS row_offset
+      FROM gnaf.address_site) r
+WHERE row_offset % 1000 = 0;
+
+INSERT INTO gnaf.register_page_boundary (register, row_offset, pid)
+SELECT 'locality', row_offset, locality_pid
+FROM (SELECT locality_pid, row_number() OVER (ORDER BY locality_pid) - 1 AS row_offset
+      FROM gnaf.locality) r
+WHERE row_offset % 1000 = 0;
+
+INSERT INTO gnaf.register_page_boundary (register, row_offset, pid)
+SELECT 'street_locality', row_offset, street_locality_pid
+FROM (SELECT street_locality_pid, row_number() OVER (ORDER BY street_locality_pid) - 1 AS row_offset
+      FROM gnaf.street_locality) r
+WHERE row_offset % 1000 = 0;
+
+ANALYZE gnaf.register_page_boundary;
@@ -15,6 +15,7 @@
 \i create_codes.sql
 \i create_views.sql
 \i create_indexes.sql
+\i create_register_pages.sql
 
 
 GRANT ALL PRIVILEGES ON ALL TABLES IN SCHEMA gnaf TO gnafusr;
@@ -0,0 +1,138 @@
+import socketserver
+import threading
+import time
+
+from cache import LRUCache, SqliteCache, MemcachedCache, SingleFlight
+
+
+def test_evicts_least_recently_used_by_size():
+    c = LRUCache(max_bytes=10, ttl=60)
+    c.set('a', 'A', 4)
+    c.set('b', 'B', 4)
+    assert c.get('a') == ('A', True)  # a is now more recently used than b
+    c.set('c', 'C', 4)
+    assert c.get('b') is None
+    assert c.get('a') == ('A', True)
+    assert c.size == 8
+
+
+def test_too_big_values_are_not_cached():
+    c = LRUCache(max_bytes=10, ttl=60)
+    c.set('a', 'A', 11)
+    assert c.get('a') is None
+    assert c.size == 0
+
+
+def test_stale_values_are_served_then_expire():
+    c = LRUCache(max_bytes=10, ttl=0.05, stale_ttl=0.1)
+    c.set('a', 'A', 1)
+    time.sleep(0.07)
+    assert c.get('a') == ('A', False)
+    time.sleep(0.1)
+    assert c.get('a') is None
+
+
+def test_refresh_loads_in_the_background():
+    c = LRUCache(max_bytes=10, ttl=60)
+    c.set('a', 'old', 1)
+    c.refresh('a', lambda: ('new', 1))
+    for _ in range(100):
+        if c.get('a') == ('new', True):
+            break
+        time.sleep(0.01)
+    assert c.get('a') == ('new', True)
+
+
+def test_sqlite_cache_stores_and_expires(tmp_path):
+    c = SqliteCache(str(tmp_path / 'l2.sqlite'), ttl=0.05)
+    c.set('release/Address/GAACT1/gnaf/text/html', b'\x00body')
+    assert c.get('release/Address/GAACT1/gnaf/text/html') == b'\x00body'
+    assert c.get('other-release/Address/GAACT1/gnaf/text/html') is None
+    time.sleep(0.07)
+    assert c.get('release/Address/GAACT1/gnaf/text/html') is None
+
+
+class _MemcachedStandIn(socketserver.StreamRequestHandler):
+    """Serves just enough of memcached's text protocol: get & set"""
+    def handle(self):
+        store = self.server.store
+        for line in self.rfile:
+            parts = line.split()
+            if parts[0] == b'set':
+                data = self.rfile.read(int(parts[4]) + 2)[:-2]
+                store[parts[1]] = data
+                self.wfile.write(b'STORED\r\n')
+            elif parts[0] == b'get':
+                for key in parts[1:]:
+                    if key in store:
+                        self.wfile.write(b'VALUE %s 0 %d\r\n%s\r\n' % (key, len(store[key]), store[key]))
+                self.wfile.write(b'END\r\n')
+
+
+def test_memcached_cache_against_a_stand_in():
+    server = socketserver.ThreadingTCPServer(('127.0.0.1', 0), _MemcachedStandIn)
+    server.daemon_threads = True
+    server.store = {}
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    try:
+        c = MemcachedCache('127.0.0.1:{}'.format(server.server_address[1]), ttl=60)
+        assert c.get('release/Address/GAACT1/gnaf/text/html') is None
+        body = b'line 1\r\nEND\r\n' * 10000
+        c.set('release/Address/GAACT1/gnaf/text/html', body)
+        assert c.get('release/Address/GAACT1/gnaf/text/html') == body
+        assert c.get('other-release/Address/GAACT1/gnaf/text/html') is None
+    finally:
+        server.shutdown()
+        server.server_close()
+
+
+def test_single_flight_shares_one_call_between_concurrent_callers():
+    flight = SingleFlight()
+    calls = []
+    started = threading.Event()
+
+    def slow():
+        calls.append(1)
+        started.set()
+        time.sleep(0.1)
+        return len(calls)
+
+    results = []
+    threads = [threading.Thread(target=lambda: results.append(flight.do('k', slow))) for _ in range(10)]
+    threads[0].start()
+    started.wait()
+    for t in threads[1:]:
+        t.start()
+    for t in threads:
+        t.join()
+    assert calls == [1]
+    assert results == [1] * 10
+    assert len(flight) == 0
+    assert flight.do('k', slow) == 2  # a later call runs it again
+
+
+def test_single_flight_shares_exceptions():
+    flight = SingleFlight()
+    started = threading.Event()
+
+    def failing():
+        started.set()
+        time.sleep(0.1)
+        raise ValueError('no')
+
+    errors = []
+
+    def call():
+        try:
+            flight.do('k', failing)
+        except ValueError as e:
+            errors.append(e)
+
+    first = threading.Thread(target=call)
+    first.start()
+    started.wait()
+    second = threading.Thread(target=call)
+    second.start()
+    first.join()
+    second.join()
+    assert len(errors) == 2 and errors[0] is errors[1]
@@ -0,0 +1,48 @@
+import gzip
+import os
+import shutil
+import pytest
+
+from nt_writer import NTriplesWriter
+
+RECORD = '<http://example.com/a> <http://example.com/p> "x" .\n<http://example.com/a> <http://example.com/q> "y" .\n'
+
+
+def test_files_are_rotated_by_records_or_bytes(tmp_path):
+    stem = str(tmp_path / 'data-')
+    with NTriplesWriter(stem, max_records=3) as w:
+        for _ in range(7):
+            w.write(RECORD)
+    assert [(os.path.basename(f['file']), f['records'], f['triples']) for f in w.files] == \
+        [('data-0001.nt', 3, 6), ('data-0002.nt', 3, 6), ('data-0003.nt', 1, 2)]
+    with open(stem + '0001.nt') as f:
+        assert f.read() == RECORD * 3
+
+    with NTriplesWriter(stem, first_number=4, max_bytes=len(RECORD) * 2 + 1) as w:
+        for _ in range(5):
+            w.write(RECORD)
+    assert [f['records'] for f in w.files] == [3, 2]
+    assert os.path.basename(w.files[0]['file']) == 'data-0004.nt'
+
+
+@pytest.mark.parametrize('compress_in', [None, 'thread', 'process'])
+def test_gzip_compression(tmp_path, compress_in):
+    if compress_in == 'process' and shutil.which('gzip') is None:
+        pytest.skip('no gzip program')
+    stem = str(tmp_path / 'data-')
+    with NTriplesWriter(stem, max_records=2, compression='gzip', compress_in=compress_in) as w:
+        for _ in range(3):
+            w.write(RECORD)
+    assert [os.path.basename(f['file']) for f in w.files] == ['data-0001.nt.gz', 'data-0002.nt.gz']
+    with gzip.open(stem + '0001.nt.gz', 'rt') as f:
+        assert f.read() == RECORD * 2
+
+
+def test_file_is_left_partial_by_an_error(tmp_path):
+    stem = str(tmp_path / 'data-')
+    with pytest.raises(RuntimeError):
+        with NTriplesWriter(stem, max_records=2) as w:
+            for _ in range(3):
+                w.write(RECORD)
+            raise RuntimeError()
+    assert sorted(os.listdir(str(tmp_path))) == ['data-0001.nt', 'data-0002.nt.part']
@@ -0,0 +1,50 @@
+# tests that N-Triples written by ntriples.py & Address.export_nt() are those rdflib writes. The Address tests need the
+# database configured in _config, with at least one Address, and are skipped without it.
+import itertools
+import pytest
+from rdflib import Graph, Literal, URIRef, XSD
+from rdflib.compare import isomorphic
+
+import ntriples as nt
+
+
+def rdflib_nt(s, p, o):
+    g = Graph()
+    g.add((s, p, o))
+    return g.serialize(format='nt').decode('utf-8').strip() + '\n'
+
+
+def test_literals_are_written_as_rdflib_writes_them():
+    s = URIRef('http://linked.data.gov.au/dataset/gnaf/address/GAACT714845933')
+    p = URIRef('http://linked.data.gov.au/def/gnaf#hasPostcode')
+    for value, datatype in [
+        ('0800', nt.XSD_INTEGER), (None, nt.XSD_INTEGER), (12, nt.XSD_INTEGER), ('12A', nt.XSD_INTEGER),
+        ('2004-04-29', nt.XSD_DATE), (None, nt.XSD_DATE),
+        ('Unit 1 "Ye Olde" Café\\Bar\r\n', nt.XSD_STRING), ('𝔊-NAF', nt.XSD_STRING)
+    ]:
+        assert nt.triple(nt.uri(str(s)), nt.uri(str(p)), nt.literal(value, datatype)) == \
+            rdflib_nt(s, p, Literal(value, datatype=URIRef(datatype)))
+
+
+def test_addresses_export_the_triples_of_their_graphs():
+    pytest.importorskip('_config')
+    from psycopg2 import sql
+    from db import get_db_connection
+    from model.address import Address
+
+    with get_db_connection() as con:
+        try:
+            addresses = Address.export_many(sql.SQL('TRUE'), con, itersize=100)
+            sample = list(itertools.islice(addresses, 200))
+            # closes the named cursor
+            addresses.close()
+        finally:
+            con.rollback()
+    assert len(sample) > 0
+    for a in sample:
+        exported = a.export_nt()
+        expected = a.export_rdf(view='gnaf').serialize(format='nt').decode('utf-8')
+        # triples without blank nodes are the same, byte for byte, the rest are the same but for their labels
+        assert set(l for l in exported.splitlines() if '_:' not in l) == \
+            set(l for l in expected.splitlines() if l and '_:' not in l)
+        assert isomorphic(Graph().parse(data=exported, format='nt'), a.export_rdf(view='gnaf'))
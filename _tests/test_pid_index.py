@@ -0,0 +1,20 @@
+from pid_index import PidIndex, write_pid_index
+
+
+def test_finds_exactly_the_indexed_pids(tmp_path):
+    path = str(tmp_path / 'address_detail-test.pids')
+    pids = sorted(['GAACT714845933', 'GAACT714845934', 'GANT_702959677', 'GAOT_717882967', 'GAVIC411711441'])
+    assert write_pid_index(path, iter(pids), width=14) == 5
+    index = PidIndex(path)
+    assert len(index) == 5
+    for pid in pids:
+        assert pid in index
+    for pid in ['GAACT714845935', 'GAACT71484593', 'GA', '', 'GAACT7148459330', 'GAZZZ999999999', 'GAÄCT714845933']:
+        assert pid not in index
+    index.close()
+
+
+def test_empty_index(tmp_path):
+    path = str(tmp_path / 'locality-test.pids')
+    write_pid_index(path, [], width=1)
+    assert 'ACT570' not in PidIndex(path)
@@ -0,0 +1,53 @@
+# tests of paging through a register by ID, with after=. They need the database configured in _config, with more than
+# one Address, and are skipped without it.
+import re
+import pytest
+from rdflib import Graph, Namespace, URIRef
+
+REG = Namespace('http://purl.org/linked-data/registry#')
+XHV = Namespace('https://www.w3.org/1999/xhtml/vocab#')
+
+
+def get(client, uri, **kwargs):
+    """Gets a URI of the dataset from the app, where its path is the part after the dataset's URI"""
+    import _config as config
+    return client.get(uri[len(config.URI_BASE):], **kwargs)
+
+
+def get_page(client, uri):
+    """:return: the page's Graph, its pids & its Link headers' URIs by rel, for the page at the URI"""
+    response = get(client, uri, headers={'Accept': 'text/turtle'})
+    assert response.status_code == 200
+    g = Graph().parse(data=response.get_data(as_text=True), format='turtle')
+    register = URIRef(uri.split('?')[0])
+    pids = sorted(str(item)[len(register):] for item in g.subjects(REG.register, register))
+    links = dict((rel, link) for link, rel in re.findall(r'<([^>]*)>; rel="([^"]*)"', response.headers['Link']))
+    return g, pids, links
+
+
+def test_keyset_pages_chain_without_gaps_or_repeats():
+    pytest.importorskip('_config')
+    import _config as config
+    from app import app
+
+    client = app.test_client()
+    register = config.URI_ADDRESS_INSTANCE_BASE
+    all_pids = get_page(client, register + '?per_page=10000&page=1')[1]
+    assert len(all_pids) > 1
+
+    walked = []
+    uri = register + '?per_page=1&after='
+    while uri is not None:
+        g, pids, links = get_page(client, uri)
+        walked += pids
+        next_uri = links.get('next')
+        # no page number links, & the page is described by its after argument, with the same next page as its header
+        assert [link for link in links.values() if '&page=' in link] == []
+        assert [o for o in g.objects() if '&page=' in str(o)] == []
+        assert list(g.objects(URIRef(uri), XHV.next)) == ([URIRef(next_uri)] if next_uri is not None else [])
+
+        hrefs = re.findall(r'href="([^"]*)"', get(client, uri).get_data(as_text=True).replace('&amp;', '&'))
+        assert [href for href in hrefs if '&page=' in href] == []
+        assert (next_uri is not None) == (next_uri in hrefs)
+        uri = next_uri
+    assert walked == all_pids
@@ -0,0 +1,83 @@
+# tests of db.ReplicaRouter against real Postgres instances, given as at least two DSNs separated by ';' in the
+# environment variable GNAF_TEST_REPLICA_DSNS, e.g.
+# GNAF_TEST_REPLICA_DSNS="host=/tmp/pg1 dbname=gnaf user=postgres;host=/tmp/pg2 dbname=gnaf user=postgres"
+import os
+import pytest
+
+DSNS = [dsn for dsn in os.environ.get('GNAF_TEST_REPLICA_DSNS', '').split(';') if dsn.strip()]
+
+pytestmark = pytest.mark.skipif(len(DSNS) < 2, reason='GNAF_TEST_REPLICA_DSNS does not give two replicas')
+
+
+def make_router(dsns):
+    from db import ReplicaRouter, PreparingConnection
+    return ReplicaRouter(dsns, 1, 4, retry_after=60, connection_factory=PreparingConnection)
+
+
+def test_connections_spread_across_replicas():
+    router = make_router(DSNS[:2])
+    cons = [router.getconn() for _ in range(4)]
+    dsns = [con.dsn for con in cons]
+    assert len(set(dsns)) == 2, 'connections were not spread over both replicas'
+    assert dsns.count(dsns[0]) == 2, 'replicas do not have equal numbers of outstanding connections'
+    for con in cons:
+        router.putconn(con)
+    router.closeall()
+
+
+def test_least_outstanding_replica_is_chosen():
+    router = make_router(DSNS[:2])
+    first, second = router.getconn(), router.getconn()
+    assert first.dsn != second.dsn
+    # first's replica now has no outstanding connections & second's has one, so the next is from first's
+    router.putconn(first)
+    con = router.getconn()
+    assert con.dsn == first.dsn
+    router.putconn(con)
+    router.putconn(second)
+    router.closeall()
+
+
+def test_unreachable_replica_is_marked_unhealthy():
+    router = make_router(['host=127.0.0.1 port=1 dbname=gnaf connect_timeout=1', DSNS[0]])
+    cons = [router.getconn() for _ in range(3)]
+    assert all(con.dsn == cons[0].dsn for con in cons)
+    assert router._unhealthy_until[0] > 0
+    for con in cons:
+        router.putconn(con)
+    router.closeall()
+
+
+def test_broken_connection_marks_replica_unhealthy():
+    import psycopg2
+    router = make_router(DSNS[:2])
+    con = router.getconn()
+    i = router._replica_of[id(con)]
+    admin = psycopg2.connect(con.dsn)
+    admin.cursor().execute('SELECT pg_terminate_backend(%s)', (con.get_backend_pid(),))
+    admin.close()
+    with pytest.raises(psycopg2.OperationalError):
+        con.cursor().execute('SELECT 1')
+    router.putconn(con)
+    assert router._unhealthy_until[i] > 0
+    # the other replica now gets all the connections
+    cons = [router.getconn() for _ in range(2)]
+    assert all(router._replica_of[id(c)] != i for c in cons)
+    for c in cons:
+        router.putconn(c)
+    router.closeall()
+
+
+def test_busy_replica_falls_over_to_the_next():
+    router = make_router(DSNS[:2])
+    # exhaust the first replica's pool behind the router's back, so the router still thinks it the least busy
+    busy_pool = router._get_pool(0)
+    busy_pool.timeout = 0.2
+    held = [busy_pool.getconn() for _ in range(busy_pool.maxconn)]
+    con = router.getconn()
+    assert router._replica_of[id(con)] == 1
+    assert router._unhealthy_until[0] == 0
+    router.putconn(con)
+    for c in held:
+        busy_pool.putconn(c)
+    router.closeall()
@@ -0,0 +1,15 @@
+# tests of the row classes of db.RowCursor & db.reg, which need _config to import db
+import pytest
+
+
+def test_last_of_duplicate_columns_wins():
+    pytest.importorskip('_config')
+    from db import row_class
+
+    Row = row_class(('pid', 'name', 'name', '?column?'))
+    r = Row('ACT570', 'locality', 'alias', 1)
+    assert r.pid == 'ACT570'
+    assert r.name == 'alias'
+    assert getattr(r, '?column?') == 1
+    assert tuple(r) == ('ACT570', 'locality', 'alias', 1)
+    assert row_class(('pid', 'name')) is not Row
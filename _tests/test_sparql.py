@@ -0,0 +1,40 @@
+from controller.sparql import normalise_sparql_query
+
+
+def test_layout_and_comments_are_normalised():
+    a = '''PREFIX gnaf: <http://linked.data.gov.au/def/gnaf#>
+SELECT ?a  # every Address
+WHERE {
+    ?a a gnaf:Address .
+} LIMIT 10'''
+    b = 'PREFIX gnaf: <http://linked.data.gov.au/def/gnaf#> SELECT ?a WHERE { ?a a gnaf:Address . } LIMIT 10'
+    assert normalise_sparql_query(a) == normalise_sparql_query(b)
+
+
+def test_strings_and_iris_are_kept_as_they_are():
+    assert normalise_sparql_query('SELECT * WHERE { ?s ?p "a  b # c" }') != \
+        normalise_sparql_query('SELECT * WHERE { ?s ?p "a b # c" }')
+    assert '<http://linked.data.gov.au/def/gnaf#Address>' in \
+        normalise_sparql_query('SELECT * WHERE { ?a a <http://linked.data.gov.au/def/gnaf#Address> }')
+
+
+def test_prefixes_are_sorted_and_repeated_ones_dropped():
+    a = '''PREFIX rdfs: <http://www.w3.org/2000/01/rdf-schema#>
+PREFIX gnaf: <http://linked.data.gov.au/def/gnaf#>
+SELECT * WHERE { ?a a gnaf:Address ; rdfs:label "dct:title" }'''
+    b = '''prefix gnaf:<http://linked.data.gov.au/def/gnaf#>
+PREFIX rdfs: <http://www.w3.org/2000/01/rdf-schema#>
+PREFIX gnaf: <http://linked.data.gov.au/def/gnaf#>
+SELECT * WHERE { ?a a gnaf:Address ; rdfs:label "dct:title" }'''
+    assert normalise_sparql_query(a) == normalise_sparql_query(b)
+    assert normalise_sparql_query(a).startswith('PREFIX gnaf: <http://linked.data.gov.au/def/gnaf#> PREFIX rdfs:')
+
+
+def test_unused_prefixes_are_kept():
+    # the prefixes of a CONSTRUCT's Turtle result are the query's, so the results of these differ
+    a = '''PREFIX gnaf: <http://linked.data.gov.au/def/gnaf#>
+CONSTRUCT { ?a a gnaf:Address } WHERE { ?a a gnaf:Address } LIMIT 10'''
+    b = '''PREFIX dct: <http://purl.org/dc/terms/>
+PREFIX gnaf: <http://linked.data.gov.au/def/gnaf#>
+CONSTRUCT { ?a a gnaf:Address } WHERE { ?a a gnaf:Address } LIMIT 10'''
+    assert normalise_sparql_query(a) != normalise_sparql_query(b)
@@ -5,11 +5,13 @@ import pyldapi
 import _config as conf
 from flask import Flask
 from controller import pages, classes
+import db
 
 app = Flask(__name__, template_folder=conf.TEMPLATES_DIR, static_folder=conf.STATIC_DIR)
 
 app.register_blueprint(pages.pages)
 app.register_blueprint(classes.classes)
+db.init_app(app)
 
 
 # run the Flask app
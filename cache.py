@@ -0,0 +1,338 @@
+import hashlib
+import logging
+import os
+import socket
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+logger = logging.getLogger(__name__)
+
+
+class LRUCache(object):
+    """
+    A thread-safe, in-process cache bounded by the total size of its values, evicting the least recently used first.
+
+    A value is fresh for ttl seconds after it is set, then stale for stale_ttl seconds more, after which it is gone.
+    Stale values are still returned by get() so that they can be served while refresh() loads a new one in the
+    background.
+    """
+    def __init__(self, max_bytes, ttl, stale_ttl=0):
+        """
+        :param max_bytes: the most the sizes of all values may add up to
+        :param ttl: seconds a value is fresh for
+        :param stale_ttl: seconds a value may be served stale for, after it stops being fresh
+        """
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.stale_ttl = stale_ttl
+        self.size = 0
+        self._entries = OrderedDict()
+        self._refreshing = set()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        """
+        :param key: a hashable key
+        :return: (value, is_fresh), or None if the key isn't cached or has expired
+        """
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            value, size, stored_at = entry
+            age = time.monotonic() - stored_at
+            if age > self.ttl + self.stale_ttl:
+                self._remove(key)
+                return None
+            self._entries.move_to_end(key)
+            return value, age <= self.ttl
+
+    def set(self, key, value, size):
+        """
+        Caches a value, evicting the least recently used values to make room. Values bigger than the whole cache
+        aren't cached.
+
+        :param key: a hashable key
+        :param value: the value
+        :param size: the size of the value, in the same units as max_bytes
+        """
+        if size > self.max_bytes:
+            return
+        with self._lock:
+            if key in self._entries:
+                self._remove(key)
+            self._entries[key] = (value, size, time.monotonic())
+            self.size += size
+            while self.size > self.max_bytes:
+                self._remove(next(iter(self._entries)))
+
+    def refresh(self, key, load):
+        """
+        Loads a new value for key in a background thread & caches it, unless the key is already being refreshed
+
+        :param key: a hashable key
+        :param load: a function returning (value, size), or None if there's nothing to cache
+        """
+        with self._lock:
+            if key in self._refreshing:
+                return
+            self._refreshing.add(key)
+
+        def _refresh():
+            try:
+                loaded = load()
+                if loaded is not None:
+                    self.set(key, *loaded)
+            except Exception as e:
+                logger.warning("Couldn't refresh cached {}: {}".format(key, e))
+            finally:
+                with self._lock:
+                    self._refreshing.discard(key)
+
+        threading.Thread(target=_refresh, daemon=True).start()
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.size = 0
+
+    def __len__(self):
+        return len(self._entries)
+
+    def _remove(self, key):
+        value, size, stored_at = self._entries.pop(key)
+        self.size -= size
+
+
+class SqliteCache(object):
+    """
+    A second-level cache of bytes values in an sqlite database on local disk, shared by all the processes on a host.
+
+    Every thread of every process gets its own connection, as sqlite connections can't be shared across threads or
+    forks. Expired values are purged every purge_every sets.
+    """
+    def __init__(self, path, ttl, purge_every=1000):
+        """
+        :param path: the database file, which is created if it doesn't exist
+        :param ttl: seconds a value is kept for
+        :param purge_every: how many sets, per process, between purges of expired values
+        """
+        self.path = path
+        self.ttl = ttl
+        self.purge_every = purge_every
+        self._sets = 0
+        self._local = threading.local()
+        self._connection().execute(
+            'CREATE TABLE IF NOT EXISTS entries (key TEXT PRIMARY KEY, value BLOB NOT NULL, expires REAL NOT NULL)')
+
+    def _connection(self):
+        con = getattr(self._local, 'con', None)
+        if con is None or self._local.pid != os.getpid():
+            con = sqlite3.connect(self.path, timeout=5, isolation_level=None)
+            con.execute('PRAGMA journal_mode=WAL')
+            con.execute('PRAGMA synchronous=NORMAL')
+            self._local.con = con
+            self._local.pid = os.getpid()
+        return con
+
+    def get(self, key):
+        """
+        :param key: a str key
+        :return: the bytes value, or None if the key isn't cached or has expired
+        """
+        row = self._connection().execute(
+            'SELECT value FROM entries WHERE key = ? AND expires > ?', (key, time.time())).fetchone()
+        return None if row is None else bytes(row[0])
+
+    def set(self, key, value):
+        """
+        :param key: a str key
+        :param value: a bytes value
+        """
+        con = self._connection()
+        con.execute('INSERT OR REPLACE INTO entries (key, value, expires) VALUES (?, ?, ?)',
+                    (key, sqlite3.Binary(value), time.time() + self.ttl))
+        self._sets += 1
+        if self._sets % self.purge_every == 0:
+            con.execute('DELETE FROM entries WHERE expires <= ?', (time.time(),))
+
+    def clear(self):
+        self._connection().execute('DELETE FROM entries')
+
+
+class MemcachedCache(object):
+    """
+    A second-level cache of bytes values in a memcached server, shared by all processes on all hosts that use it.
+
+    This speaks memcached's text protocol directly, so anything serving that protocol will do. Keys are hashed, as
+    memcached keys are limited to 250 characters without spaces. Each thread keeps its own socket, which is reopened
+    after any error.
+    """
+    def __init__(self, server, ttl, timeout=1.0):
+        """
+        :param server: 'host:port' of the memcached server
+        :param ttl: seconds a value is kept for, at most 30 days
+        :param timeout: seconds to wait for the server before giving up
+        """
+        host, _, port = server.rpartition(':')
+        self.address = (host or 'localhost', int(port))
+        self.ttl = int(ttl)
+        self.timeout = timeout
+        self._local = threading.local()
+
+    @staticmethod
+    def _key(key):
+        return hashlib.sha1(key.encode('utf-8')).hexdigest()
+
+    def _socket(self):
+        sock = getattr(self._local, 'sock', None)
+        if sock is None or self._local.pid != os.getpid():
+            sock = socket.create_connection(self.address, timeout=self.timeout)
+            self._local.sock = sock
+            self._local.pid = os.getpid()
+            self._local.buffer = b''
+        return sock
+
+    def _disconnect(self):
+        sock = getattr(self._local, 'sock', None)
+        self._local.sock = None
+        if sock is not None:
+            try:
+                sock.close()
+            except OSError:
+                pass
+
+    def _read_line(self, sock):
+        while b'\r\n' not in self._local.buffer:
+            self._read_more(sock)
+        line, _, self._local.buffer = self._local.buffer.partition(b'\r\n')
+        return line
+
+    def _read_exactly(self, sock, n):
+        while len(self._local.buffer) < n:
+            self._read_more(sock)
+        data, self._local.buffer = self._local.buffer[:n], self._local.buffer[n:]
+        return data
+
+    def _read_more(self, sock):
+        data = sock.recv(65536)
+        if not data:
+            raise ConnectionError('memcached closed the connection')
+        self._local.buffer += data
+
+    def _command(self, fn):
+        try:
+            return fn(self._socket())
+        except Exception:
+            # the connection may be part-way through a response, so it can't be reused
+            self._disconnect()
+            raise
+
+    def get(self, key):
+        """
+        :param key: a str key
+        :return: the bytes value, or None if the key isn't cached
+        """
+        def _get(sock):
+            sock.sendall(b'get ' + self._key(key).encode('ascii') + b'\r\n')
+            value = None
+            while True:
+                line = self._read_line(sock)
+                if line == b'END':
+                    return value
+                parts = line.split()
+                if parts[0] != b'VALUE':
+                    raise ConnectionError('unexpected memcached response {!r}'.format(line))
+                value = self._read_exactly(sock, int(parts[3]) + 2)[:-2]
+        return self._command(_get)
+
+    def set(self, key, value):
+        """
+        :param key: a str key
+        :param value: a bytes value
+        """
+        def _set(sock):
+            sock.sendall(b''.join([
+                'set {} 0 {} {}\r\n'.format(self._key(key), self.ttl, len(value)).encode('ascii'), value, b'\r\n'
+            ]))
+            line = self._read_line(sock)
+            if line != b'STORED':
+                # e.g. SERVER_ERROR object too large for cache, which is no reason to drop the connection
+                logger.debug("memcached didn't store {}: {!r}".format(key, line))
+        self._command(_set)
+
+    def clear(self):
+        def _flush(sock):
+            sock.sendall(b'flush_all\r\n')
+            self._read_line(sock)
+        self._command(_flush)
+
+
+def make_l2_cache(backend, location, ttl):
+    """
+    Makes a second-level cache, to be shared by worker processes, from config values
+
+    :param backend: 'sqlite', 'memcached' or None for no second-level cache
+    :param location: the sqlite database file or the memcached server's 'host:port'
+    :param ttl: seconds values are kept for
+    :return: a SqliteCache, MemcachedCache or None
+    """
+    if not backend:
+        return None
+    if backend == 'sqlite':
+        return SqliteCache(location, ttl)
+    if backend == 'memcached':
+        return MemcachedCache(location, ttl)
+    raise ValueError("Unknown second-level cache backend '{}'".format(backend))
+
+
+class SingleFlight(object):
+    """
+    Coalesces concurrent calls for the same key: the first caller runs the function & any others that arrive while it
+    runs wait for, & share, its result or exception rather than running it again.
+    """
+    class _Call(object):
+        def __init__(self):
+            self.done = threading.Event()
+            self.result = None
+            self.error = None
+
+    def __init__(self):
+        self._calls = {}
+        self._lock = threading.Lock()
+
+    def do(self, key, fn, timeout=None):
+        """
+        :param key: a hashable key identifying what fn computes
+        :param fn: a function of no arguments
+        :param timeout: seconds to wait for another caller's result before running fn anyway, or None to wait as long
+        as it takes
+        :return: fn's result, from this call or a concurrent one
+        """
+        with self._lock:
+            call = self._calls.get(key)
+            leading = call is None
+            if leading:
+                call = self._calls[key] = SingleFlight._Call()
+        if not leading:
+            if not call.done.wait(timeout):
+                logger.warning("Gave up waiting for {} after {}s".format(key, timeout))
+                return fn()
+            if call.error is not None:
+                raise call.error
+            return call.result
+        try:
+            call.result = fn()
+            return call.result
+        except Exception as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+            call.done.set()
+
+    def __len__(self):
+        return len(self._calls)
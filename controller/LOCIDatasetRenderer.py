@@ -1,9 +1,74 @@
+import logging
 import pyldapi
 import os
+from collections import defaultdict
 from flask import Response, render_template
 from rdflib import Graph
 import _config as config
 
+logger = logging.getLogger(__name__)
+
+STATIC_RDF_FILES = ['dcat.ttl', 'reg.ttl', 'void.ttl']
+
+
+def load_static_rdf():
+    """
+    Parses the static RDF files & serializes each of them into every RDF mimetype, once, so that they can be served
+    from memory. Turtle is served as written in the file.
+
+    :return: dict of Graphs keyed by file name & dict of serialized bytes keyed by (file name, mimetype)
+    """
+    graphs = {}
+    serializations = {}
+    for file in STATIC_RDF_FILES:
+        with open(os.path.join(config.APP_DIR, 'view', file), 'rb') as f:
+            ttl = f.read()
+        g = Graph().parse(data=ttl.decode('utf-8'), format='turtle')
+        graphs[file] = g
+        serializations[(file, 'text/turtle')] = ttl
+        for mimetype in pyldapi.Renderer.RDF_MIMETYPES:
+            if mimetype == 'text/turtle':
+                continue
+            try:
+                serializations[(file, mimetype)] = g.serialize(destination=None, format=mimetype, encoding='utf-8')
+            except Exception as e:
+                # left for each request to try, & fail, as it did before these were pre-serialized
+                logger.warning("Couldn't serialize {} as {}: {}".format(file, mimetype, e))
+    return graphs, serializations
+
+
+def find_subregisters(g):
+    """
+    Finds the Registers of a Register of Registers in the same way pyldapi.RegisterOfRegistersRenderer does, so that
+    this can be done once rather than for each request
+
+    :param g: the Register of Registers' Graph
+    :return: list of (URI, label) of its Registers & dict of sets of their contained item classes keyed by their URIs
+    """
+    q = '''
+        PREFIX rdfs: <http://www.w3.org/2000/01/rdf-schema#>
+        PREFIX reg: <http://purl.org/linked-data/registry#>
+        SELECT ?uri ?label ?rofr ?cic
+        WHERE {
+            ?uri a reg:Register ;
+            rdfs:label ?label ;
+            reg:containedItemClass ?cic .
+            ?rofr reg:subregister ?uri .
+        }
+        '''
+    register_items = []
+    subregister_cics = defaultdict(set)
+    for r in g.query(q):
+        if r['cic']:
+            subregister_cics[r['uri']].add(r['cic'])
+        if r['uri'] not in [uri for uri, label in register_items]:
+            register_items.append((r['uri'], r['label']))
+    return register_items, subregister_cics
+
+
+static_graphs, static_serializations = load_static_rdf()
+rofr_items, rofr_subregister_cics = find_subregisters(static_graphs['reg.ttl'])
+
 
 class LOCIDatasetRenderer(pyldapi.RegisterOfRegistersRenderer):
     """
@@ -39,8 +104,13 @@ class LOCIDatasetRenderer(pyldapi.RegisterOfRegistersRenderer):
         if url is None:
             url = request.url
 
-        reg_file_path = os.path.join(config.APP_DIR, 'view', 'reg.ttl')
-        super().__init__(request, url, label="RofR", comment="RofR", rofr_file_path=reg_file_path, views=views, default_view_token='dcat')
+        # skips RegisterOfRegistersRenderer's constructor, which would parse reg.ttl for every request, & uses the
+        # Registers found in it at startup instead
+        pyldapi.RegisterRenderer.__init__(self, request, url, "RofR", "RofR", None,
+                                          ['http://purl.org/linked-data/registry#Register'], 0,
+                                          views=views, default_view_token='dcat')
+        self.register_items = list(rofr_items)
+        self.subregister_cics = defaultdict(set, {uri: set(cics) for uri, cics in rofr_subregister_cics.items()})
 
         # replace automatically-calculated view & format with specifically set ones
         if view is not None:
@@ -70,15 +140,15 @@ class LOCIDatasetRenderer(pyldapi.RegisterOfRegistersRenderer):
                 return self._render_rdf_from_file('dcat.ttl', self.format)
 
     def _render_rdf_from_file(self, file, format):
-        if self.format == 'text/turtle':
-            txt = open(os.path.join(config.APP_DIR, 'view', file), 'rb').read().decode('utf-8')
-            return Response(txt, mimetype='text/turtle')
-        else:
-            g = Graph().parse(os.path.join(config.APP_DIR, 'view', file), format='turtle')
-            if format == "_internal":
-                return g
-            return Response(
-                g.serialize(destination=None, format=format, encoding='utf-8'),
-                mimetype=format
-            )
+        serialization = static_serializations.get((file, format))
+        if serialization is not None:
+            return Response(serialization, mimetype=format)
+        g = Graph()
+        g += static_graphs[file]  # a copy, so the shared Graph can't be changed
+        if format == "_internal":
+            return g
+        return Response(
+            g.serialize(destination=None, format=format, encoding='utf-8'),
+            mimetype=format
+        )
 
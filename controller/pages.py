@@ -2,18 +2,49 @@
 """
 This file contains all the HTTP routes for basic pages (usually HTML)
 """
+import logging
 from flask import Blueprint, Response, request, render_template
 import pyldapi
-import json
 from rdflib import Graph
 import io
 import requests
+from requests.adapters import HTTPAdapter
 import _config as config
 import os
 import controller.LOCIDatasetRenderer
+from controller.sparql import normalise_sparql_query
+from cache import LRUCache
+
+logger = logging.getLogger(__name__)
 
 pages = Blueprint('routes', __name__)
 
+# serialized SPARQL service descriptions, keyed by (format, base URL). The base URL comes from the request's Host so
+# this is bounded by size.
+service_descriptions = LRUCache(max_bytes=1024 * 1024, ttl=float('inf'))
+
+# seconds to wait for the triplestore to accept a connection & then between each part of its response
+SPARQL_CONNECT_TIMEOUT = getattr(config, 'SPARQL_CONNECT_TIMEOUT', 5)
+SPARQL_READ_TIMEOUT = getattr(config, 'SPARQL_READ_TIMEOUT', 30)
+# the most keep-alive connections to the triplestore each process keeps open
+SPARQL_POOL_SIZE = getattr(config, 'SPARQL_POOL_SIZE', 10)
+SPARQL_STREAM_CHUNK_SIZE = 64 * 1024
+
+# SPARQL results as (body, Content-Type), keyed by (normalised query, result mimetype). Results bigger than
+# SPARQL_CACHE_MAX_RESULT_BYTES are streamed but not cached.
+sparql_results = LRUCache(
+    max_bytes=getattr(config, 'SPARQL_CACHE_MAX_BYTES', 64 * 1024 * 1024),
+    ttl=getattr(config, 'SPARQL_CACHE_TTL', 60 * 60)
+)
+SPARQL_CACHE_MAX_RESULT_BYTES = getattr(config, 'SPARQL_CACHE_MAX_RESULT_BYTES', 1024 * 1024)
+
+
+def sparql_cache_bypassed():
+    """True if the request asks for a fresh SPARQL result, with Cache-Control or Pragma no-cache"""
+    cache_control = request.headers.get('Cache-Control', '').lower()
+    return 'no-cache' in cache_control or 'no-store' in cache_control \
+        or 'no-cache' in request.headers.get('Pragma', '').lower()
+
 
 @pages.route('/', strict_slashes=True)
 def home():
@@ -103,8 +134,18 @@ def sparql():
             else:
                 format_mimetype = request.form.get('graphContentType')
 
-            print(format_mimetype)
-            query_result = sparql_query(query, format_mimetype=format_mimetype)
+            # respond to a form or with a raw result
+            if 'form' in request.values and request.values['form'].lower() == 'true':
+                query_result = sparql_query(query, format_mimetype=format_mimetype,
+                                            cached=not sparql_cache_bypassed())
+                return render_template(
+                    'page_sparql.html',
+                    query=query,
+                    query_result=query_result
+                )
+            else:
+                return sparql_query_response(query, format_mimetype=format_mimetype,
+                                             cached=not sparql_cache_bypassed())
         except ValueError as e:
             return render_template(
                 'page_sparql.html',
@@ -113,20 +154,6 @@ def sparql():
             ), 400
         except ConnectionError as e:
             return Response(str(e), status=500)
-
-        # if query_result and 'results' in query_result:
-        #     query_result = json.dumps(json.loads(query_result)['results']['bindings'])
-
-        # respond to a form or with a raw result
-        if 'form' in request.values and request.values['form'].lower() == 'true':
-            return render_template(
-                'page_sparql.html',
-                query=query,
-                query_result=query_result
-            )
-        else:
-            return query_result
-            # return Response(json.dumps(query_result), status=200, mimetype=request.values['output-format'])
     # No query, display form
     else:  # GET
         if request.args.get('query') is not None:
@@ -151,8 +178,10 @@ def sparql():
             #         status=400,
             #         mimetype="text/plain")
             query = request.args.get('query')
-            query_result = sparql_query(query)
-            return Response(json.dumps(query_result), status=200, mimetype="application/sparql-results+json")
+            try:
+                return sparql_query_response(query, cached=not sparql_cache_bypassed())
+            except ConnectionError as e:
+                return Response(str(e), status=500)
         else:
             # SPARQL Service Description
             '''
@@ -202,11 +231,21 @@ def sparql():
 
 
 def get_sparql_service_description(format, base_url):
-    """Return an RDF description of PROMS' read only SPARQL endpoint in a requested format
+    """Return an RDF description of PROMS' read only SPARQL endpoint in a requested format, made once per base URL
 
     :param mimetype: 'turtle', 'n3', 'xml', 'json-ld'
     :return: string of RDF in the requested format
     """
+    key = (format, base_url)
+    cached = service_descriptions.get(key)
+    if cached is not None:
+        return cached[0]
+    description = _make_sparql_service_description(format, base_url)
+    service_descriptions.set(key, description, len(description))
+    return description
+
+
+def _make_sparql_service_description(format, base_url):
     sd_ttl = '''\
 @prefix rdf:    <http://www.w3.org/1999/02/22-rdf-syntax-ns#> .
 @prefix sd:     <http://www.w3.org/ns/sparql-service-description#> .
@@ -243,18 +282,115 @@ def get_sparql_service_description(format, base_url):
         raise ValueError('Input parameter rdf_format must be one of: ' + ', '.join(rdf_mimetypes_map.values()))
 
 
-def sparql_query(sparql_query, format_mimetype='application/sparql-results+json'):
-    """ Make a SPARQL query"""
-    auth = (config.SPARQL_AUTH_USR, config.SPARQL_AUTH_PWD)
+_sparql_session = None
+_sparql_session_pid = None
+
+
+def get_sparql_session():
+    """
+    Gets this process's session with the triplestore, which keeps its connections to it alive between queries
+
+    :return: a requests.Session
+    """
+    global _sparql_session, _sparql_session_pid
+    if _sparql_session is None or _sparql_session_pid != os.getpid():
+        # a forked worker mustn't share its parent's sockets
+        session = requests.Session()
+        session.auth = (config.SPARQL_AUTH_USR, config.SPARQL_AUTH_PWD)
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=SPARQL_POOL_SIZE)
+        session.mount('http://', adapter)
+        session.mount('https://', adapter)
+        _sparql_session = session
+        _sparql_session_pid = os.getpid()
+    return _sparql_session
+
+
+def post_sparql_query(sparql_query, format_mimetype='application/sparql-results+json'):
+    """
+    Sends a SPARQL query to the triplestore without waiting for its result
+
+    :param sparql_query: the query
+    :param format_mimetype: the mimetype to ask for the result in
+    :return: the triplestore's requests.Response, whose body is yet to be read. It must be closed.
+    """
     data = {'query': sparql_query}
     headers = {
         'Content-Type': 'application/x-www-form-urlencoded',
         'Accept': format_mimetype
     }
     try:
-        r = requests.post(config.SPARQL_QUERY_URI, auth=auth, data=data, headers=headers, timeout=30)
-        import pprint
-        pprint.pprint(r.headers)
-        return r.content.decode('utf-8')
-    except Exception as e:
-        raise e
+        return get_sparql_session().post(config.SPARQL_QUERY_URI, data=data, headers=headers, stream=True,
+                                         timeout=(SPARQL_CONNECT_TIMEOUT, SPARQL_READ_TIMEOUT))
+    except requests.RequestException as e:
+        raise ConnectionError("Couldn't query the SPARQL endpoint: {}".format(e))
+
+
+def sparql_result_key(sparql_query, format_mimetype):
+    if isinstance(sparql_query, bytes):
+        sparql_query = sparql_query.decode('utf-8', 'replace')
+    return normalise_sparql_query(sparql_query), format_mimetype
+
+
+def sparql_query(sparql_query, format_mimetype='application/sparql-results+json', cached=True):
+    """ Make a SPARQL query, or get its result from the cache if cached is True"""
+    key = sparql_result_key(sparql_query, format_mimetype)
+    hit = sparql_results.get(key) if cached else None
+    if hit is not None:
+        (body, content_type), is_fresh = hit
+        return body.decode('utf-8')
+    r = post_sparql_query(sparql_query, format_mimetype=format_mimetype)
+    try:
+        body = r.content
+    except requests.RequestException as e:
+        raise ConnectionError("Couldn't read the SPARQL endpoint's result: {}".format(e))
+    finally:
+        r.close()
+    if r.status_code == 200 and len(body) <= SPARQL_CACHE_MAX_RESULT_BYTES:
+        sparql_results.set(key, (body, r.headers.get('Content-Type', format_mimetype)), len(body))
+    return body.decode('utf-8')
+
+
+def sparql_query_response(sparql_query, format_mimetype='application/sparql-results+json', cached=True):
+    """
+    Makes a SPARQL query & passes its result on as it arrives, as bytes, without holding it all in memory.
+
+    The triplestore's connection is closed when the result has been sent or as soon as the client disconnects, which
+    stops the triplestore sending the rest of it. Whole, successful results that aren't too big are cached.
+
+    :param cached: True to send a cached result if there is one, else False to always query the triplestore
+    :return: a streamed Response with the triplestore's status & Content-Type, or a Response of the cached result
+    """
+    key = sparql_result_key(sparql_query, format_mimetype)
+    hit = sparql_results.get(key) if cached else None
+    if hit is not None:
+        (body, content_type), is_fresh = hit
+        return Response(body, status=200, content_type=content_type, headers={'X-Cache': 'HIT'})
+    r = post_sparql_query(sparql_query, format_mimetype=format_mimetype)
+    content_type = r.headers.get('Content-Type', format_mimetype)
+
+    def generate():
+        # kept as it streams, to be cached once it's all sent, unless it's too big
+        chunks = [] if r.status_code == 200 else None
+        size = 0
+        complete = False
+        try:
+            for chunk in r.iter_content(SPARQL_STREAM_CHUNK_SIZE):
+                if chunks is not None:
+                    size += len(chunk)
+                    if size <= SPARQL_CACHE_MAX_RESULT_BYTES:
+                        chunks.append(chunk)
+                    else:
+                        chunks = None
+                yield chunk
+            complete = True
+        except requests.RequestException as e:
+            # too late to change the status, so the client gets a truncated result
+            logger.warning("SPARQL result stream broken: {}".format(e))
+        finally:
+            r.close()
+        if complete and chunks is not None:
+            sparql_results.set(key, (b''.join(chunks), content_type), size)
+
+    response = Response(generate(), status=r.status_code, content_type=content_type, headers={'X-Cache': 'MISS'})
+    response.call_on_close(r.close)
+    return response
@@ -0,0 +1,67 @@
+# -*- coding: utf-8 -*-
+"""
+Normalisation of SPARQL query text, so that queries which differ only in layout, comments or the order of their PREFIX
+declarations are recognised as the same query, e.g. for caching their results
+"""
+import re
+
+_TOKENS = re.compile(r'''
+    (?P<string>"""(?:[^"\\]|\\.|"(?!""))*"""|\'\'\'(?:[^'\\]|\\.|'(?!''))*\'\'\'|"(?:[^"\\\n]|\\.)*"|'(?:[^'\\\n]|\\.)*')
+  | (?P<iri><[^<>"{}|^`\\\s]*>)
+  | (?P<comment>\#[^\n]*)
+  | (?P<space>\s+)
+  | (?P<other>[^"'<#\s]+|[<"'])
+''', re.VERBOSE)
+
+_PREFIX = re.compile(r'^PREFIX\s*([A-Za-z][\w.-]*)?:\s*(<[^>]*>)\s*', re.IGNORECASE)
+
+# whitespace either side of these doesn't change a query's meaning. '.' isn't one, as it's also a decimal point.
+_PUNCTUATION = '{}(),;'
+
+
+def _tokens(text):
+    """
+    Splits query text into (kind, text) tokens: string, iri, comment, space or other
+    """
+    return [(m.lastgroup, m.group()) for m in _TOKENS.finditer(text)]
+
+
+def _normalise_layout(tokens):
+    """Drops comments & reduces whitespace to single spaces, only where it's needed, outside strings & IRIs"""
+    parts = []
+    pending_space = False
+    for kind, text in tokens:
+        if kind in ('space', 'comment'):
+            pending_space = True
+            continue
+        if pending_space and parts and parts[-1][-1] not in _PUNCTUATION and text[0] not in _PUNCTUATION:
+            parts.append(' ')
+        pending_space = False
+        parts.append(text)
+    return ''.join(parts)
+
+
+def normalise_sparql_query(query):
+    """
+    Normalises a SPARQL query's text. Comments are dropped and whitespace outside strings & IRIs is reduced to what's
+    needed. Its PREFIX declarations are sorted & repeated ones dropped. Unused ones are kept, as CONSTRUCT & DESCRIBE
+    results serialised as Turtle or RDF/XML declare the query's prefixes too.
+
+    :param query: the query text
+    :return: the normalised text, which is for comparing queries rather than running them
+    """
+    text = _normalise_layout(_tokens(query))
+
+    # the prologue's PREFIX declarations, which are left as they are if there's a BASE, as they could depend on it
+    prefixes = {}
+    body = text
+    while True:
+        m = _PREFIX.match(body)
+        if m is None:
+            break
+        prefixes[m.group(1) or ''] = m.group(2)
+        body = body[m.end():]
+    if not prefixes or re.match(r'BASE\b', body, re.IGNORECASE):
+        return text
+
+    return ' '.join(['PREFIX {}: {}'.format(p, prefixes[p]) for p in sorted(prefixes)] + [body])
@@ -1,47 +1,337 @@
+import logging
 import os
-from collections import defaultdict
-from psycopg2 import pool
+import re
+import time
+from collections import defaultdict, deque, namedtuple
+import psycopg2
+from psycopg2 import pool, sql, extensions, extras
 from contextlib import contextmanager
+from operator import itemgetter
+from flask import g, has_request_context
 from psycopg2.pool import PoolError
-from threading import Lock
+from threading import Lock, Condition
 
+import _config
 from _config import DB_HOST, DB_PORT, DB_DBNAME, DB_USR, DB_PWD
 
-class ThrottledConnectionPool(pool.ThreadedConnectionPool):
-    def __init__(self, *args, seconds=1, retries=4, **kwargs):
-        super(ThrottledConnectionPool, self).__init__(*args, **kwargs)
-        self.seconds = seconds
-        self.retries = retries
-
-    def getconn(self, key=None):
-        sleep_time = int(self.seconds)
-        for r1 in range(int(self.retries)):
-            for r2 in range(int(self.retries)):
-                try:
-                    con = super(ThrottledConnectionPool, self).getconn(key)
-                    return con
-                except PoolError as pe:
-                    pe_args = pe.args
-                    if len(pe_args) > 0 and "exhausted" in pe_args[0]:
-                        import time
-                        print("Throttling pg connections {} second/s".format(str(sleep_time)))
-                        time.sleep(sleep_time)
-                    else:
-                        raise pe
-                except Exception as e:
-                    raise e
-            print("Throttling Harder {} of {}.".format(r1+1, self.retries))
-            sleep_time = sleep_time * 2
-        raise RuntimeError("Still cannot get pg connection even after throttling.")
+
+logger = logging.getLogger(__name__)
+
+POOL_MINCONN = getattr(_config, 'DB_POOL_MINCONN', 4)
+POOL_MAXCONN = getattr(_config, 'DB_POOL_MAXCONN', 24)
+# seconds a request waits for a connection before giving up
+POOL_TIMEOUT = getattr(_config, 'DB_POOL_TIMEOUT', 30)
+# connections idle in the pool for longer than this many seconds are checked before they are handed out
+POOL_MAX_IDLE = getattr(_config, 'DB_POOL_MAX_IDLE', 300)
+# seconds a replica whose connections failed is skipped for
+REPLICA_RETRY_AFTER = getattr(_config, 'DB_REPLICA_RETRY_AFTER', 30)
+
+
+class FairConnectionPool(pool.ThreadedConnectionPool):
+    """
+    A connection pool that, when exhausted, queues the threads waiting for a connection and hands connections out in
+    the order they were asked for, as soon as they are put back. A thread waits at most timeout seconds.
+
+    Connections that have been idle in the pool for more than max_idle seconds are checked with a trivial query
+    before they are handed out, and replaced if they have gone stale, e.g. been closed by the server.
+
+    New connections are made outside the pool's lock, in a slot reserved for them, so other threads can get & put back
+    connections while one connects.
+    """
+    def __init__(self, minconn, maxconn, *args, timeout=POOL_TIMEOUT, max_idle=POOL_MAX_IDLE, **kwargs):
+        super(FairConnectionPool, self).__init__(minconn, maxconn, *args, **kwargs)
+        self.timeout = timeout
+        self.max_idle = max_idle
+        self._available = Condition(self._lock)
+        self._waiters = deque()
+        self._idle_since = {}
+        # slots reserved for connections being made
+        self._connecting = 0
+
+    def _can_get(self):
+        return len(self._pool) > 0 or len(self._used) + self._connecting < self.maxconn
+
+    def getconn(self, key=None, timeout=None):
+        timeout = self.timeout if timeout is None else timeout
+        deadline = time.monotonic() + timeout
+        while True:
+            con, con_key = self._getconn_fifo(key, deadline)
+            if con is None:
+                return self._connect_reserved(con_key)
+            if self._is_fresh(con):
+                return con
+            logger.warning("Replacing a stale DB connection.")
+            self.putconn(con, key, close=True)
+
+    def _take(self, key):
+        """
+        Takes a pooled connection or, if there are none, reserves a slot for a new one. Called with the lock held.
+
+        :return: (the connection, or None if a slot was reserved, its key)
+        """
+        if self.closed:
+            raise PoolError("connection pool is closed")
+        if key is None:
+            key = self._getkey()
+        if key in self._used:
+            return self._used[key], key
+        if self._pool:
+            self._used[key] = con = self._pool.pop()
+            self._rused[id(con)] = key
+            return con, key
+        self._connecting += 1
+        return None, key
+
+    def _connect_reserved(self, key):
+        """Makes a new connection in a slot reserved by _take(), without holding the lock while it connects"""
+        try:
+            con = psycopg2.connect(*self._args, **self._kwargs)
+        except Exception:
+            with self._available:
+                self._connecting -= 1
+                self._available.notify_all()
+            raise
+        with self._available:
+            self._connecting -= 1
+            if self.closed:
+                con.close()
+                self._available.notify_all()
+                raise PoolError("connection pool is closed")
+            self._used[key] = con
+            self._rused[id(con)] = key
+        return con
+
+    def _getconn_fifo(self, key, deadline):
+        """:return: as per _take()"""
+        with self._available:
+            if self.closed:
+                raise PoolError("connection pool is closed")
+            if not self._waiters and self._can_get():
+                return self._take(key)
+            waiter = object()
+            self._waiters.append(waiter)
+            try:
+                while self._waiters[0] is not waiter or not self._can_get():
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        raise PoolError("timed out waiting for a connection from the pool")
+                    self._available.wait(remaining)
+                    if self.closed:
+                        raise PoolError("connection pool is closed")
+                return self._take(key)
+            finally:
+                self._waiters.remove(waiter)
+                # the next waiter may be able to get a connection too
+                self._available.notify_all()
+
+    def _is_fresh(self, con):
+        if con.closed:
+            return False
+        idle_since = self._idle_since.pop(id(con), None)
+        if idle_since is None or time.monotonic() - idle_since < self.max_idle:
+            return True
+        try:
+            with con.cursor() as cursor:
+                cursor.execute('SELECT 1')
+            con.rollback()
+            return True
+        except Exception as e:
+            logger.warning("DB connection failed its check: {}".format(e))
+            return False
+
+    def putconn(self, conn, key=None, close=False):
+        with self._available:
+            self._idle_since[id(conn)] = time.monotonic()
+            self._putconn(conn, key, close)
+            if conn.closed:
+                self._idle_since.pop(id(conn), None)
+            self._available.notify_all()
+
+    def closeall(self):
+        with self._available:
+            self._closeall()
+            self._idle_since.clear()
+            self._available.notify_all()
+
+
+row_classes = {}
+
+
+def row_class(columns):
+    """
+    Gets the row class for a tuple of column names, making it the first time those columns are seen. Rows are
+    namedtuples so their values are read by attribute, like reg's, or by index.
+    """
+    try:
+        return row_classes[columns]
+    except KeyError:
+        pass
+    cls = namedtuple('Row', columns, rename=True)
+    # as with reg, a value is read by its column's name & the last of columns with the same name wins. namedtuple gives
+    # duplicates & names that aren't identifiers positional names, so those are read by properties instead.
+    last = {name: i for i, name in enumerate(columns)}
+    renamed = {name: property(itemgetter(i)) for name, i in last.items() if cls._fields[i] != name}
+    if renamed:
+        renamed['__slots__'] = ()
+        cls = type('Row', (cls,), renamed)
+    row_classes[columns] = cls
+    return cls
+
+
+class RowCursor(extras.NamedTupleCursor):
+    """A cursor whose rows are instances of the row class for its result's columns"""
+    def _make_nt(self):
+        return row_class(tuple(d[0] for d in self.description))
+
+
+# numeric values, such as latitudes & longitudes, are read as floats rather than Decimals
+NUMERIC_AS_FLOAT = extensions.new_type(
+    extensions.DECIMAL.values, 'NUMERIC_AS_FLOAT', lambda value, cursor: float(value) if value is not None else None)
+
+
+class PreparingConnection(extensions.connection):
+    """
+    A connection that remembers which of the registered statements have been prepared on it. Its cursors are
+    RowCursors and it reads numerics as floats.
+    """
+    def __init__(self, *args, **kwargs):
+        super(PreparingConnection, self).__init__(*args, **kwargs)
+        self.prepared_statements = set()
+        self.cursor_factory = RowCursor
+        extensions.register_type(NUMERIC_AS_FLOAT, self)
 
 
 connect_str = "host='{}' port='{}' dbname='{}' user='{}' password='{}'" \
     .format(DB_HOST, DB_PORT, DB_DBNAME, DB_USR, DB_PWD)
+# DSNs of read replicas to spread queries across, else just the one DB_HOST
+replica_dsns = getattr(_config, 'DB_REPLICA_DSNS', None) or [connect_str]
+
+
+class ReplicaRouter(object):
+    """
+    Keeps a FairConnectionPool per replica DSN and hands out connections from the healthy replica with the fewest
+    outstanding connections, i.e. connections handed out or being waited for. A replica is marked unhealthy for
+    retry_after seconds when connecting to it fails or one of its connections is put back broken. If all replicas are
+    unhealthy, they are tried anyway, in the order they were marked. A replica whose pool times out is busy rather than
+    unhealthy, and the next is tried.
+
+    It has the getconn() & putconn() of a single pool, so it is used as the process' connection pool.
+    """
+    def __init__(self, dsns, minconn, maxconn, retry_after=REPLICA_RETRY_AFTER, **kwargs):
+        self.dsns = list(dsns)
+        self.minconn = minconn
+        self.maxconn = maxconn
+        self.retry_after = retry_after
+        self.pool_kwargs = kwargs
+        self.closed = False
+        self._pools = [None] * len(self.dsns)
+        self._outstanding = [0] * len(self.dsns)
+        self._unhealthy_until = [0] * len(self.dsns)
+        self._replica_of = {}
+        self._lock = Lock()
+
+    def _get_pool(self, i):
+        with self._lock:
+            replica_pool = self._pools[i]
+        if replica_pool is not None:
+            return replica_pool
+        # connects minconn times, so raises if the replica is down. It's made outside the lock, so a slow replica
+        # doesn't hold up getting connections from the others.
+        new_pool = FairConnectionPool(self.minconn, self.maxconn, dsn=self.dsns[i], **self.pool_kwargs)
+        with self._lock:
+            if self._pools[i] is None:
+                self._pools[i] = new_pool
+                return new_pool
+            replica_pool = self._pools[i]
+        # another thread made one first
+        new_pool.closeall()
+        return replica_pool
+
+    def _mark_unhealthy(self, i, reason):
+        logger.warning("Marking DB replica {} unhealthy for {}s: {}".format(i, self.retry_after, reason))
+        with self._lock:
+            self._unhealthy_until[i] = time.monotonic() + self.retry_after
+
+    def _replicas_in_order(self):
+        with self._lock:
+            now = time.monotonic()
+            healthy = [i for i in range(len(self.dsns)) if self._unhealthy_until[i] <= now]
+            if healthy:
+                return sorted(healthy, key=lambda i: self._outstanding[i])
+            return sorted(range(len(self.dsns)), key=lambda i: self._unhealthy_until[i])
+
+    def replica_pools(self):
+        """The pools of the healthy replicas, creating them if need be"""
+        pools = []
+        for i in self._replicas_in_order():
+            try:
+                pools.append(self._get_pool(i))
+            except psycopg2.OperationalError as e:
+                self._mark_unhealthy(i, e)
+        return pools
+
+    def getconn(self, key=None, timeout=None):
+        if self.closed:
+            raise PoolError("connection pool is closed")
+        last_error = None
+        tried = set()
+        while True:
+            # the replica with the fewest outstanding connections of those not yet tried
+            untried = [i for i in self._replicas_in_order() if i not in tried]
+            if not untried:
+                raise last_error
+            i = untried[0]
+            tried.add(i)
+            with self._lock:
+                self._outstanding[i] += 1
+            try:
+                con = self._get_pool(i).getconn(key, timeout=timeout)
+            except psycopg2.OperationalError as e:
+                with self._lock:
+                    self._outstanding[i] -= 1
+                self._mark_unhealthy(i, e)
+                last_error = e
+                continue
+            except PoolError as e:
+                # timed out waiting for one of its connections, so it's busy rather than unhealthy
+                with self._lock:
+                    self._outstanding[i] -= 1
+                last_error = e
+                continue
+            except Exception:
+                with self._lock:
+                    self._outstanding[i] -= 1
+                raise
+            with self._lock:
+                self._replica_of[id(con)] = i
+            return con
+
+    def putconn(self, conn, key=None, close=False):
+        with self._lock:
+            i = self._replica_of.pop(id(conn))
+            self._outstanding[i] -= 1
+        # closed == 2 means the connection was closed by an error rather than by close()
+        if conn.closed == 2:
+            self._mark_unhealthy(i, "connection broken")
+        self._pools[i].putconn(conn, key, close)
+
+    def closeall(self):
+        self.closed = True
+        for p in self._pools:
+            if p is not None:
+                p.closeall()
+
 
 per_process_pools = {}
 per_process_mutexes = {}
 
-def get_process_connection_pool():
+def get_process_connection_pool(minconn=POOL_MINCONN, maxconn=POOL_MAXCONN):
+    """
+    Gets this process' connection pool, creating it on first use
+
+    :param minconn: connections kept open per replica, if the pool is created by this call
+    :param maxconn: connections allowed per replica, if the pool is created by this call
+    """
     pid = os.getpid()
     if pid in per_process_pools:
         return per_process_pools[pid]
@@ -57,28 +347,31 @@ def get_process_connection_pool():
             # the pool while we were waiting.
             if pid in per_process_pools:
                 return per_process_pools[pid]
-            print("Attempting to create a new DB connection pool for PID {}".format(pid))
-            con_pool = ThrottledConnectionPool(minconn=4, maxconn=24, dsn=connect_str)
+            logger.info("Attempting to create a new DB connection pool for PID {}".format(pid))
+            con_pool = ReplicaRouter(replica_dsns, minconn, maxconn,
+                                     connection_factory=PreparingConnection)
         except Exception as e:
-            print("Can't connect to DB {}".format(DB_DBNAME))
-            print(e)
+            logger.error("Can't connect to DB {}: {}".format(DB_DBNAME, e))
             raise e
         finally:
             m.release()
         per_process_pools[pid] = con_pool
-        print("Got it.")
+        logger.info("Got it.")
         return con_pool
 
 
 @contextmanager
-def get_db_connection():
+def get_db_connection(timeout=None):
+    """
+    :param timeout: seconds to wait for a connection if the pool is exhausted, the pool's timeout if None
+    """
     con = None
     con_pool = get_process_connection_pool()
     try:
         try:
-            con = con_pool.getconn()
+            con = con_pool.getconn(timeout=timeout)
         except Exception as e:
-            print("Can't get a db connection from the connection pool.".format(DB_DBNAME))
+            logger.error("Can't get a db connection from the connection pool: {}".format(e))
             raise e
         yield con
     finally:
@@ -88,16 +381,20 @@ def get_db_connection():
 cursor_pools = defaultdict(list)
 
 @contextmanager
-def get_db_cursor(con=None):
+def get_db_cursor(con=None, timeout=None):
+    """
+    :param con: the connection to get a cursor on, else one is got from the pool & put back afterwards
+    :param timeout: seconds to wait for a connection if the pool is exhausted, the pool's timeout if None
+    """
     put_con = False
     con_pool = None
     if con is None:
         con_pool = get_process_connection_pool()
         try:
-            con = con_pool.getconn()
+            con = con_pool.getconn(timeout=timeout)
             put_con = True
         except Exception as e:
-            print("Can't get a db cursor from the cursor pool.")
+            logger.error("Can't get a db cursor from the cursor pool: {}".format(e))
             raise e
 
     con_id = id(con)
@@ -106,12 +403,16 @@ def get_db_cursor(con=None):
     try:
         try:
             cur = cursor_pool.pop(0)
+            # a replaced connection's id may be reused, so only reuse cursors of this very connection
+            if cur.closed or cur.connection is not con:
+                cursor_pool[:] = []
+                raise IndexError()
         except IndexError:
             try:
                 cur = con.cursor()
             except Exception as e:
-                print("Can't get a cursor from the connection.")
-                print(e)
+                logger.error("Can't get a cursor from the connection: {}".format(e))
+                cur = None
         yield cur
     finally:
         if cur is not None:
@@ -119,8 +420,149 @@ def get_db_cursor(con=None):
         if put_con and con_pool:
             con_pool.putconn(con)
 
+def get_request_cursor():
+    """
+    Gets the cursor shared by all the models & lookups of the current Flask request, so that a request holds only one
+    pooled connection. The connection is got on first use and put back when the request is torn down, see init_app().
+
+    :return: the request's cursor, or None if not handling a request
+    """
+    if not has_request_context():
+        return None
+    if 'db_cursor' not in g:
+        cursor_context_manager = get_db_cursor()
+        g.db_cursor = cursor_context_manager.__enter__()
+        g.db_cursor_context_manager = cursor_context_manager
+    return g.db_cursor
+
+
+@contextmanager
+def get_shared_cursor():
+    """Like get_db_cursor() but, when handling a request, yields the request's cursor which is kept for the request"""
+    cursor = get_request_cursor()
+    if cursor is not None:
+        yield cursor
+    else:
+        with get_db_cursor() as cursor:
+            yield cursor
+
+
+def close_request_cursor(exception=None):
+    """Puts the request's cursor & its connection back in the pool, if the request used one"""
+    g.pop('db_cursor', None)
+    cursor_context_manager = g.pop('db_cursor_context_manager', None)
+    if cursor_context_manager is not None:
+        cursor_context_manager.__exit__(None, None, None)
+
+
+def init_app(app):
+    """Puts each request's cursor back when the request is torn down"""
+    app.teardown_appcontext(close_request_cursor)
 
-class reg(object):
-    def __init__(self, cursor, row):
-        for (attr, val) in zip((d[0] for d in cursor.description), row):
-            setattr(self, attr, val)
+
+statements = {}
+
+
+def register_statement(name, statement, arg_types):
+    """
+    Registers a named, parameterised statement. It is prepared on each pooled connection the first time it is executed
+    on that connection, and so is parsed & planned once per connection rather than once per execution.
+
+    :param name: the name of the prepared statement, unique within the process
+    :param statement: a psycopg2 sql Composable with one sql.Placeholder() per argument, in argument order
+    :param arg_types: a list of the Postgres types of the arguments, e.g. ['text']
+    """
+    statements[name] = (statement, tuple(arg_types))
+
+
+def prepare_statement(cursor, name):
+    """
+    Prepares a registered statement on the cursor's connection
+
+    :param cursor: a cursor of a pooled connection
+    :param name: the name the statement was registered with
+    """
+    statement, arg_types = statements[name]
+    # PREPARE takes $n parameters rather than psycopg2's %s placeholders
+    n = iter(range(1, len(arg_types) + 1))
+    query = re.sub(r'%s', lambda m: '${}'.format(next(n)), statement.as_string(cursor))
+    cursor.execute(
+        sql.SQL('PREPARE {name} ({arg_types}) AS ').format(
+            name=sql.Identifier(name),
+            arg_types=sql.SQL(', ').join(sql.SQL(t) for t in arg_types)
+        ) + sql.SQL(query)
+    )
+    cursor.connection.prepared_statements.add(name)
+
+
+def execute_prepared(cursor, name, args):
+    """
+    Executes a registered statement on the cursor, preparing it on the cursor's connection first if needed
+
+    :param cursor: the cursor to execute on
+    :param name: the name the statement was registered with
+    :param args: a sequence of the statement's arguments
+    """
+    statement, arg_types = statements[name]
+    con = cursor.connection
+    prepared = getattr(con, 'prepared_statements', None)
+    if prepared is None:
+        # not a connection from the pool so nowhere to remember the preparation, just execute the statement
+        cursor.execute(statement, args)
+        return
+    if name not in prepared:
+        prepare_statement(cursor, name)
+    cursor.execute(
+        sql.SQL('EXECUTE {name} ({args})').format(
+            name=sql.Identifier(name),
+            args=sql.SQL(', ').join(sql.Placeholder() for _ in arg_types)
+        ),
+        args
+    )
+
+
+def reg(cursor, row):
+    """
+    Gives attribute access to the values of a row. Rows from RowCursors already have it so are returned as they are,
+    other rows are made into an instance of the row class for the cursor's columns.
+    """
+    if hasattr(row, '_fields'):
+        return row
+    return row_class(tuple(d[0] for d in cursor.description))(*row)
+
+
+def warm_up():
+    """
+    Creates this process' connection pools, opens their minimum number of connections, checks them & prepares all the
+    registered statements on them, then loads the codes.* tables, so that a worker's first requests don't pay for it.
+    Call it once per process after forking, e.g. from uwsgi's postfork hook, and after the models have been imported so
+    their statements are registered. Failures are logged, not raised: connections are then made, & the codes loaded,
+    on demand as usual.
+    """
+    try:
+        warmed = 0
+        for con_pool in get_process_connection_pool().replica_pools():
+            cons = []
+            try:
+                for _ in range(con_pool.minconn):
+                    cons.append(con_pool.getconn())
+                for con in cons:
+                    with con.cursor() as cursor:
+                        cursor.execute('SELECT 1')
+                        for name in statements:
+                            if name not in con.prepared_statements:
+                                prepare_statement(cursor, name)
+                    con.rollback()
+            finally:
+                for con in cons:
+                    con_pool.putconn(con)
+            warmed += len(cons)
+        logger.info("Warmed up {} DB connections for PID {}".format(warmed, os.getpid()))
+    except Exception as e:
+        logger.error("Couldn't warm up the DB connection pool: {}".format(e))
+    try:
+        # imported here as model.codes imports this module
+        from model.codes import load_codes
+        load_codes()
+    except Exception as e:
+        logger.error("Couldn't load the codes tables: {}".format(e))
@@ -1,17 +1,53 @@
+import itertools
+import json
 import logging
 
 from psycopg2 import sql
 
 import _config as config
-from db import get_db_cursor, reg
+from db import get_db_connection, get_db_cursor, get_process_connection_pool
 import model.address
 import model.locality
+import multiprocessing
+import os
+import sys
 import threading
 from queue import Queue
 
 from model import NotFoundError
+from nt_writer import NTriplesWriter
 
 dbschema=sql.Identifier(config.DB_SCHEMA)
+LOAD_CHUNK_SIZE = 1000
+# rows of the Address export query fetched per round trip
+EXPORT_ITERSIZE = 10000
+# Addresses per range of Addresses each worker process exports
+ADDRESS_RANGE_SIZE = 100000
+# the output files: instances & bytes per file at most, compression (None, 'gzip' or 'zstd') & where it's done (None
+# as it's written, 'thread' or 'process'), see nt_writer.NTriplesWriter
+EXPORT_FILE_MAX_RECORDS = getattr(config, 'EXPORT_FILE_MAX_RECORDS', 100000)
+EXPORT_FILE_MAX_BYTES = getattr(config, 'EXPORT_FILE_MAX_BYTES', None)
+EXPORT_COMPRESSION = getattr(config, 'EXPORT_COMPRESSION', None)
+EXPORT_COMPRESS_IN = getattr(config, 'EXPORT_COMPRESS_IN', None)
+# worker processes exporting Addresses in parallel
+EXPORT_PROCESSES = getattr(config, 'EXPORT_PROCESSES', os.cpu_count())
+
+def make_writer(data_file_stem, data_file_count=1):
+    """An NTriplesWriter of files data_file_stem0001.nt etc., as configured by the EXPORT_ settings"""
+    return NTriplesWriter(data_file_stem, first_number=data_file_count, max_records=EXPORT_FILE_MAX_RECORDS,
+                          max_bytes=EXPORT_FILE_MAX_BYTES, compression=EXPORT_COMPRESSION,
+                          compress_in=EXPORT_COMPRESS_IN)
+
+
+def graph_to_nt(g):
+    """An rdflib graph's N-Triples, without the blank line rdflib ends them with"""
+    return g.serialize(format='nt').decode('utf-8').rstrip('\n') + '\n'
+
+
+def write_files_manifest(data_file_stem, files):
+    """Writes the manifest of a builder's files, & their numbers of records & triples, to <stem>manifest.json"""
+    write_manifest(data_file_stem + 'manifest.json', {'files': files})
+
 
 def line_count(filename):
     lines = 0
@@ -24,32 +60,46 @@ def line_count(filename):
             buf = read_f(buf_size)
     return lines
 
-def get_state_addresses(state_pid):
+def read_index(index_file):
+    """Yields the pids of an index file, one line at a time, so the file is never read into memory whole"""
+    with open(index_file, 'r') as f:
+        for line in f:
+            pid = line.strip()
+            if pid:
+                yield pid
+
+
+def copy_to_index(query, index_file):
+    """
+    Writes the pids selected by query to an index file, one per line, streamed straight to disk by
+    COPY (query) TO STDOUT rather than fetched as rows
+
+    :param query: a psycopg2 sql Composable of a query of one column, without a closing ;
+    """
     with get_db_cursor() as cursor:
-        s = sql.SQL('''SELECT address_detail_pid 
-               FROM {dbschema}.address_detail 
-               WHERE locality_pid 
-               IN (SELECT locality_pid FROM gnaf.locality WHERE state_pid = {pid}) 
-               ORDER BY address_detail_pid;''').format(pid=sql.Literal(state_pid), dbschema=dbschema)
-        cursor.execute(s)
+        with open(index_file, 'wb') as f:
+            cursor.copy_expert(sql.SQL('COPY ({}) TO STDOUT').format(query), f)
+        cursor.connection.rollback()
+
 
-    with open('addresses_state_{}.txt'.format(state_pid), 'w') as f:
-        for row in cursor.fetchall():
-            r = reg(cursor, row)
-            f.write(str(r.address_detail_pid) + '\n')
+def get_state_addresses(state_pid):
+    copy_to_index(
+        sql.SQL('''SELECT address_detail_pid
+               FROM {dbschema}.address_detail
+               WHERE locality_pid
+               IN (SELECT locality_pid FROM {dbschema}.locality WHERE state_pid = {pid})
+               ORDER BY address_detail_pid''').format(pid=sql.Literal(state_pid), dbschema=dbschema),
+        'addresses_state_{}.txt'.format(state_pid)
+    )
 
 
 def get_state_localities(state_pid):
-    with get_db_cursor() as cursor:
-        s = sql.SQL('''SELECT locality_pid 
+    copy_to_index(
+        sql.SQL('''SELECT locality_pid
                FROM {dbschema}.locality WHERE state_pid = {pid}
-               ORDER BY locality_pid;''').format(pid=sql.Literal(state_pid), dbschema=dbschema)
-        cursor.execute(s)
-
-    with open('localities_state_{}.txt'.format(state_pid), 'w') as f:
-        for row in cursor.fetchall():
-            r = reg(cursor, row)
-            f.write(str(r.locality_pid) + '\n')
+               ORDER BY locality_pid''').format(pid=sql.Literal(state_pid), dbschema=dbschema),
+        'localities_state_{}.txt'.format(state_pid)
+    )
 
 
 def run_addresses(index_file, file_id, data_file_count, threaded=False):
@@ -63,37 +113,218 @@ def run_addresses(index_file, file_id, data_file_count, threaded=False):
     - Create an Address class instance using the ID
     - Serialise that to a file
     '''
-    DATA_FILE_LENGTH_MAX = 100000
-
     if threaded:
         return run_addresses_threaded(index_file, file_id, data_file_count, threaded)
 
     lines = line_count(index_file)
 
-    with get_db_cursor() as cursor:
-        data_file_stem = 'data-address-'+str(file_id)+"-"
-        # for idx, addr in enumerate(cursor.fetchall()):
-        for idx, addr in enumerate(open(index_file, 'r').readlines()):
-            print("Getting Address {} of {}".format(idx+1, lines))
-            a = addr.strip()
+    data_file_stem = 'data-address-'+str(file_id)+"-"
+    with get_db_cursor() as cursor, make_writer(data_file_stem, data_file_count) as writer:
+        addrs = read_index(index_file)
+        # load Addresses LOAD_CHUNK_SIZE at a time, rather than with a round trip per Address
+        for chunk_start in itertools.count(0, LOAD_CHUNK_SIZE):
+            chunk = list(itertools.islice(addrs, LOAD_CHUNK_SIZE))
+            if not chunk:
+                break
             try:
-                # record the Address being processed in case of failure
-                # every DATA_FILE_LENGTH_MAXth URI, create a new destination file
-                if (idx + 1) % DATA_FILE_LENGTH_MAX == 0:
-                    data_file_count += 1
-                with open(data_file_stem + str(data_file_count).zfill(4) + '.nt', 'a') as fl:
-                    fl.write(
-                        model.address.Address(a, focus=True, db_cursor=cursor)
-                            .export_rdf(view='gnaf').serialize(format='nt').decode('utf-8')
-                    )
+                addresses = {
+                    _a.id: _a for _a in
+                    model.address.Address.load_many(chunk, focus=True, db_cursor=cursor, chunk_size=LOAD_CHUNK_SIZE)
+                }
             except Exception as e:
-                logging.log(logging.DEBUG, 'address ' + a, e)
-                print('address ' + a + '\n')
+                logging.log(logging.DEBUG, 'addresses {} to {}'.format(chunk[0], chunk[-1]), e)
                 print(e)
-                with open('faulty.log', 'a') as f:
-                    f.write(addr + '\n')
-            finally:
-                logging.log(logging.INFO, 'Last accessed Address: ' + a)
+                cursor.connection.rollback()
+                addresses = {}
+            for idx, a in enumerate(chunk, start=chunk_start):
+                print("Getting Address {} of {}".format(idx+1, lines))
+                try:
+                    # record the Address being processed in case of failure
+                    if a not in addresses:
+                        raise NotFoundError()
+                    writer.write(graph_to_nt(addresses.pop(a).export_rdf(view='gnaf')))
+                except Exception as e:
+                    logging.log(logging.DEBUG, 'address ' + a, e)
+                    print('address ' + a + '\n')
+                    print(e)
+                    with open('faulty.log', 'a') as f:
+                        f.write(a + '\n')
+                finally:
+                    logging.log(logging.INFO, 'Last accessed Address: ' + a)
+    write_files_manifest(data_file_stem, writer.files)
+
+
+def export_addresses(where, file_id, data_file_count, itersize=EXPORT_ITERSIZE):
+    '''
+    - Stream the Addresses matching where, in pid order, from a server-side cursor
+    - Write each one's triples as N-Triples text, without an rdflib Graph
+    - Write them to files data-address-<file_id>-NNNN.nt, by an NTriplesWriter as per make_writer()
+
+    :param where: a psycopg2 sql Composable of the WHERE condition, using alias d for address_detail
+    :return: the number of Addresses written, a list of the pids of those that couldn't be & a list of the files
+        written, as per NTriplesWriter.files
+    '''
+    count = 0
+    faulty = []
+    with get_db_connection() as con, make_writer('data-address-' + str(file_id) + '-', data_file_count) as writer:
+        try:
+            for a in model.address.Address.export_many(where, con, itersize=itersize):
+                try:
+                    triples = a.export_nt()
+                except Exception as e:
+                    logging.log(logging.DEBUG, 'address ' + a.id, e)
+                    faulty.append(a.id)
+                    continue
+                writer.write(triples)
+                count += 1
+                if count % 10000 == 0:
+                    logging.log(logging.INFO, 'Last written Address: ' + a.id)
+        finally:
+            con.rollback()
+    return count, faulty, writer.files
+
+
+def make_state_where(state_pid):
+    """The WHERE condition of the Addresses of a state, for export_addresses()"""
+    return sql.SQL('d.locality_pid IN (SELECT locality_pid FROM {dbschema}.locality WHERE state_pid = {pid})') \
+        .format(pid=sql.Literal(state_pid), dbschema=dbschema)
+
+
+def get_address_ranges(where, size=ADDRESS_RANGE_SIZE):
+    """
+    Splits the Addresses matching where into contiguous ranges of pids, of size Addresses each but the last
+
+    :return: list of (first pid, first pid of the next range or None) tuples, in pid order
+    """
+    with get_db_cursor() as cursor:
+        cursor.execute(sql.SQL('''SELECT address_detail_pid
+               FROM (SELECT d.address_detail_pid, row_number() OVER (ORDER BY d.address_detail_pid) - 1 AS row_offset
+                     FROM {dbschema}.address_detail d WHERE {where}) r
+               WHERE row_offset % {size} = 0
+               ORDER BY address_detail_pid;''').format(dbschema=dbschema, where=where, size=sql.Literal(size)))
+        firsts = [row[0] for row in cursor.fetchall()]
+        cursor.connection.rollback()
+    return list(zip(firsts, firsts[1:] + [None]))
+
+
+def _init_export_worker():
+    logging.basicConfig(filename='graph_builder.log',
+                        level=logging.DEBUG,
+                        datefmt='%Y-%m-%d %H:%M:%S',
+                        format='%(asctime)s %(message)s')
+    # each worker exports one range at a time, so keeps only one connection of its own open
+    get_process_connection_pool(minconn=1)
+
+
+def _export_address_range(task):
+    """Exports one range of a state's Addresses, in a worker process, to its own files"""
+    state_pid, range_number, first, next_first = task
+    result = {'range': range_number, 'first': first, 'next': next_first}
+    where = make_state_where(state_pid) + sql.SQL(' AND d.address_detail_pid >= {}').format(sql.Literal(first))
+    if next_first is not None:
+        where += sql.SQL(' AND d.address_detail_pid < {}').format(sql.Literal(next_first))
+    try:
+        result['count'], result['faulty'], result['files'] = \
+            export_addresses(where, '{}-{}'.format(state_pid, str(range_number).zfill(4)), 1)
+    except Exception as e:
+        logging.exception('Addresses {} to {}'.format(first, next_first))
+        result['error'] = str(e)
+    return result
+
+
+def manifest_path(state_pid):
+    return 'manifest-address-{}.json'.format(state_pid)
+
+
+def read_manifest(path):
+    """:return: the manifest written by write_manifest(), or None if there isn't one"""
+    try:
+        with open(path) as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return None
+
+
+def write_manifest(path, manifest):
+    """Writes a manifest atomically, so it's always either the last one written or the one before"""
+    tmp_path = '{}.tmp'.format(path)
+    with open(tmp_path, 'w') as f:
+        json.dump(manifest, f, indent=1)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, path)
+
+
+def export_state_addresses(state_pid, processes=EXPORT_PROCESSES, resume=False):
+    '''
+    Exports a state's Addresses in contiguous pid ranges of ADDRESS_RANGE_SIZE Addresses, each to its own files,
+    data-address-<state>-<range>-NNNN.nt. If processes > 1, a pool of worker processes exports the ranges in parallel.
+
+    The state's manifest, manifest-address-<state>.json, records the ranges and, as each one is completed, its files
+    with their numbers of Addresses & triples. So with resume only the ranges not completed are exported, & any files they left incomplete are rewritten.
+    Addresses that can't be exported are listed in faulty.log & ranges whose export failed in faulty_ranges.log, with
+    their first pid & the first pid of the next range; the latter aren't completed, so are exported again on resume.
+
+    :return: the number of Addresses written
+    '''
+    logging.basicConfig(filename='graph_builder.log',
+                        level=logging.DEBUG,
+                        datefmt='%Y-%m-%d %H:%M:%S',
+                        format='%(asctime)s %(message)s')
+    path = manifest_path(state_pid)
+    manifest = read_manifest(path) if resume else None
+    if manifest is None:
+        manifest = {
+            'state': state_pid,
+            'ranges': get_address_ranges(make_state_where(state_pid)),
+            'completed': {}
+        }
+        write_manifest(path, manifest)
+    tasks = [(state_pid, i + 1, first, next_first) for i, (first, next_first) in enumerate(manifest['ranges'])
+             if str(i + 1) not in manifest['completed']]
+    if len(tasks) < len(manifest['ranges']):
+        print('State {}: resuming, {} of {} ranges already done'.format(
+            state_pid, len(manifest['ranges']) - len(tasks), len(manifest['ranges'])))
+
+    total = 0
+    if processes is None or processes <= 1:
+        results = map(_export_address_range, tasks)
+        pool = None
+    else:
+        # spawned rather than forked, so workers don't share this process' DB connections
+        pool = multiprocessing.get_context('spawn').Pool(processes, initializer=_init_export_worker)
+        results = pool.imap_unordered(_export_address_range, tasks)
+    try:
+        for done, result in enumerate(results, start=1):
+            if 'error' in result:
+                print('Addresses {} to {} failed: {}'.format(result['first'], result['next'], result['error']))
+                with open('faulty_ranges.log', 'a') as f:
+                    f.write('{}\t{}\n'.format(result['first'], result['next'] or ''))
+            else:
+                total += result['count']
+                _log_faulty(result['faulty'])
+                manifest['completed'][str(result['range'])] = {
+                    'files': result['files'],
+                    'count': result['count'],
+                    'faulty': len(result['faulty'])
+                }
+                write_manifest(path, manifest)
+            print('State {}: {} of {} ranges done, {} Addresses written'.format(state_pid, done, len(tasks), total))
+            logging.log(logging.INFO, 'Exported range {} of state {}, from Address {}'.format(
+                result['range'], state_pid, result['first']))
+    finally:
+        if pool is not None:
+            pool.close()
+            pool.join()
+    return total
+
+
+def _log_faulty(pids):
+    if pids:
+        print('{} Addresses could not be exported'.format(len(pids)))
+        with open('faulty.log', 'a') as f:
+            for pid in pids:
+                f.write(pid + '\n')
 
 
 def run_addresses_threaded(index_file, file_id, data_file_count, threads=8):
@@ -107,7 +338,6 @@ def run_addresses_threaded(index_file, file_id, data_file_count, threads=8):
     - Create an Address class instance using the ID
     - Serialise that to a file
     '''
-    DATA_FILE_LENGTH_MAX = 1000
     if threads is True:
         threads = 8
     elif threads == 1 or threads == 0 or threads is False:
@@ -140,8 +370,8 @@ def run_addresses_threaded(index_file, file_id, data_file_count, threads=8):
                 print("[T{}] Getting Address {} of {}.".format(t, i+1, lines))
                 new_triples = None
                 try:
-                    new_triples = model.address.Address(_a, focus=True, db_cursor=cursor) \
-                        .export_rdf(view='gnaf').serialize(format='nt').decode('utf-8')
+                    new_triples = graph_to_nt(
+                        model.address.Address(_a, focus=True, db_cursor=cursor).export_rdf(view='gnaf'))
                 except NotFoundError as e1:
                     msg = "address {} not found.".format(a)
                     logging.warning(msg)
@@ -160,56 +390,40 @@ def run_addresses_threaded(index_file, file_id, data_file_count, threads=8):
 
     data_file_stem = 'data-address-' + str(file_id) + "-"
 
+    writer = make_writer(data_file_stem, data_file_count)
+
     def _output_thread_processor():
-        nonlocal data_file_count
         nonlocal output_queue
         nonlocal eof_token
-        nonlocal data_file_stem
-        last_data_file_count = data_file_count
-        fo = None
-        try:
+        nonlocal writer
+        with writer:
             while True:
-                if last_data_file_count != data_file_count:
-                    if fo:
-                        fo.close()
-                        fo = None
                 new_triples = output_queue.get()
                 if new_triples is eof_token:
                     break
-                else:
-                    if fo is None:
-                        fo = open(data_file_stem + str(data_file_count).zfill(4) + '.nt', 'a')
-                        last_data_file_count = data_file_count
-                    fo.write(new_triples)
-                    fo.flush()
-        finally:
-            if fo:
-                fo.close()
+                writer.write(new_triples)
         print("[T-o] Thread terminated.")
 
     my_input_threads = [threading.Thread(target=_input_thread_processor, args=(_i,)) for _i in range(threads)]
     _ = [_t.start() for _t in my_input_threads]
     my_output_thread = threading.Thread(target=_output_thread_processor)
     my_output_thread.start()
-    for idx, addr in enumerate(open(index_file, 'r').readlines()):
-        a = addr.strip()
+    for idx, a in enumerate(read_index(index_file)):
         try:
-            # every DATA_FILE_LENGTH_MAXth URI, create a new destination file
-            if (idx + 1) % DATA_FILE_LENGTH_MAX == 0:
-                data_file_count += 1
             input_queue.put((idx, a))
         except Exception as e:
             logging.log(logging.DEBUG, 'address ' + a, e)
             print('address ' + a + '\n')
             print(e)
             with open('faulty.log', 'a') as f:
-                f.write(addr + '\n')
+                f.write(a + '\n')
         finally:
             logging.log(logging.INFO, 'Last accessed Address: ' + a)
     _ = [input_queue.put(eof_token) for _t in my_input_threads]
     _ = [_t.join() for _t in my_input_threads]
     output_queue.put(eof_token)
     my_output_thread.join()
+    write_files_manifest(data_file_stem, writer.files)
 
 
 def run_localities(locality_index_file, file_id, data_file_count, threaded=False):
@@ -223,66 +437,30 @@ def run_localities(locality_index_file, file_id, data_file_count, threaded=False
     - Create an Address class instance using the ID
     - Serialise that to a file
     '''
-    DATA_FILE_LENGTH_MAX = 100000
-
-    with get_db_cursor() as cursor:
-        data_file_stem = 'data-locality-'+str(file_id)+"-"
+    data_file_stem = 'data-locality-'+str(file_id)+"-"
+    with get_db_cursor() as cursor, make_writer(data_file_stem, data_file_count) as writer:
         # for idx, addr in enumerate(cursor.fetchall()):
-        for idx, addr in enumerate(open(locality_index_file, 'r').readlines()):
-            a = addr.strip()
+        for idx, a in enumerate(read_index(locality_index_file)):
             try:
                 # record the Address being processed in case of failure
-                # every DATA_FILE_LENGTH_MAXth URI, create a new destination file
-                if (idx + 1) % DATA_FILE_LENGTH_MAX == 0:
-                    data_file_count += 1
-                with open(data_file_stem + str(data_file_count).zfill(4) + '.nt', 'a') as fl:
-                    rdf = model.locality.Locality(a, db_cursor=cursor)\
-                        .export_rdf(view='gnaf').serialize(format='nt').decode('utf-8')
-                    fl.write(rdf)
+                writer.write(graph_to_nt(model.locality.Locality(a, db_cursor=cursor).export_rdf(view='gnaf')))
             except Exception as e:
                 logging.log(logging.DEBUG, 'address ' + a, e)
                 print('locality ' + a + '\n')
                 print(e)
                 with open('faulty_locality.log', 'a') as f:
-                    f.write(addr + '\n')
+                    f.write(a + '\n')
             finally:
                 logging.log(logging.INFO, 'Last accessed Locality: ' + a)
+    write_files_manifest(data_file_stem, writer.files)
 
 
 if __name__ == '__main__':
-    get_state_addresses('1')
-    get_state_addresses('2')
-    get_state_addresses('3')
-    get_state_addresses('4')
-    get_state_addresses('5')
-    get_state_addresses('6')
-    get_state_addresses('7')
-    get_state_addresses('8')
-    get_state_addresses('9')
-    run_addresses('addresses_state_1.txt', '1', 1)
-    run_addresses('addresses_state_2.txt', '2', 1)
-    run_addresses('addresses_state_3.txt', '3', 1)
-    run_addresses('addresses_state_4.txt', '4', 1)
-    run_addresses('addresses_state_5.txt', '5', 1)
-    run_addresses('addresses_state_6.txt', '6', 1)
-    run_addresses('addresses_state_7.txt', '7', 1)
-    run_addresses('addresses_state_8.txt', '8', 1)
-    run_addresses('addresses_state_9.txt', '9', 1)
-    get_state_localities('1')
-    get_state_localities('2')
-    get_state_localities('3')
-    get_state_localities('4')
-    get_state_localities('5')
-    get_state_localities('6')
-    get_state_localities('7')
-    get_state_localities('8')
-    get_state_localities('9')
-    run_localities('localities_state_1.txt', '1', 1)
-    run_localities('localities_state_2.txt', '2', 1)
-    run_localities('localities_state_3.txt', '3', 1)
-    run_localities('localities_state_4.txt', '4', 1)
-    run_localities('localities_state_5.txt', '5', 1)
-    run_localities('localities_state_6.txt', '6', 1)
-    run_localities('localities_state_7.txt', '7', 1)
-    run_localities('localities_state_8.txt', '8', 1)
-    run_localities('localities_state_9.txt', '9', 1)
+    # python3 graph_builder.py [--resume] [state_pid ...], all states if none are given
+    resume = '--resume' in sys.argv[1:]
+    states = [arg for arg in sys.argv[1:] if arg != '--resume'] or [str(i) for i in range(1, 10)]
+    for state in states:
+        export_state_addresses(state, resume=resume)
+    for state in states:
+        get_state_localities(state)
+        run_localities('localities_state_{}.txt'.format(state), state, 1)
@@ -1,5 +1,8 @@
 # -*- coding: utf-8 -*-
+import re
 from abc import ABCMeta, abstractmethod
+from contextlib import contextmanager
+from db import get_db_cursor, get_request_cursor, get_shared_cursor, execute_prepared
 
 
 class NotFoundError(Exception):
@@ -9,6 +12,12 @@ class NotFoundError(Exception):
 
 class GNAFModel:
     __metaclass__ = ABCMeta
+    # the prepared statement that gets an instance's last-modified date by its ID, see last_modified()
+    LAST_MODIFIED_STATEMENT = None
+    # what the IDs of instances look like; G-NAF pids are at most varchar(15)
+    PID_PATTERN = re.compile(r'^[A-Za-z0-9_]{1,15}$')
+    # the table of instances, whose pids pid_index.py indexes
+    PID_TABLE = None
 
     @abstractmethod
     def __init__(self, graph, uri):
@@ -16,6 +25,67 @@ class GNAFModel:
         self.g = graph
         self.uri = uri
 
+    def _use_cursor(self, db_cursor=None):
+        """
+        Sets the cursor this model queries with: the one given, else the current request's, else one of its own from
+        the pool which it holds until close()
+        """
+        if db_cursor is None:
+            db_cursor = get_request_cursor()
+        if db_cursor is not None:
+            self.cursor = db_cursor
+            self._cursor_context_manager = None
+        else:
+            self._cursor_context_manager = get_db_cursor()
+            self.cursor = self._cursor_context_manager.__enter__()
+
+    def close(self):
+        """Puts back the cursor this model took from the pool, if it took one. The model can't query after this."""
+        cursor_context_manager = getattr(self, '_cursor_context_manager', None)
+        if cursor_context_manager is not None:
+            self._cursor_context_manager = None
+            self.cursor = None
+            cursor_context_manager.__exit__(None, None, None)
+
+    def __del__(self):
+        # a safety net for models that are never closed, e.g. an AddressSite or StreetLocality, which query as they're
+        # exported, made outside a request & not opened with open()
+        self.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    @classmethod
+    @contextmanager
+    def open(cls, *args, **kwargs):
+        """
+        Loads a model & closes it on leaving the with block, e.g.:
+
+            with Address.open('GAACT714845933', focus=True) as a:
+                g = a.export_rdf()
+        """
+        instance = cls(*args, **kwargs)
+        try:
+            yield instance
+        finally:
+            instance.close()
+
+    @classmethod
+    def last_modified(cls, id):
+        """
+        Gets when an instance was last changed, with one indexed lookup and without loading it
+
+        :param id: the instance's ID
+        :return: the date it was last created, modified or retired, or None if there's no such instance
+        """
+        with get_shared_cursor() as cursor:
+            execute_prepared(cursor, cls.LAST_MODIFIED_STATEMENT, (id,))
+            row = cursor.fetchone()
+        return row[0] if row is not None else None
+
     @classmethod
     def make_wkt_literal(cls, longitude, latitude):
         return '<http://www.opengis.net/def/crs/EPSG/0/4283> POINT({} {})'.format(
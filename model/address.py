@@ -1,12 +1,16 @@
 # -*- coding: utf-8 -*-
-from db import get_db_cursor, reg
+from db import get_shared_cursor, reg, register_statement, execute_prepared
 from model import NotFoundError, GNAFModel
+from model.codes import get_code
 from flask import render_template
 from rdflib import Graph, URIRef, RDF, RDFS, XSD, Namespace, Literal, BNode
 import _config as config
 from psycopg2 import sql
+from collections import defaultdict
 import json
 import decimal
+import re
+import ntriples as nt
 
 
 class Address(GNAFModel):
@@ -15,258 +19,332 @@ class Address(GNAFModel):
     and to be exported in a number of formats including RDF, according to the 'GNAF Ontology' and an
     expression of the Dublin Core ontology, HTML, XML in the form according to the AS4590 XML schema.
     """
+    LAST_MODIFIED_STATEMENT = 'address_last_modified'
+    PID_TABLE = 'address_detail'
+    PID_PATTERN = re.compile(r'^GA[A-Z_]{2,4}[0-9]{1,11}$')
 
     def __init__(self, identifier, focus=False, db_cursor=None):
         self.id = identifier
         self.uri = config.URI_ADDRESS_INSTANCE_BASE + identifier
         # DB connection
-        if db_cursor is not None:
-            self.cursor = db_cursor
-            self._cursor_context_manager = None
-        else:
-            self._cursor_context_manager = get_db_cursor()
-            self.cursor = self._cursor_context_manager.__enter__()
+        self._use_cursor(db_cursor)
         assert self.cursor is not None, "Cannot get a cursor!"
 
-        # get basic properties
-        s = sql.SQL('''SELECT 
-                       d.location_description,
-                       d.street_locality_pid, 
-                       s.street_name, 
-                       s.street_type_code, 
-                       d.locality_pid,
-                       l.locality_name, 
-                       l.locality_class_code,
-                       TRIM(BOTH '0123456789' FROM d.locality_pid) state_abbreviation,
-                       d.postcode,
-                       g.latitude,
-                       g.longitude,
-                       CAST(d.date_created AS text),
-                       CAST(d.date_last_modified AS text),
-                       CAST(d.date_retired AS text),
-                       d.building_name,
-                       d.lot_number_prefix,
-                       d.lot_number,
-                       d.lot_number_suffix,
-                       d.flat_type_code,
-                       d.flat_number_prefix,
-                       CAST(d.flat_number AS text),
-                       d.flat_number_suffix,
-                       d.level_type_code,
-                       d.level_number_prefix,
-                       CAST(d.level_number AS text),
-                       d.level_number_suffix,
-                       d.number_first_prefix,
-                       CAST(d.number_first AS text), 
-                       d.number_first_suffix,
-                       d.number_last_prefix,
-                       CAST(d.number_last AS text),
-                       d.number_last_suffix,
-                       d.alias_principal,
-                       d.legal_parcel_id,
-                       d.address_site_pid,
-                       d.level_geocoded_code,
-                       d.property_pid,
-                       d.primary_secondary ,
-                       u.uri, 
-                       u.prefLabel,
-                       u2.uri uri2,
-                       u2.prefLabel prefLabel2,
-                       u3.uri uri3,
-                       u3.prefLabel prefLabel3,
-                       u4.uri uri4,
-                       u4.prefLabel prefLabel4,
-                       u5.uri uri5,
-                       u5.prefLabel prefLabel5,
-                       u6.uri uri6,
-                       u6.prefLabel prefLabel6                                               
-                       FROM {dbschema}.address_detail d
-                       INNER JOIN {dbschema}.street_locality s ON d.street_locality_pid = s.street_locality_pid
-                       INNER JOIN {dbschema}.locality l ON d.locality_pid = l.locality_pid
-                       INNER JOIN {dbschema}.address_default_geocode g ON d.address_detail_pid = g.address_detail_pid                
-                       LEFT JOIN codes.geocode u ON g.geocode_type_code = u.code           
-                       LEFT JOIN codes.gnafconfidence u2 ON CAST(d.confidence AS text) = u2.code 
-                       LEFT JOIN codes.locality u3 ON l.locality_class_code = u3.code 
-                       INNER JOIN {dbschema}.address_site a ON d.address_site_pid = a.address_site_pid
-                       LEFT JOIN codes.address u4 ON a.address_type = u4.code 
-                       LEFT JOIN codes.flat u5 ON d.flat_type_code = u5.code 
-                       LEFT JOIN codes.state u6 ON CAST(l.state_pid AS text) = u6.code 
-                       WHERE d.address_detail_pid = {id};
-                       ''').format(dbschema=sql.Identifier(config.DB_SCHEMA), id=sql.Literal(self.id))
-
-        # get just IDs, ordered, from the address_detail table, paginated by class init args
-        self.cursor.execute(s)
-        for row in self.cursor.fetchall():
-            r = reg(self.cursor, row)
-            # assign this Address' instance variables
-            self.address_subclass_uri = r.uri4
-            self.address_subclass_label = r.preflabel4
-            self.description = r.location_description.title() if r.location_description is not None else None
-            self.street_name = r.street_name.title()
-            self.street_type = r.street_type_code
-            self.locality_name = r.locality_name.title()
-            self.state_territory = r.state_abbreviation
-            self.state_uri = r.uri6
-            self.state_prefLabel = r.preflabel6
-            self.postcode = r.postcode
-            self.latitude = r.latitude
-            self.longitude = r.longitude
-            self.geocode_type_label = r.preflabel
-            self.geocode_type_uri = r.uri
-            self.confidence_uri = r.uri2
-            self.confidence_prefLabel = r.preflabel2
-            self.date_created = r.date_created
-            self.date_last_modified = r.date_last_modified
-            self.date_retired = r.date_retired
-            self.building_name = r.building_name.title() if r.building_name is not None else None
-            self.number_lot_prefix = r.lot_number_prefix
-            self.number_lot = r.lot_number
-            self.number_lot_suffix = r.lot_number_suffix
-            self.flat_type_code = r.flat_type_code
-            self.flat_type_uri = r.uri5
-            self.number_flat_prefix = r.flat_number_prefix
-            self.number_flat = r.flat_number
-            self.number_flat_suffix = r.flat_number_suffix
-            self.level_type_code = r.level_type_code
-            self.number_level_prefix = r.level_number_prefix
-            self.number_level = r.level_number
-            self.number_level_suffix = r.level_number_suffix
-            self.number_first = r.number_first
-            self.number_first_prefix = r.number_first_prefix
-            self.number_first_suffix = r.number_first_suffix
-            self.number_last_prefix = r.number_last_prefix
-            self.number_last = r.number_last
-            self.number_last_suffix = r.number_last_suffix
-            self.alias_principal = r.alias_principal
-            self.legal_parcel_id = r.legal_parcel_id
-            self.address_site_pid = r.address_site_pid
-            self.level_geocoded_code = r.level_geocoded_code
-            self.property_pid = r.property_pid
-            self.street_locality_pid = r.street_locality_pid
-            self.locality_pid = r.locality_pid
-            # self.private_street = True r.private_street private street seemingly unused in address_detail
-            self.is_primary = True if r.primary_secondary == 'P' else False
-            self.address_string, self.street_string = make_address_street_strings(
-                level_type_code=self.level_type_code,
-                level_number_prefix=self.number_level_prefix,
-                level_number=self.number_level,
-                level_number_suffix=self.number_level_suffix,
-                flat_type_code=self.flat_type_code,
-                flat_number_prefix=self.number_flat_prefix,
-                flat_number=self.number_flat,
-                flat_number_suffix=self.number_flat_suffix,
-                number_first_prefix=self.number_first_prefix,
-                number_first=self.number_first,
-                number_first_suffix=self.number_first_suffix,
-                number_last_prefix=self.number_last_prefix,
-                number_last=self.number_last,
-                number_last_suffix=self.number_last_suffix,
-                building=self.building_name,
-                lot_number_prefix=self.number_lot_prefix,
-                lot_number=self.number_lot,
-                lot_number_suffix=self.number_lot_suffix,
-                street_name=self.street_name,
-                street_type=self.street_type,
-                locality=self.locality_name,
-                state_territory=self.state_territory,
-                postcode=self.postcode
-            )
-            break
-        else:
-            raise NotFoundError()
-
-        # get aliases
-        self.alias_addresses = dict()
-        s2 = sql.SQL('''SELECT alias_pid, uri, prefLabel 
-                        FROM {dbschema}.address_alias 
-                        LEFT JOIN codes.alias ON {dbschema}.address_alias.alias_type_code = codes.alias.code 
-                        WHERE principal_pid = {id}''') \
-            .format(dbschema=sql.Identifier(config.DB_SCHEMA), id=sql.Literal(self.id))
-        self.cursor.execute(s2)
-        for row in self.cursor.fetchall():
-            r = reg(self.cursor, row)
-            self.alias_addresses[r.alias_pid] = {
-                'address_string': Address(r.alias_pid, focus=False).address_string,
-                'subclass_uri': r.uri,
-                'subclass_label': r.preflabel  # note use of preflabel, not prefLabel: capital letter dies in reg
-            }
-
-        # get alternates for address if in focus
-        if focus:
-            # get principals
-            self.principal_addresses = dict()
-            s3 = sql.SQL('''SELECT principal_pid, uri, prefLabel  
-                            FROM {dbschema}.address_alias 
-                            LEFT JOIN codes.alias ON {dbschema}.address_alias.alias_type_code = codes.alias.code 
-                            WHERE alias_pid = {id}''') \
-                .format(dbschema=sql.Identifier(config.DB_SCHEMA), id=sql.Literal(self.id))
-            self.cursor.execute(s3)
+        try:
+            # get basic properties, aliases &, if in focus, alternates in one statement
+            execute_prepared(self.cursor, 'address_focus' if focus else 'address', (self.id,))
             for row in self.cursor.fetchall():
                 r = reg(self.cursor, row)
-                ar = Address(r.principal_pid, focus=False)
-                self.principal_addresses[r.principal_pid] = {
-                    'address_string': ar.address_string,
-                    'subclass_uri': r.uri,
-                    'subclass_label': r.preflabel
+                # assign this Address' instance variables
+                self._set_properties(r)
+                break
+            else:
+                raise NotFoundError()
+
+            # the address strings of all related Addresses
+            address_strings = dict()
+            for related in r.related_addresses or []:
+                address_strings[related['address_detail_pid']] = make_address_string(related)
+
+            # aliases
+            self.alias_addresses = dict()
+            for alias in r.aliases or []:
+                alias_type_uri, alias_type_label = get_code('alias', alias['alias_type_code'])
+                self.alias_addresses[alias['alias_pid']] = {
+                    'address_string': address_strings.get(alias['alias_pid']),
+                    'subclass_uri': alias_type_uri,
+                    'subclass_label': alias_type_label
                 }
 
-            # get primary
-            self.primary_addresses = dict()
-            s4 = sql.SQL('''SELECT primary_pid FROM {dbschema}.primary_secondary WHERE secondary_pid = {id}''') \
-                .format(dbschema=sql.Identifier(config.DB_SCHEMA), id=sql.Literal(self.id))
-            self.cursor.execute(s4)
-            for row in self.cursor.fetchall():
-                r = reg(self.cursor, row)
-                a = Address(r.primary_pid, focus=False)
-                self.primary_addresses[r.primary_pid] = a.address_string
-
-            # get secondaries
-            self.secondary_addresses = dict()
-            s5 = sql.SQL('''SELECT secondary_pid FROM {dbschema}.primary_secondary WHERE primary_pid = {id}''') \
-                .format(dbschema=sql.Identifier(config.DB_SCHEMA), id=sql.Literal(self.id))
-            self.cursor.execute(s5)
-            rows = self.cursor.fetchall()
-            for row in rows:
-                r = reg(self.cursor, row)
-                a = Address(r.secondary_pid, focus=False)
-                self.secondary_addresses[r.secondary_pid] = a.address_string
-
-            # MBs
-            self.mesh_block_2011s = {}
-            self.mesh_block_2016s = {}
-            s6 = sql.SQL('''SELECT 
-                              mb_2011_code,
-                              mb_2016_code, 
-                              a.uri mb2011_uri, 
-                              a.prefLabel mb2011_prefLabel,
-                              b.uri mb2016_uri, 
-                              b.prefLabel mb2016_prefLabel  
-                            FROM {dbschema}.address_mesh_block_2016_view
-                            INNER JOIN {dbschema}.address_mesh_block_2011_view 
-                            ON {dbschema}.address_mesh_block_2016_view.address_detail_pid 
-                            = {dbschema}.address_mesh_block_2011_view.address_detail_pid
-                            LEFT JOIN codes.meshblockmatch a ON {dbschema}.address_mesh_block_2011_view.mb_match_code = a.code 
-                            LEFT JOIN codes.meshblockmatch b ON {dbschema}.address_mesh_block_2016_view.mb_match_code = b.code 
-                            WHERE {dbschema}.address_mesh_block_2016_view.address_detail_pid = {id};''') \
-                .format(dbschema=sql.Identifier(config.DB_SCHEMA), id=sql.Literal(self.id))
-
-            self.cursor.execute(s6)
-            for row in self.cursor.fetchall():
-                r = reg(self.cursor, row)
-                self.mesh_block_2011s[config.URI_MB_2011_INSTANCE_BASE + r.mb_2011_code] = {
+            # alternates for address if in focus
+            if focus:
+                self.principal_addresses = dict()
+                for principal in r.principals or []:
+                    alias_type_uri, alias_type_label = get_code('alias', principal['alias_type_code'])
+                    self.principal_addresses[principal['principal_pid']] = {
+                        'address_string': address_strings.get(principal['principal_pid']),
+                        'subclass_uri': alias_type_uri,
+                        'subclass_label': alias_type_label
+                    }
+
+                self.primary_addresses = dict()
+                for pid in r.primaries or []:
+                    self.primary_addresses[pid] = address_strings.get(pid)
+
+                self.secondary_addresses = dict()
+                for pid in r.secondaries or []:
+                    self.secondary_addresses[pid] = address_strings.get(pid)
+
+                # MBs
+                self.mesh_block_2011s = {}
+                self.mesh_block_2016s = {}
+                for mb in r.mesh_blocks or []:
+                    mb2011_uri, mb2011_label = get_code('meshblockmatch', mb['mb_2011_match_code'])
+                    mb2016_uri, mb2016_label = get_code('meshblockmatch', mb['mb_2016_match_code'])
+                    self.mesh_block_2011s[config.URI_MB_2011_INSTANCE_BASE + mb['mb_2011_code']] = {
+                        'string': mb['mb_2011_code'],
+                        'subclass_uri': mb2011_uri,
+                        'subclass_label': mb2011_label
+                    }
+                    self.mesh_block_2016s[config.URI_MB_2016_INSTANCE_BASE + mb['mb_2016_code']] = {
+                        'string': mb['mb_2016_code'],
+                        'subclass_uri': mb2016_uri,
+                        'subclass_label': mb2016_label
+                    }
+        except Exception:
+            # the caller never gets this model to close, so put back any cursor it took from the pool
+            self.close()
+            raise
+
+    def _set_properties(self, r):
+        """Assigns this Address' instance variables from a row of the Address query (see make_address_query)"""
+        self.address_subclass_uri, self.address_subclass_label = get_code('address', r.address_type)
+        self.description = r.location_description.title() if r.location_description is not None else None
+        self.street_name = r.street_name.title()
+        self.street_type = r.street_type_code
+        self.locality_name = r.locality_name.title()
+        self.state_territory = r.state_abbreviation
+        self.state_uri, self.state_prefLabel = get_code('state', r.state_pid)
+        self.postcode = r.postcode
+        self.latitude = r.latitude
+        self.longitude = r.longitude
+        self.geocode_type_uri, self.geocode_type_label = get_code('geocode', r.geocode_type_code)
+        self.confidence_uri, self.confidence_prefLabel = get_code('gnafconfidence', r.confidence)
+        self.date_created = r.date_created
+        self.date_last_modified = r.date_last_modified
+        self.date_retired = r.date_retired
+        self.building_name = r.building_name.title() if r.building_name is not None else None
+        self.number_lot_prefix = r.lot_number_prefix
+        self.number_lot = r.lot_number
+        self.number_lot_suffix = r.lot_number_suffix
+        self.flat_type_code = r.flat_type_code
+        self.flat_type_uri = get_code('flat', r.flat_type_code)[0]
+        self.number_flat_prefix = r.flat_number_prefix
+        self.number_flat = r.flat_number
+        self.number_flat_suffix = r.flat_number_suffix
+        self.level_type_code = r.level_type_code
+        self.number_level_prefix = r.level_number_prefix
+        self.number_level = r.level_number
+        self.number_level_suffix = r.level_number_suffix
+        self.number_first = r.number_first
+        self.number_first_prefix = r.number_first_prefix
+        self.number_first_suffix = r.number_first_suffix
+        self.number_last_prefix = r.number_last_prefix
+        self.number_last = r.number_last
+        self.number_last_suffix = r.number_last_suffix
+        self.alias_principal = r.alias_principal
+        self.legal_parcel_id = r.legal_parcel_id
+        self.address_site_pid = r.address_site_pid
+        self.level_geocoded_code = r.level_geocoded_code
+        self.property_pid = r.property_pid
+        self.street_locality_pid = r.street_locality_pid
+        self.locality_pid = r.locality_pid
+        # self.private_street = True r.private_street private street seemingly unused in address_detail
+        self.is_primary = True if r.primary_secondary == 'P' else False
+        self.address_string, self.street_string = make_address_street_strings(
+            level_type_code=self.level_type_code,
+            level_number_prefix=self.number_level_prefix,
+            level_number=self.number_level,
+            level_number_suffix=self.number_level_suffix,
+            flat_type_code=self.flat_type_code,
+            flat_number_prefix=self.number_flat_prefix,
+            flat_number=self.number_flat,
+            flat_number_suffix=self.number_flat_suffix,
+            number_first_prefix=self.number_first_prefix,
+            number_first=self.number_first,
+            number_first_suffix=self.number_first_suffix,
+            number_last_prefix=self.number_last_prefix,
+            number_last=self.number_last,
+            number_last_suffix=self.number_last_suffix,
+            building=self.building_name,
+            lot_number_prefix=self.number_lot_prefix,
+            lot_number=self.number_lot,
+            lot_number_suffix=self.number_lot_suffix,
+            street_name=self.street_name,
+            street_type=self.street_type,
+            locality=self.locality_name,
+            state_territory=self.state_territory,
+            postcode=self.postcode
+        )
+
+    @classmethod
+    def from_record(cls, record, alias_addresses=None, principal_addresses=None, primary_addresses=None,
+                    secondary_addresses=None, mesh_block_2011s=None, mesh_block_2016s=None, db_cursor=None):
+        """
+        Makes an Address from an already-fetched row of the Address query (see make_address_query), without going
+        to the database. The alternates (principals, primaries, secondaries & Mesh Blocks) are only set if given, as
+        they are for an Address loaded with focus=True.
+
+        :param record: a row object, as made by db.reg, of the Address query
+        :param alias_addresses: dict of this Address' aliases, keyed by alias pid
+        :param db_cursor: a cursor to keep for any view that needs further queries (e.g. the DCT HTML view)
+        :return: an Address
+        """
+        self = cls.__new__(cls)
+        self.id = record.address_detail_pid
+        self.uri = config.URI_ADDRESS_INSTANCE_BASE + self.id
+        self.cursor = db_cursor
+        self._cursor_context_manager = None
+        self._set_properties(record)
+        self.alias_addresses = alias_addresses if alias_addresses is not None else dict()
+        if principal_addresses is not None:
+            self.principal_addresses = principal_addresses
+        if primary_addresses is not None:
+            self.primary_addresses = primary_addresses
+        if secondary_addresses is not None:
+            self.secondary_addresses = secondary_addresses
+        if mesh_block_2011s is not None:
+            self.mesh_block_2011s = mesh_block_2011s
+        if mesh_block_2016s is not None:
+            self.mesh_block_2016s = mesh_block_2016s
+        return self
+
+    @classmethod
+    def load_many(cls, identifiers, focus=False, db_cursor=None, chunk_size=1000):
+        """
+        Loads many Addresses, chunk_size at a time, using one query per related table per chunk rather than one
+        query per table per Address.
+
+        Addresses are yielded in the order of identifiers. Identifiers not found in the database are skipped.
+
+        :param identifiers: an iterable of address_detail_pids
+        :param focus: as per Address(focus=True), also load the principals, primaries, secondaries & Mesh Blocks
+        :param db_cursor: a cursor to use, otherwise the request's or, outside a request, one taken from the pool for the
+            life of the generator
+        :param chunk_size: the number of Addresses to fetch per round trip
+        :return: a generator of Addresses
+        """
+        if db_cursor is None:
+            with get_shared_cursor() as cursor:
+                for a in cls.load_many(identifiers, focus=focus, db_cursor=cursor, chunk_size=chunk_size):
+                    yield a
+            return
+
+        chunk = []
+        for identifier in identifiers:
+            chunk.append(identifier)
+            if len(chunk) >= chunk_size:
+                for a in cls._load_chunk(chunk, focus, db_cursor):
+                    yield a
+                chunk = []
+        if len(chunk) > 0:
+            for a in cls._load_chunk(chunk, focus, db_cursor):
+                yield a
+
+    @classmethod
+    def _load_chunk(cls, identifiers, focus, cursor):
+        records = cls._fetch_records(cursor, identifiers)
+
+        # aliases, for all Addresses in the chunk at once
+        aliases = defaultdict(list)
+        execute_prepared(cursor, 'address_chunk_aliases', (list(records.keys()),))
+        for row in cursor.fetchall():
+            r = reg(cursor, row)
+            aliases[r.principal_pid].append(r)
+
+        principals = defaultdict(list)
+        primaries = defaultdict(list)
+        secondaries = defaultdict(list)
+        mesh_blocks = defaultdict(list)
+        if focus:
+            execute_prepared(cursor, 'address_chunk_principals', (list(records.keys()),))
+            for row in cursor.fetchall():
+                r = reg(cursor, row)
+                principals[r.alias_pid].append(r)
+
+            execute_prepared(cursor, 'address_chunk_primaries', (list(records.keys()),))
+            for row in cursor.fetchall():
+                r = reg(cursor, row)
+                primaries[r.secondary_pid].append(r.primary_pid)
+
+            execute_prepared(cursor, 'address_chunk_secondaries', (list(records.keys()),))
+            for row in cursor.fetchall():
+                r = reg(cursor, row)
+                secondaries[r.primary_pid].append(r.secondary_pid)
+
+            execute_prepared(cursor, 'address_chunk_mesh_blocks', (list(records.keys()),))
+            for row in cursor.fetchall():
+                r = reg(cursor, row)
+                mesh_blocks[r.address_detail_pid].append(r)
+
+        # the address strings of all related Addresses, in one more query
+        related_pids = set()
+        for rows in aliases.values():
+            related_pids.update(r.alias_pid for r in rows)
+        for rows in principals.values():
+            related_pids.update(r.principal_pid for r in rows)
+        for pids in primaries.values():
+            related_pids.update(pids)
+        for pids in secondaries.values():
+            related_pids.update(pids)
+        address_strings = get_address_strings(related_pids, cursor)
+
+        for identifier in identifiers:
+            record = records.get(identifier)
+            if record is None:
+                continue
+            alias_addresses = dict()
+            for r in aliases[identifier]:
+                alias_type_uri, alias_type_label = get_code('alias', r.alias_type_code)
+                alias_addresses[r.alias_pid] = {
+                    'address_string': address_strings.get(r.alias_pid),
+                    'subclass_uri': alias_type_uri,
+                    'subclass_label': alias_type_label
+                }
+            if not focus:
+                yield cls.from_record(record, alias_addresses=alias_addresses, db_cursor=cursor)
+                continue
+            principal_addresses = dict()
+            for r in principals[identifier]:
+                alias_type_uri, alias_type_label = get_code('alias', r.alias_type_code)
+                principal_addresses[r.principal_pid] = {
+                    'address_string': address_strings.get(r.principal_pid),
+                    'subclass_uri': alias_type_uri,
+                    'subclass_label': alias_type_label
+                }
+            primary_addresses = dict()
+            for pid in primaries[identifier]:
+                primary_addresses[pid] = address_strings.get(pid)
+            secondary_addresses = dict()
+            for pid in secondaries[identifier]:
+                secondary_addresses[pid] = address_strings.get(pid)
+            mesh_block_2011s = {}
+            mesh_block_2016s = {}
+            for r in mesh_blocks[identifier]:
+                mb2011_uri, mb2011_label = get_code('meshblockmatch', r.mb_2011_match_code)
+                mb2016_uri, mb2016_label = get_code('meshblockmatch', r.mb_2016_match_code)
+                mesh_block_2011s[config.URI_MB_2011_INSTANCE_BASE + r.mb_2011_code] = {
                     'string': r.mb_2011_code,
-                    'subclass_uri': r.mb2011_uri,
-                    'subclass_label': r.mb2011_preflabel  # note use of preflabel, not prefLabel
+                    'subclass_uri': mb2011_uri,
+                    'subclass_label': mb2011_label
                 }
-                self.mesh_block_2016s[config.URI_MB_2016_INSTANCE_BASE + r.mb_2016_code] = {
+                mesh_block_2016s[config.URI_MB_2016_INSTANCE_BASE + r.mb_2016_code] = {
                     'string': r.mb_2016_code,
-                    'subclass_uri': r.mb2016_uri,
-                    'subclass_label': r.mb2016_preflabel  # note use of preflabel, not prefLabel
+                    'subclass_uri': mb2016_uri,
+                    'subclass_label': mb2016_label
                 }
+            yield cls.from_record(
+                record,
+                alias_addresses=alias_addresses,
+                principal_addresses=principal_addresses,
+                primary_addresses=primary_addresses,
+                secondary_addresses=secondary_addresses,
+                mesh_block_2011s=mesh_block_2011s,
+                mesh_block_2016s=mesh_block_2016s,
+                db_cursor=cursor
+            )
 
-    def __del__(self):
-        if self._cursor_context_manager:
-            self._cursor_context_manager.__exit__(None, None, None)
+    @classmethod
+    def _fetch_records(cls, cursor, identifiers):
+        """Runs the Address query for many identifiers at once, returning their rows keyed by address_detail_pid"""
+        records = dict()
+        if len(identifiers) < 1:
+            return records
+        execute_prepared(cursor, 'address_chunk', (list(identifiers),))
+        for row in cursor.fetchall():
+            r = reg(cursor, row)
+            records[r.address_detail_pid] = r
+        return records
 
     def export_html(self, view='gnaf'):
         if view == 'gnaf':
@@ -328,23 +406,8 @@ class Address(GNAFModel):
             )
 
         elif view == 'dct':
-            s = sql.SQL('''SELECT 
-                         street_locality_pid, 
-                         locality_pid, 
-                         CAST(number_first AS text), 
-                         street_name, 
-                         street_type_code, 
-                         locality_name, 
-                         state_abbreviation, 
-                         postcode,
-                         longitude,
-                         latitude
-                     FROM {dbschema}.address_view 
-                     WHERE address_detail_pid = {id}''') \
-                .format(dbschema=sql.Identifier(config.DB_SCHEMA), id=sql.Literal(self.id))
-
             # get just IDs, ordered, from the address_detail table, paginated by class init args
-            self.cursor.execute(s)
+            execute_prepared(self.cursor, 'address_dct', (self.id,))
             address_string = "Not found"
             for record in self.cursor:
                 address_string = '{} {} {}, {}, {} {}' \
@@ -876,6 +939,138 @@ class Address(GNAFModel):
 
         return g
 
+    def export_nt(self):
+        """
+        Writes the triples of export_rdf(view='gnaf') as N-Triples text, directly rather than through an rdflib Graph,
+        for bulk exports. Blank nodes are labelled by this Address' pid, so are unique across the whole export.
+
+        :return: str of N-Triples lines
+        """
+        GNAF = 'http://linked.data.gov.au/def/gnaf#'
+        a = nt.uri(self.uri)
+        rdf_type = nt.uri(str(RDF.type))
+        label = nt.uri(str(RDFS.label))
+        gnaf_type = nt.uri(GNAF + 'gnafType')
+        has_number = nt.uri(GNAF + 'hasNumber')
+        lines = []
+
+        lines.append(nt.triple(a, rdf_type, nt.uri(GNAF + 'Address')))
+        lines.append(nt.triple(a, gnaf_type, nt.uri(
+            self.address_subclass_uri if self.address_subclass_uri is not None
+            else 'http://gnafld.net/def/gnaf/code/AddressTypes#Unknown'
+        )))
+        subclass_label = self.address_subclass_label if self.address_subclass_label is not None else 'Unknown'
+        lines.append(nt.triple(a, label, nt.literal('Address ' + self.id + ' of ' + subclass_label + ' type')))
+        lines.append(nt.triple(a, nt.uri(str(RDFS.comment)), nt.literal(self.address_string)))
+
+        geocode = nt.bnode(self.id + 'geocode')
+        lines.append(nt.triple(geocode, rdf_type, nt.uri(GNAF + 'Geocode')))
+        lines.append(nt.triple(geocode, gnaf_type, nt.uri(self.geocode_type_uri)))
+        lines.append(nt.triple(geocode, label, nt.literal(self.geocode_type_label)))
+        lines.append(nt.triple(geocode, nt.uri('http://www.opengis.net/ont/geosparql#asWKT'), nt.literal(
+            self.make_wkt_literal(longitude=self.longitude, latitude=self.latitude),
+            'http://www.opengis.net/ont/geosparql#wktLiteral'
+        )))
+        lines.append(nt.triple(a, nt.uri('http://www.opengis.net/ont/geosparql#hasGeometry'), geocode))
+
+        lines.append(nt.triple(a, nt.uri(GNAF + 'hasStreet'),
+                               nt.uri(config.URI_STREETLOCALITY_INSTANCE_BASE + str(self.street_locality_pid))))
+        lines.append(nt.triple(a, nt.uri(GNAF + 'hasGnafConfidence'), nt.uri(self.confidence_uri)))
+        lines.append(nt.triple(nt.uri(self.confidence_uri), label, nt.literal(self.confidence_prefLabel)))
+        if self.address_site_pid is not None:
+            lines.append(nt.triple(a, nt.uri(GNAF + 'hasAddressSite'),
+                                   nt.uri(config.URI_ADDRESS_SITE_INSTANCE_BASE + str(self.address_site_pid))))
+
+        # Numbers, as per export_rdf, where only a lot number may be other than an integer
+        try:
+            lot = nt.literal(int(self.number_lot), nt.XSD_INTEGER) if self.number_lot is not None else None
+        except ValueError:
+            lot = nt.literal(str(self.number_lot))
+        numbers = [
+            ('lot', 'Lot', lot, self.number_lot_prefix, self.number_lot_suffix),
+            ('flat', 'Flat', self.number_flat, self.number_flat_prefix, self.number_flat_suffix),
+            ('level', 'Level', self.number_level, self.number_level_prefix, self.number_level_suffix),
+            ('first', 'FirstStreet', self.number_first, self.number_first_prefix, self.number_first_suffix),
+            ('last', 'LastStreet', self.number_last, self.number_last_prefix, self.number_last_suffix),
+        ]
+        for name, number_type, value, prefix, suffix in numbers:
+            if value is None:
+                continue
+            if name != 'lot':
+                value = nt.literal(int(value), nt.XSD_INTEGER)
+            number = nt.bnode(self.id + name)
+            lines.append(nt.triple(number, rdf_type, nt.uri(GNAF + 'Number')))
+            lines.append(nt.triple(number, gnaf_type,
+                                   nt.uri('http://linked.data.gov.au/def/gnaf/code/NumberTypes#' + number_type)))
+            lines.append(nt.triple(number, nt.uri('http://www.w3.org/ns/prov#value'), value))
+            lines.append(nt.triple(a, has_number, number))
+            if prefix is not None:
+                lines.append(nt.triple(number, nt.uri(GNAF + 'hasPrefix'), nt.literal(str(prefix))))
+            if suffix is not None:
+                lines.append(nt.triple(number, nt.uri(GNAF + 'hasSuffix'), nt.literal(str(suffix))))
+
+        lines.append(nt.triple(a, nt.uri(GNAF + 'hasLocality'),
+                               nt.uri(config.URI_LOCALITY_INSTANCE_BASE + self.locality_pid)))
+        lines.append(nt.triple(a, nt.uri(GNAF + 'hasState'), nt.uri(self.state_uri)))
+        lines.append(nt.triple(nt.uri(self.state_uri), label, nt.literal(self.state_prefLabel)))
+
+        if self.description is not None:
+            lines.append(nt.triple(a, nt.uri('http://purl.org/dc/terms/description'), nt.literal(self.description)))
+        lines.append(nt.triple(a, nt.uri(GNAF + 'hasPostcode'), nt.literal(self.postcode, nt.XSD_INTEGER)))
+        if self.building_name is not None:
+            lines.append(nt.triple(a, nt.uri(GNAF + 'hasBuildingName'), nt.literal(self.building_name)))
+        lines.append(nt.triple(a, nt.uri(GNAF + 'hasDateCreated'), nt.literal(self.date_created, nt.XSD_DATE)))
+        lines.append(nt.triple(a, nt.uri(GNAF + 'hasDateLastModified'),
+                               nt.literal(self.date_last_modified, nt.XSD_DATE)))
+        if self.date_retired is not None:
+            lines.append(nt.triple(a, nt.uri(GNAF + 'hasDateRetired'), nt.literal(self.date_retired, nt.XSD_DATE)))
+
+        for k, v in getattr(self, 'alias_addresses', {}).items():
+            alias = nt.bnode(self.id + 'alias' + k)
+            lines.append(nt.triple(alias, rdf_type, nt.uri(GNAF + 'Alias')))
+            lines.append(nt.triple(a, nt.uri(GNAF + 'hasAlias'), alias))
+            lines.append(nt.triple(alias, gnaf_type, nt.uri(v['subclass_uri'])))
+            lines.append(nt.triple(alias, label, nt.literal(v['subclass_label'])))
+            lines.append(nt.triple(alias, nt.uri(GNAF + 'aliasOf'), nt.uri(config.URI_ADDRESS_INSTANCE_BASE + k)))
+        for k in getattr(self, 'primary_addresses', {}):
+            lines.append(nt.triple(a, nt.uri(GNAF + 'hasAddressPrimary'), nt.uri(config.URI_ADDRESS_INSTANCE_BASE + k)))
+        for k in getattr(self, 'secondary_addresses', {}):
+            lines.append(nt.triple(a, nt.uri(GNAF + 'hasAddressSecondary'),
+                                   nt.uri(config.URI_ADDRESS_INSTANCE_BASE + k)))
+
+        return ''.join(lines)
+
+    @classmethod
+    def export_many(cls, where, connection, itersize=10000):
+        """
+        Reads Addresses, with their aliases, primaries & secondaries, through a server-side cursor, itersize rows per
+        round trip, so any number of them can be exported in constant memory. They have what export_rdf(view='gnaf')
+        & export_nt() need but not the address strings of related Addresses or the Mesh Blocks.
+
+        :param where: a psycopg2 sql Composable of the WHERE condition, using alias d for address_detail
+        :param connection: the connection to read with, in a transaction that lasts as long as the generator
+        :param itersize: the number of rows to fetch per round trip
+        :return: a generator of Addresses, in address_detail_pid order
+        """
+        with connection.cursor(name='address_export') as cursor:
+            cursor.itersize = itersize
+            cursor.execute(make_address_export_query(where))
+            for r in cursor:
+                alias_addresses = dict()
+                for alias in r.aliases or []:
+                    alias_type_uri, alias_type_label = get_code('alias', alias['alias_type_code'])
+                    alias_addresses[alias['alias_pid']] = {
+                        'address_string': None,
+                        'subclass_uri': alias_type_uri,
+                        'subclass_label': alias_type_label
+                    }
+                yield cls.from_record(
+                    r,
+                    alias_addresses=alias_addresses,
+                    primary_addresses=dict.fromkeys(r.primaries or []),
+                    secondary_addresses=dict.fromkeys(r.secondaries or [])
+                )
+
     def export_schemaorg(self):
         data = {
             '@context': 'http://schema.org',
@@ -907,6 +1102,260 @@ class DecimalEncoder(json.JSONEncoder):
 
 
 # static methods
+def get_address_strings(identifiers, db_cursor):
+    """
+    Gets the human-readable address strings of many Addresses in one query, for labelling related Addresses (aliases,
+    principals, primaries & secondaries) without loading each of them as an Address
+
+    :param identifiers: an iterable of address_detail_pids
+    :param db_cursor: the cursor to query with
+    :return: dict of address string keyed by address_detail_pid. Identifiers not found are absent.
+    """
+    address_strings = dict()
+    identifiers = list(set(identifiers))
+    if len(identifiers) < 1:
+        return address_strings
+    execute_prepared(db_cursor, 'address_strings', (identifiers,))
+    for row in db_cursor.fetchall():
+        address_strings[row[0]['address_detail_pid']] = make_address_string(row[0])
+    return address_strings
+
+
+def make_address_string(components):
+    """
+    Makes the address string of an Address from a dict of its components, as selected by ADDRESS_STRING_OBJECT
+
+    :param components: dict of the address_detail, street_locality & locality values that make up an address string
+    :return: the address string
+    """
+    return make_address_street_strings(
+        level_type_code=components['level_type_code'],
+        level_number_prefix=components['level_number_prefix'],
+        level_number=components['level_number'],
+        level_number_suffix=components['level_number_suffix'],
+        flat_type_code=components['flat_type_code'],
+        flat_number_prefix=components['flat_number_prefix'],
+        flat_number=components['flat_number'],
+        flat_number_suffix=components['flat_number_suffix'],
+        number_first_prefix=components['number_first_prefix'],
+        number_first=components['number_first'],
+        number_first_suffix=components['number_first_suffix'],
+        number_last_prefix=components['number_last_prefix'],
+        number_last=components['number_last'],
+        number_last_suffix=components['number_last_suffix'],
+        building=components['building_name'].title() if components['building_name'] is not None else None,
+        lot_number_prefix=components['lot_number_prefix'],
+        lot_number=components['lot_number'],
+        lot_number_suffix=components['lot_number_suffix'],
+        street_name=components['street_name'].title(),
+        street_type=components['street_type_code'],
+        locality=components['locality_name'].title(),
+        state_territory=components['state_abbreviation'],
+        postcode=components['postcode']
+    )[0]
+
+
+# the components of a (related) Address' address string as a JSON object, over address_detail rd,
+# street_locality rs & locality rl
+ADDRESS_STRING_OBJECT = '''json_build_object(
+                   'address_detail_pid', rd.address_detail_pid,
+                   'street_name', rs.street_name,
+                   'street_type_code', rs.street_type_code,
+                   'locality_name', rl.locality_name,
+                   'state_abbreviation', TRIM(BOTH '0123456789' FROM rd.locality_pid),
+                   'postcode', rd.postcode,
+                   'building_name', rd.building_name,
+                   'lot_number_prefix', rd.lot_number_prefix,
+                   'lot_number', rd.lot_number,
+                   'lot_number_suffix', rd.lot_number_suffix,
+                   'flat_type_code', rd.flat_type_code,
+                   'flat_number_prefix', rd.flat_number_prefix,
+                   'flat_number', CAST(rd.flat_number AS text),
+                   'flat_number_suffix', rd.flat_number_suffix,
+                   'level_type_code', rd.level_type_code,
+                   'level_number_prefix', rd.level_number_prefix,
+                   'level_number', CAST(rd.level_number AS text),
+                   'level_number_suffix', rd.level_number_suffix,
+                   'number_first_prefix', rd.number_first_prefix,
+                   'number_first', CAST(rd.number_first AS text),
+                   'number_first_suffix', rd.number_first_suffix,
+                   'number_last_prefix', rd.number_last_prefix,
+                   'number_last', CAST(rd.number_last AS text),
+                   'number_last_suffix', rd.number_last_suffix)'''
+
+# the basic properties of an Address, over address_detail d
+ADDRESS_COLUMNS = '''d.address_detail_pid,
+                   d.location_description,
+                   d.street_locality_pid,
+                   s.street_name,
+                   s.street_type_code,
+                   d.locality_pid,
+                   l.locality_name,
+                   l.locality_class_code,
+                   TRIM(BOTH '0123456789' FROM d.locality_pid) state_abbreviation,
+                   d.postcode,
+                   g.latitude,
+                   g.longitude,
+                   CAST(d.date_created AS text),
+                   CAST(d.date_last_modified AS text),
+                   CAST(d.date_retired AS text),
+                   d.building_name,
+                   d.lot_number_prefix,
+                   d.lot_number,
+                   d.lot_number_suffix,
+                   d.flat_type_code,
+                   d.flat_number_prefix,
+                   CAST(d.flat_number AS text),
+                   d.flat_number_suffix,
+                   d.level_type_code,
+                   d.level_number_prefix,
+                   CAST(d.level_number AS text),
+                   d.level_number_suffix,
+                   d.number_first_prefix,
+                   CAST(d.number_first AS text),
+                   d.number_first_suffix,
+                   d.number_last_prefix,
+                   CAST(d.number_last AS text),
+                   d.number_last_suffix,
+                   d.alias_principal,
+                   d.legal_parcel_id,
+                   d.address_site_pid,
+                   d.level_geocoded_code,
+                   d.property_pid,
+                   d.primary_secondary ,
+                   g.geocode_type_code,
+                   CAST(d.confidence AS text) confidence,
+                   a.address_type,
+                   CAST(l.state_pid AS text) state_pid'''
+
+ADDRESS_TABLES = '''{dbschema}.address_detail d
+                   INNER JOIN {dbschema}.street_locality s ON d.street_locality_pid = s.street_locality_pid
+                   INNER JOIN {dbschema}.locality l ON d.locality_pid = l.locality_pid
+                   INNER JOIN {dbschema}.address_default_geocode g ON d.address_detail_pid = g.address_detail_pid
+                   INNER JOIN {dbschema}.address_site a ON d.address_site_pid = a.address_site_pid'''
+
+
+def make_address_query(where):
+    """
+    Makes the query for the basic properties of Addresses, one row per Address
+
+    :param where: a psycopg2 sql Composable of the WHERE condition, using alias d for address_detail
+    :return: a psycopg2 sql Composed query
+    """
+    return sql.SQL('SELECT ' + ADDRESS_COLUMNS + ' FROM ' + ADDRESS_TABLES + ' WHERE {where};') \
+        .format(dbschema=sql.Identifier(config.DB_SCHEMA), where=where)
+
+
+def make_address_aggregate_query(where, focus=False):
+    """
+    Makes a query for Addresses that returns, as well as the basic properties, each Address' aliases and the
+    components of the address strings of its related Addresses, aggregated into JSON columns by LATERAL subqueries.
+    With focus, the principals, primaries, secondaries & Mesh Blocks are included too. So a whole Address is loaded
+    by one statement.
+
+    :param where: a psycopg2 sql Composable of the WHERE condition, using alias d for address_detail
+    :param focus: include the alternates of the Address
+    :return: a psycopg2 sql Composed query
+    """
+    related = '''SELECT alias_pid FROM {dbschema}.address_alias WHERE principal_pid = d.address_detail_pid'''
+    focus_columns = ''
+    focus_laterals = ''
+    if focus:
+        related += '''
+                       UNION SELECT principal_pid FROM {dbschema}.address_alias WHERE alias_pid = d.address_detail_pid
+                       UNION SELECT primary_pid FROM {dbschema}.primary_secondary WHERE secondary_pid = d.address_detail_pid
+                       UNION SELECT secondary_pid FROM {dbschema}.primary_secondary WHERE primary_pid = d.address_detail_pid'''
+        focus_columns = ''',
+                   pr.principals,
+                   ps.primaries,
+                   sc.secondaries,
+                   mb.mesh_blocks'''
+        focus_laterals = '''
+                   LEFT JOIN LATERAL (
+                       SELECT json_agg(json_build_object(
+                           'principal_pid', aa.principal_pid, 'alias_type_code', aa.alias_type_code)) principals
+                       FROM {dbschema}.address_alias aa
+                       WHERE aa.alias_pid = d.address_detail_pid
+                   ) pr ON TRUE
+                   LEFT JOIN LATERAL (
+                       SELECT json_agg(p.primary_pid) primaries
+                       FROM {dbschema}.primary_secondary p
+                       WHERE p.secondary_pid = d.address_detail_pid
+                   ) ps ON TRUE
+                   LEFT JOIN LATERAL (
+                       SELECT json_agg(p.secondary_pid) secondaries
+                       FROM {dbschema}.primary_secondary p
+                       WHERE p.primary_pid = d.address_detail_pid
+                   ) sc ON TRUE
+                   LEFT JOIN LATERAL (
+                       SELECT json_agg(json_build_object(
+                           'mb_2011_code', m11.mb_2011_code,
+                           'mb_2016_code', m16.mb_2016_code,
+                           'mb_2011_match_code', m11.mb_match_code,
+                           'mb_2016_match_code', m16.mb_match_code)) mesh_blocks
+                       FROM {dbschema}.address_mesh_block_2016_view m16
+                       INNER JOIN {dbschema}.address_mesh_block_2011_view m11
+                       ON m16.address_detail_pid = m11.address_detail_pid
+                       WHERE m16.address_detail_pid = d.address_detail_pid
+                   ) mb ON TRUE'''
+
+    return sql.SQL('SELECT ' + ADDRESS_COLUMNS + ''',
+                   al.aliases,
+                   ra.related_addresses''' + focus_columns + '''
+                   FROM ''' + ADDRESS_TABLES + '''
+                   LEFT JOIN LATERAL (
+                       SELECT json_agg(json_build_object(
+                           'alias_pid', aa.alias_pid, 'alias_type_code', aa.alias_type_code)) aliases
+                       FROM {dbschema}.address_alias aa
+                       WHERE aa.principal_pid = d.address_detail_pid
+                   ) al ON TRUE
+                   LEFT JOIN LATERAL (
+                       SELECT json_agg({address_string_object}) related_addresses
+                       FROM {dbschema}.address_detail rd
+                       INNER JOIN {dbschema}.street_locality rs ON rd.street_locality_pid = rs.street_locality_pid
+                       INNER JOIN {dbschema}.locality rl ON rd.locality_pid = rl.locality_pid
+                       WHERE rd.address_detail_pid IN (''' + related + ''')
+                   ) ra ON TRUE''' + focus_laterals + '''
+                   WHERE {where};''') \
+        .format(dbschema=sql.Identifier(config.DB_SCHEMA),
+                address_string_object=sql.SQL(ADDRESS_STRING_OBJECT),
+                where=where)
+
+
+def make_address_export_query(where):
+    """
+    Makes the query for exporting Addresses in bulk: the basic properties with each Address' aliases, primaries &
+    secondaries aggregated into JSON columns, ordered by address_detail_pid
+
+    :param where: a psycopg2 sql Composable of the WHERE condition, using alias d for address_detail
+    :return: a psycopg2 sql Composed query
+    """
+    return sql.SQL('SELECT ' + ADDRESS_COLUMNS + ''',
+                   al.aliases,
+                   ps.primaries,
+                   sc.secondaries
+                   FROM ''' + ADDRESS_TABLES + '''
+                   LEFT JOIN LATERAL (
+                       SELECT json_agg(json_build_object(
+                           'alias_pid', aa.alias_pid, 'alias_type_code', aa.alias_type_code)) aliases
+                       FROM {dbschema}.address_alias aa
+                       WHERE aa.principal_pid = d.address_detail_pid
+                   ) al ON TRUE
+                   LEFT JOIN LATERAL (
+                       SELECT json_agg(p.primary_pid) primaries
+                       FROM {dbschema}.primary_secondary p
+                       WHERE p.secondary_pid = d.address_detail_pid
+                   ) ps ON TRUE
+                   LEFT JOIN LATERAL (
+                       SELECT json_agg(p.secondary_pid) secondaries
+                       FROM {dbschema}.primary_secondary p
+                       WHERE p.primary_pid = d.address_detail_pid
+                   ) sc ON TRUE
+                   WHERE {where}
+                   ORDER BY d.address_detail_pid;''') \
+        .format(dbschema=sql.Identifier(config.DB_SCHEMA), where=where)
+
+
 def make_address_street_strings(
         level_type_code=None,
         level_number_prefix=None,
@@ -1003,10 +1452,111 @@ def make_gml_literal(longitude, latitude):
                 longitude, latitude
             )
 
+# prepared statements, by the name they are executed with
+register_statement(
+    'address',
+    make_address_aggregate_query(sql.SQL('d.address_detail_pid = {id}').format(id=sql.Placeholder()), focus=False),
+    ['text']
+)
+register_statement(
+    'address_focus',
+    make_address_aggregate_query(sql.SQL('d.address_detail_pid = {id}').format(id=sql.Placeholder()), focus=True),
+    ['text']
+)
+register_statement(
+    'address_chunk',
+    make_address_query(sql.SQL('d.address_detail_pid = ANY({ids})').format(ids=sql.Placeholder())),
+    ['text[]']
+)
+register_statement(
+    'address_chunk_aliases',
+    sql.SQL('''SELECT principal_pid, alias_pid, alias_type_code
+                FROM {dbschema}.address_alias
+                WHERE principal_pid = ANY({ids})''') \
+        .format(ids=sql.Placeholder(), dbschema=sql.Identifier(config.DB_SCHEMA)),
+    ['text[]']
+)
+register_statement(
+    'address_chunk_principals',
+    sql.SQL('''SELECT alias_pid, principal_pid, alias_type_code
+                FROM {dbschema}.address_alias
+                WHERE alias_pid = ANY({ids})''') \
+        .format(ids=sql.Placeholder(), dbschema=sql.Identifier(config.DB_SCHEMA)),
+    ['text[]']
+)
+register_statement(
+    'address_chunk_primaries',
+    sql.SQL('''SELECT secondary_pid, primary_pid FROM {dbschema}.primary_secondary
+                WHERE secondary_pid = ANY({ids})''') \
+        .format(ids=sql.Placeholder(), dbschema=sql.Identifier(config.DB_SCHEMA)),
+    ['text[]']
+)
+register_statement(
+    'address_chunk_secondaries',
+    sql.SQL('''SELECT primary_pid, secondary_pid FROM {dbschema}.primary_secondary
+                WHERE primary_pid = ANY({ids})''') \
+        .format(ids=sql.Placeholder(), dbschema=sql.Identifier(config.DB_SCHEMA)),
+    ['text[]']
+)
+register_statement(
+    'address_chunk_mesh_blocks',
+    sql.SQL('''SELECT
+                {dbschema}.address_mesh_block_2016_view.address_detail_pid,
+                mb_2011_code,
+                mb_2016_code,
+                {dbschema}.address_mesh_block_2011_view.mb_match_code mb_2011_match_code,
+                {dbschema}.address_mesh_block_2016_view.mb_match_code mb_2016_match_code
+                FROM {dbschema}.address_mesh_block_2016_view
+                INNER JOIN {dbschema}.address_mesh_block_2011_view
+                ON {dbschema}.address_mesh_block_2016_view.address_detail_pid
+                = {dbschema}.address_mesh_block_2011_view.address_detail_pid
+                WHERE {dbschema}.address_mesh_block_2016_view.address_detail_pid = ANY({ids});''') \
+        .format(ids=sql.Placeholder(), dbschema=sql.Identifier(config.DB_SCHEMA)),
+    ['text[]']
+)
+register_statement(
+    'address_dct',
+    sql.SQL('''SELECT
+                street_locality_pid,
+                locality_pid,
+                CAST(number_first AS text),
+                street_name,
+                street_type_code,
+                locality_name,
+                state_abbreviation,
+                postcode,
+                longitude,
+                latitude
+                FROM {dbschema}.address_view
+                WHERE address_detail_pid = {id}''') \
+        .format(id=sql.Placeholder(), dbschema=sql.Identifier(config.DB_SCHEMA)),
+    ['text']
+)
+register_statement(
+    'address_strings',
+    sql.SQL('''SELECT {address_string_object}
+                FROM {dbschema}.address_detail rd
+                INNER JOIN {dbschema}.street_locality rs ON rd.street_locality_pid = rs.street_locality_pid
+                INNER JOIN {dbschema}.locality rl ON rd.locality_pid = rl.locality_pid
+                WHERE rd.address_detail_pid = ANY({ids});''') \
+        .format(address_string_object=sql.SQL(ADDRESS_STRING_OBJECT), dbschema=sql.Identifier(config.DB_SCHEMA),
+                ids=sql.Placeholder()),
+    ['text[]']
+)
+register_statement(
+    'address_last_modified',
+    sql.SQL('''SELECT GREATEST(date_created, date_last_modified, date_retired)
+                FROM {dbschema}.address_detail
+                WHERE address_detail_pid = {id}''') \
+        .format(dbschema=sql.Identifier(config.DB_SCHEMA), id=sql.Placeholder()),
+    ['text']
+)
+
 
 if __name__ == '__main__':
-    a = Address('GANSW703902211', focus=True)
-    print(a.export_rdf().decode('utf-8'))
+    with Address.open('GANSW703902211', focus=True) as a:
+        print(a.export_rdf().serialize(format='turtle').decode('utf-8'))
 
 # has alias for which it can't get address subclass: GAACT715069724. Alias is GAACT718348352
 # GAACT718348352 has subclass UnknownVillaAddress
+
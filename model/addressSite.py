@@ -1,6 +1,7 @@
 # -*- coding: utf-8 -*-
-from db import get_db_cursor
+from db import register_statement, execute_prepared
 from model import GNAFModel, NotFoundError
+from model.codes import get_code
 from flask import render_template
 from rdflib import Graph, URIRef, RDF, XSD, Namespace, Literal, BNode, RDFS
 import _config as config
@@ -13,35 +14,21 @@ class AddressSite(GNAFModel):
     database and to be exported in a number of formats including RDF, according to the 'GNAF Ontology' and an
     expression of the Dublin Core ontology, HTML, XML in the form according to the AS4590 XML schema.
     """
+    LAST_MODIFIED_STATEMENT = 'address_site_last_modified'
+    PID_TABLE = 'address_site'
 
     def __init__(self, identifier, db_cursor=None):
         self.id = identifier
         self.uri = config.URI_ADDRESS_SITE_INSTANCE_BASE + identifier
         self.address_site_geocode_ids = dict()
-        if db_cursor is not None:
-            self.cursor = db_cursor
-            self._cursor_context_manager = None
-        else:
-            self._cursor_context_manager = get_db_cursor()
-            self.cursor = self._cursor_context_manager.__enter__()
-
-    def __del__(self):
-        if self._cursor_context_manager:
-            self._cursor_context_manager.__exit__(None, None, None)
+        self._use_cursor(db_cursor)
 
     def export_html(self, view='gnaf'):
         # connect to DB
         cursor = self.cursor
 
         if view == 'gnaf':
-            s = sql.SQL('''SELECT
-                a.address_type, a.address_site_name, gv.address_site_geocode_pid, gv.geocode_type                   
-                FROM {dbschema}.address_site as a
-                LEFT JOIN {dbschema}.address_site_geocode_view as gv on a.address_site_pid = gv.address_site_pid
-                WHERE a.address_site_pid = {id};''') \
-                .format(id=sql.Literal(self.id), dbschema=sql.Identifier(config.DB_SCHEMA))
-
-            cursor.execute(s)
+            execute_prepared(cursor, 'address_site_html', (self.id,))
             rows = cursor.fetchall()
             found = False
             for row in rows:
@@ -80,15 +67,8 @@ class AddressSite(GNAFModel):
             )
 
         elif view == 'dct':
-            s = sql.SQL('''SELECT 
-                        address_type, 
-                        address_site_name                       
-                    FROM {dbschema}.address_site
-                    WHERE address_site_pid = {id}''') \
-                .format(id=sql.Literal(self.id), dbschema=sql.Identifier(config.DB_SCHEMA))
-
             # get just IDs, ordered, from the address_detail table, paginated by class init args
-            cursor.execute(s)
+            execute_prepared(cursor, 'address_site', (self.id,))
             for record in cursor:
                 address_type = record[0]
                 address_site_name = record[1]
@@ -114,16 +94,9 @@ class AddressSite(GNAFModel):
 
         if view == 'ISO19160':
             # get the components from the DB needed for ISO19160
-            s = sql.SQL('''SELECT 
-                        address_type, 
-                        address_site_name                       
-                    FROM {dbschema}.address_site
-                    WHERE address_site_pid = {id}''') \
-                .format(id=sql.Literal(self.id), dbschema=sql.Identifier(config.DB_SCHEMA))
-
             cursor = self.cursor
             # get just IDs, ordered, from the address_detail table, paginated by class init args
-            cursor.execute(s)
+            execute_prepared(cursor, 'address_site', (self.id,))
             for record in cursor:
                 address_type = record[0]
                 address_site_name = record[1]
@@ -150,31 +123,21 @@ class AddressSite(GNAFModel):
             g.bind('gnaf', GNAF)
             GEO = Namespace('http://www.opengis.net/ont/geosparql#')
             g.bind('geo', GEO)
-            s = sql.SQL('''SELECT
-                a.address_type, a.address_site_name, coa.uri, coa.preflabel, gc.address_site_geocode_pid, gc.geocode_type_code, gc.longitude, gc.latitude, cog.uri, cog.preflabel 
-                FROM {dbschema}.address_site as a
-                LEFT JOIN {dbschema}.address_site_geocode as gc on a.address_site_pid = gc.address_site_pid
-                LEFT JOIN codes.address as coa on a.address_type = coa.code
-                LEFT JOIN codes.geocode as cog on gc.geocode_type_code = cog.code
-                WHERE a.address_site_pid = {id};''') \
-                .format(id=sql.Literal(self.id), dbschema=sql.Identifier(config.DB_SCHEMA))
             cursor = self.cursor
-            cursor.execute(s)
+            execute_prepared(cursor, 'address_site_gnaf', (self.id,))
             rows = cursor.fetchall()
             found = False
             for row in rows:
                 found = True
                 address_type = row[0]
                 address_site_name = row[1]
-                address_type_uri = row[2]
-                address_type_label = row[3]
-                geocode_pid = row[4]
+                address_type_uri, address_type_label = get_code('address', address_type)
+                geocode_pid = row[2]
                 if geocode_pid is not None:
-                    self.address_site_geocode_ids[geocode_pid] = row[5]
-                longitude = row[6]
-                latitude = row[7]
-                geocode_uri = row[8]
-                geocode_preflabel = row[9]
+                    self.address_site_geocode_ids[geocode_pid] = row[3]
+                longitude = row[4]
+                latitude = row[5]
+                geocode_uri, geocode_preflabel = get_code('geocode', row[3])
             if not found:
                 raise NotFoundError()
             g.add((a, RDF.type, GNAF.AddressSite))
@@ -207,3 +170,44 @@ class AddressSite(GNAFModel):
         else:
             raise RuntimeError("Cannot render an RDF representation of that View.")
         return g
+
+
+# prepared statements, by the name they are executed with
+register_statement(
+    'address_site_html',
+    sql.SQL('''SELECT
+                a.address_type, a.address_site_name, gv.address_site_geocode_pid, gv.geocode_type
+                FROM {dbschema}.address_site as a
+                LEFT JOIN {dbschema}.address_site_geocode_view as gv on a.address_site_pid = gv.address_site_pid
+                WHERE a.address_site_pid = {id};''') \
+        .format(id=sql.Placeholder(), dbschema=sql.Identifier(config.DB_SCHEMA)),
+    ['text']
+)
+register_statement(
+    'address_site',
+    sql.SQL('''SELECT
+                    address_type,
+                    address_site_name
+                FROM {dbschema}.address_site
+                WHERE address_site_pid = {id}''') \
+        .format(id=sql.Placeholder(), dbschema=sql.Identifier(config.DB_SCHEMA)),
+    ['text']
+)
+register_statement(
+    'address_site_gnaf',
+    sql.SQL('''SELECT
+                a.address_type, a.address_site_name, gc.address_site_geocode_pid, gc.geocode_type_code, gc.longitude, gc.latitude
+                FROM {dbschema}.address_site as a
+                LEFT JOIN {dbschema}.address_site_geocode as gc on a.address_site_pid = gc.address_site_pid
+                WHERE a.address_site_pid = {id};''') \
+        .format(id=sql.Placeholder(), dbschema=sql.Identifier(config.DB_SCHEMA)),
+    ['text']
+)
+register_statement(
+    'address_site_last_modified',
+    sql.SQL('''SELECT GREATEST(date_created, date_retired)
+                FROM {dbschema}.address_site
+                WHERE address_site_pid = {id}''') \
+        .format(dbschema=sql.Identifier(config.DB_SCHEMA), id=sql.Placeholder()),
+    ['text']
+)
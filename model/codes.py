@@ -0,0 +1,72 @@
+# -*- coding: utf-8 -*-
+"""
+The codes.* lookup tables, which give G-NAF's codes a URI & a label. They are small and static so are loaded once per
+process and shared by all models, rather than joined into every instance query.
+"""
+from threading import Lock
+from psycopg2 import sql
+from db import get_shared_cursor
+
+CODE_TABLES = [
+    'address',
+    'alias',
+    'flat',
+    'geocode',
+    'gnafconfidence',
+    'locality',
+    'meshblockmatch',
+    'state',
+    'street',
+    'streetsuffix'
+]
+
+NO_CODE = (None, None)
+
+_codes = None
+_codes_lock = Lock()
+
+
+def load_codes(db_cursor=None):
+    """
+    Loads all the codes.* tables, if they haven't been already
+
+    :param db_cursor: the cursor to load them with, else the request's or one from the pool
+    :return: dict, keyed by table name, of dicts of (uri, prefLabel) keyed by code
+    """
+    global _codes
+    if _codes is None:
+        with _codes_lock:
+            if _codes is None:
+                if db_cursor is not None:
+                    _codes = _fetch_codes(db_cursor)
+                else:
+                    with get_shared_cursor() as cursor:
+                        _codes = _fetch_codes(cursor)
+    return _codes
+
+
+def _fetch_codes(cursor):
+    s = sql.SQL(' UNION ALL ').join(
+        sql.SQL('SELECT {table_name}, code, uri, prefLabel FROM codes.{table}').format(
+            table_name=sql.Literal(table), table=sql.Identifier(table))
+        for table in CODE_TABLES
+    )
+    cursor.execute(s)
+    codes = {table: {} for table in CODE_TABLES}
+    for table, code, uri, pref_label in cursor.fetchall():
+        # like a LEFT JOIN, the first row of a code wins
+        codes[table].setdefault(code, (uri, pref_label))
+    return codes
+
+
+def get_code(table, code):
+    """
+    Looks up a code in one of the codes.* tables
+
+    :param table: the table's name, e.g. 'geocode' for codes.geocode
+    :param code: the code, as text
+    :return: (uri, prefLabel), or (None, None) if the code is None or not in the table
+    """
+    if code is None:
+        return NO_CODE
+    return load_codes()[table].get(code, NO_CODE)
@@ -1,6 +1,7 @@
 # -*- coding: utf-8 -*-
-from db import get_db_cursor, reg
+from db import reg, register_statement, execute_prepared
 from model import GNAFModel, NotFoundError
+from model.codes import get_code
 from flask import render_template
 from rdflib import Graph, URIRef, RDF, XSD, Namespace, Literal, BNode
 import _config as config
@@ -13,98 +14,65 @@ class Locality(GNAFModel):
     and to be exported in a number of formats including RDF, according to the 'GNAF Ontology' and an
     expression of the Dublin Core ontology, HTML, XML in the form according to the AS4590 XML schema.
     """
+    LAST_MODIFIED_STATEMENT = 'locality_last_modified'
+    PID_TABLE = 'locality'
 
     def __init__(self, identifier, db_cursor=None):
         self.id = identifier
         self.uri = config.URI_LOCALITY_INSTANCE_BASE + identifier
 
         # DB connection
-        if db_cursor is not None:
-            self.cursor = db_cursor
-            self._cursor_context_manager = None
-        else:
-            self._cursor_context_manager = get_db_cursor()
-            self.cursor = self._cursor_context_manager.__enter__()
-
-        self.locality_name = None
-        self.latitude = None
-        self.longitude = None
-        self.date_created = None
-        self.date_retired = None
-        self.geocode_type = None
-        self.geometry_wkt = None
-        self.state_pid = None
-        self.alias_localities = dict()
-        self.locality_neighbours = dict()
-
-        # get data from DB
-        s = sql.SQL('''SELECT 
-                            l.locality_name, 
-                            l.date_created,
-                            l.date_retired,
-                            l.primary_postcode,
-                            lp.latitude,
-                            lp.longitude,
-                            s.uri AS state_uri, 
-                            s.prefLabel AS state_label
-                        FROM {dbschema}.locality l
-                        LEFT JOIN {dbschema}.locality_point lp on l.locality_pid = lp.locality_pid
-                        LEFT JOIN codes.state s ON CAST(l.state_pid AS text) = s.code
-                        WHERE l.locality_pid = {id}''') \
-            .format(dbschema=sql.Identifier(config.DB_SCHEMA), id=sql.Literal(self.id))
-
-        self.cursor.execute(s)
-        rows = self.cursor.fetchall()
-        for row in rows:
-            r = reg(self.cursor, row)
-            self.locality_name = r.locality_name.title()
-            self.latitude = r.latitude
-            self.longitude = r.longitude
-            self.date_created = r.date_created
-            self.date_retired = r.date_retired
-            self.state_uri = r.state_uri
-            self.state_label = r.state_label
-            if self.latitude is not None and self.longitude is not None:
-                self.geometry_wkt = self.make_wkt_literal(longitude=self.longitude, latitude=self.latitude)
-            break
-        else:
-            raise NotFoundError()
-
-        s2 = sql.SQL('''SELECT locality_alias_pid, name, uri, prefLabel 
-                        FROM {dbschema}.locality_alias 
-                        LEFT JOIN codes.alias a ON {dbschema}.locality_alias.alias_type_code = a.code 
-                        WHERE locality_pid = {id}''') \
-            .format(dbschema=sql.Identifier(config.DB_SCHEMA), id=sql.Literal(self.id))
-
-        # get just IDs, ordered, from the address_detail table, paginated by class init args
-        self.cursor.execute(s2)
-        rows = self.cursor.fetchall()
-        for row in rows:
-            r = reg(self.cursor, row)
-            alias = dict()
-            alias['locality_name'] = r.name.title()
-            alias['subclass_uri'] = r.uri
-            alias['subclass_label'] = r.preflabel
-            self.alias_localities[r.locality_alias_pid] = alias
-
-        # get a list of localityNeighbourIds from the locality_alias table
-        s3 = sql.SQL('''SELECT 
-                    a.neighbour_locality_pid,
-                    b.locality_name                
-                FROM {dbschema}.locality_neighbour a
-                INNER JOIN {dbschema}.locality_view b ON a.neighbour_locality_pid = b.locality_pid
-                WHERE a.locality_pid = {id}''') \
-            .format(dbschema=sql.Identifier(config.DB_SCHEMA), id=sql.Literal(self.id))
-        # get just IDs, ordered, from the address_detail table, paginated by class init args
-        self.cursor.execute(s3)
-        rows = self.cursor.fetchall()
-        for row in rows:
-            r = reg(self.cursor, row)
-            self.locality_neighbours[r.neighbour_locality_pid] = r.locality_name.title()
-
-    def __del__(self):
-        if self._cursor_context_manager:
-            self._cursor_context_manager.__exit__(None, None, None)
+        self._use_cursor(db_cursor)
+
+        try:
+            self.locality_name = None
+            self.latitude = None
+            self.longitude = None
+            self.date_created = None
+            self.date_retired = None
+            self.geocode_type = None
+            self.geometry_wkt = None
+            self.state_pid = None
+            self.alias_localities = dict()
+            self.locality_neighbours = dict()
+
+            # get data from DB
+            execute_prepared(self.cursor, 'locality', (self.id,))
+            rows = self.cursor.fetchall()
+            for row in rows:
+                r = reg(self.cursor, row)
+                self.locality_name = r.locality_name.title()
+                self.latitude = r.latitude
+                self.longitude = r.longitude
+                self.date_created = r.date_created
+                self.date_retired = r.date_retired
+                self.state_uri, self.state_label = get_code('state', r.state_pid)
+                if self.latitude is not None and self.longitude is not None:
+                    self.geometry_wkt = self.make_wkt_literal(longitude=self.longitude, latitude=self.latitude)
+                break
+            else:
+                raise NotFoundError()
+
+            # get just IDs, ordered, from the address_detail table, paginated by class init args
+            execute_prepared(self.cursor, 'locality_aliases', (self.id,))
+            rows = self.cursor.fetchall()
+            for row in rows:
+                r = reg(self.cursor, row)
+                alias = dict()
+                alias['locality_name'] = r.name.title()
+                alias['subclass_uri'], alias['subclass_label'] = get_code('alias', r.alias_type_code)
+                self.alias_localities[r.locality_alias_pid] = alias
+
+            # get a list of localityNeighbourIds from the locality_alias table
+            execute_prepared(self.cursor, 'locality_neighbours', (self.id,))
+            rows = self.cursor.fetchall()
+            for row in rows:
+                r = reg(self.cursor, row)
+                self.locality_neighbours[r.neighbour_locality_pid] = r.locality_name.title()
+        except Exception:
+            # the caller never gets this model to close, so put back any cursor it took from the pool
+            self.close()
+            raise
 
     def export_html(self, view='gnaf'):
         if view == 'gnaf':
@@ -129,21 +97,9 @@ class Locality(GNAFModel):
             )
 
         elif view == 'dct':
-            s = sql.SQL('''SELECT 
-                        locality_name, 
-                        latitude,
-                        longitude,
-                        geocode_type,
-                        locality_pid,
-                        state_pid
-                    FROM {dbschema}.locality_view
-                    WHERE locality_pid = {id}''') \
-                .format(dbschema=sql.Identifier(config.DB_SCHEMA), id=sql.Literal(self.id))
-
-
             cursor = self.cursor
             # get just IDs, ordered, from the address_detail table, paginated by class init args
-            cursor.execute(s)
+            execute_prepared(cursor, 'locality_view', (self.id,))
             for record in cursor:
                 locality_name = record[0]
                 latitude = record[1]
@@ -178,21 +134,9 @@ class Locality(GNAFModel):
 
         if view == 'ISO19160':
             # get the components from the DB needed for ISO19160
-            s = sql.SQL('''SELECT 
-                        locality_name, 
-                        latitude,
-                        longitude,
-                        geocode_type,
-                        locality_pid,
-                        state_pid
-                    FROM {dbschema}.locality_view
-                    WHERE locality_pid = {id}''') \
-                .format(dbschema=sql.Identifier(config.DB_SCHEMA), id=sql.Literal(self.id))
-
-
             cursor = self.cursor
             # get just IDs, ordered, from the address_detail table, paginated by class init args
-            cursor.execute(s)
+            execute_prepared(cursor, 'locality_view', (self.id,))
             for record in cursor:
                 ac_locality_value = record[0].title()
                 latitude = record[1]
@@ -288,3 +232,62 @@ class Locality(GNAFModel):
             raise RuntimeError("Cannot render an RDF representation of that View.")
         return g
 
+
+# prepared statements, by the name they are executed with
+register_statement(
+    'locality',
+    sql.SQL('''SELECT
+                    l.locality_name,
+                    l.date_created,
+                    l.date_retired,
+                    l.primary_postcode,
+                    lp.latitude,
+                    lp.longitude,
+                    CAST(l.state_pid AS text) state_pid
+                FROM {dbschema}.locality l
+                LEFT JOIN {dbschema}.locality_point lp on l.locality_pid = lp.locality_pid
+                WHERE l.locality_pid = {id}''') \
+        .format(dbschema=sql.Identifier(config.DB_SCHEMA), id=sql.Placeholder()),
+    ['text']
+)
+register_statement(
+    'locality_aliases',
+    sql.SQL('''SELECT locality_alias_pid, name, alias_type_code
+                FROM {dbschema}.locality_alias
+                WHERE locality_pid = {id}''') \
+        .format(dbschema=sql.Identifier(config.DB_SCHEMA), id=sql.Placeholder()),
+    ['text']
+)
+register_statement(
+    'locality_neighbours',
+    sql.SQL('''SELECT
+                    a.neighbour_locality_pid,
+                    b.locality_name
+                FROM {dbschema}.locality_neighbour a
+                INNER JOIN {dbschema}.locality_view b ON a.neighbour_locality_pid = b.locality_pid
+                WHERE a.locality_pid = {id}''') \
+        .format(dbschema=sql.Identifier(config.DB_SCHEMA), id=sql.Placeholder()),
+    ['text']
+)
+register_statement(
+    'locality_view',
+    sql.SQL('''SELECT
+                    locality_name,
+                    latitude,
+                    longitude,
+                    geocode_type,
+                    locality_pid,
+                    state_pid
+                FROM {dbschema}.locality_view
+                WHERE locality_pid = {id}''') \
+        .format(dbschema=sql.Identifier(config.DB_SCHEMA), id=sql.Placeholder()),
+    ['text']
+)
+register_statement(
+    'locality_last_modified',
+    sql.SQL('''SELECT GREATEST(date_created, date_retired)
+                FROM {dbschema}.locality
+                WHERE locality_pid = {id}''') \
+        .format(dbschema=sql.Identifier(config.DB_SCHEMA), id=sql.Placeholder()),
+    ['text']
+)
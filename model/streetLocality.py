@@ -1,6 +1,7 @@
 # -*- coding: utf-8 -*-
-from db import get_db_cursor, reg
+from db import reg, register_statement, execute_prepared
 from model import GNAFModel, NotFoundError
+from model.codes import get_code
 from flask import render_template
 from rdflib import Graph, URIRef, RDF, XSD, Namespace, Literal, BNode
 import _config as config
@@ -13,6 +14,8 @@ class StreetLocality(GNAFModel):
     and to be exported in a number of formats including RDF, according to the 'GNAF Ontology' and an
     expression of the Dublin Core ontology, HTML, XML in the form according to the AS4590 XML schema.
     """
+    LAST_MODIFIED_STATEMENT = 'street_locality_last_modified'
+    PID_TABLE = 'street_locality'
 
     def __init__(self, identifier, db_cursor=None):
         self.id = identifier
@@ -26,16 +29,7 @@ class StreetLocality(GNAFModel):
         self.street_suffix_label = None
         self.street_suffix_uri = None
         self.locality_pid = None
-        if db_cursor is not None:
-            self.cursor = db_cursor
-            self._cursor_context_manager = None
-        else:
-            self._cursor_context_manager = get_db_cursor()
-            self.cursor = self._cursor_context_manager.__enter__()
-
-    def __del__(self):
-        if self._cursor_context_manager:
-            self._cursor_context_manager.__exit__(None, None, None)
+        self._use_cursor(db_cursor)
 
     def export_html(self, view='gnaf'):
         if view == 'gnaf':
@@ -48,29 +42,9 @@ class StreetLocality(GNAFModel):
             street_string = None
 
             # make a human-readable street
-            s = sql.SQL('''SELECT 
-                        a.street_name, 
-                        a.street_type_code, 
-                        a.street_suffix_code,
-                        a.latitude,
-                        a.longitude,
-                        a.geocode_type,
-                        a.locality_pid,
-                        b.locality_name,
-                        st.prefLabel AS street_type_label,
-                        st.uri AS street_type_uri,
-                        ss.prefLabel AS street_suffix_label,
-                        ss.uri AS street_suffix_uri
-                    FROM {dbschema}.street_view a
-                      INNER JOIN {dbschema}.locality_view b ON a.locality_pid = b.locality_pid
-                      LEFT JOIN codes.street st ON a.street_type_code = st.code
-                      LEFT JOIN codes.streetsuffix ss ON a.street_suffix_code = ss.code
-                    WHERE street_locality_pid = {id}''') \
-                .format(id=sql.Literal(self.id), dbschema=sql.Identifier(config.DB_SCHEMA))
-
             cursor = self.cursor
             # get just IDs, ordered, from the address_detail table, paginated by class init args
-            cursor.execute(s)
+            execute_prepared(cursor, 'street_locality_html', (self.id,))
             rows = cursor.fetchall()
             for row in rows:
                 r = reg(cursor, row)
@@ -82,10 +56,8 @@ class StreetLocality(GNAFModel):
                 geocode_type = r.geocode_type.title() if r.geocode_type is not None else None
                 self.locality_pid = r.locality_pid
                 locality_name = r.locality_name.title()
-                self.street_type_label = r.street_type_label
-                self.street_type_uri = r.street_type_uri
-                self.street_suffix_label = r.street_suffix_label
-                self.street_suffix_uri = r.street_suffix_uri
+                self.street_type_uri, self.street_type_label = get_code('street', r.street_type_code)
+                self.street_suffix_uri, self.street_suffix_label = get_code('streetsuffix', r.street_suffix_code)
                 geometry_wkt = self.make_wkt_literal(
                     longitude=longitude, latitude=latitude
                 ) if latitude is not None else None
@@ -99,17 +71,7 @@ class StreetLocality(GNAFModel):
             else:
                 raise NotFoundError()
             # aliases
-            s2 = sql.SQL('''SELECT 
-                          street_locality_alias_pid,
-                          street_name,
-                          street_type_code,
-                          street_suffix_code,
-                          alias_type_code
-                        FROM {dbschema}.street_locality_alias 
-                        WHERE street_locality_pid = {id}''') \
-                .format(id=sql.Literal(self.id), dbschema=sql.Identifier(config.DB_SCHEMA))
-
-            cursor.execute(s2)
+            execute_prepared(cursor, 'street_locality_aliases', (self.id,))
             rows = cursor.fetchall()
             street_string = "Not Found"
             for row in rows:
@@ -148,21 +110,9 @@ class StreetLocality(GNAFModel):
             )
 
         elif view == 'dct':
-            s = sql.SQL('''SELECT 
-                        street_name, 
-                        street_type_code, 
-                        street_suffix_code,
-                        latitude,
-                        longitude,
-                        geocode_type,
-                        locality_pid
-                    FROM {dbschema}.street_view
-                    WHERE street_locality_pid = {id}''') \
-                .format(id=sql.Literal(self.id), dbschema=sql.Identifier(config.DB_SCHEMA))
-
             cursor = self.cursor
             # get just IDs, ordered, from the address_detail table, paginated by class init args
-            cursor.execute(s)
+            execute_prepared(cursor, 'street_locality_view', (self.id,))
             for record in cursor:
                 self.street_name = record[0]
                 self.street_type = record[1]
@@ -197,21 +147,9 @@ class StreetLocality(GNAFModel):
 
         if view == 'ISO19160':
             # get the components from the DB needed for ISO19160
-            s = sql.SQL('''SELECT 
-                        street_name, 
-                        street_type_code, 
-                        street_suffix_code,
-                        latitude,
-                        longitude,
-                        geocode_type,
-                        locality_pid
-                    FROM {dbschema}.street_view
-                    WHERE street_locality_pid = {id}''') \
-                .format(id=sql.Literal(self.id), dbschema=sql.Identifier(config.DB_SCHEMA))
-
             cursor = self.cursor
             # get just IDs, ordered, from the address_detail table, paginated by class init args
-            cursor.execute(s)
+            execute_prepared(cursor, 'street_locality_view', (self.id,))
             for record in cursor:
                 ac_street_value = record[0].title()
                 if(record[1] is not None):
@@ -256,20 +194,8 @@ class StreetLocality(GNAFModel):
 
         elif view == 'gnaf':
             # get the components from the DB needed for gnaf
-            s = sql.SQL('''SELECT 
-                        street_name, 
-                        street_type_code, 
-                        street_suffix_code,
-                        latitude,
-                        longitude,
-                        geocode_type,
-                        locality_pid
-                    FROM {dbschema}.street_view
-                    WHERE street_locality_pid = {id}''') \
-                .format(id=sql.Literal(self.id), dbschema=sql.Identifier(config.DB_SCHEMA))
-
             cursor = self.cursor
-            cursor.execute(s)
+            execute_prepared(cursor, 'street_locality_view', (self.id,))
             for record in cursor:
                 self.street_name = record[0].title()
                 if record[1] is not None:
@@ -335,3 +261,59 @@ class StreetLocality(GNAFModel):
         else:
             raise RuntimeError("Cannot render an RDF representation of that View.")
         return g
+
+
+# prepared statements, by the name they are executed with
+register_statement(
+    'street_locality_html',
+    sql.SQL('''SELECT
+                    a.street_name,
+                    a.street_type_code,
+                    a.street_suffix_code,
+                    a.latitude,
+                    a.longitude,
+                    a.geocode_type,
+                    a.locality_pid,
+                    b.locality_name
+                FROM {dbschema}.street_view a
+                  INNER JOIN {dbschema}.locality_view b ON a.locality_pid = b.locality_pid
+                WHERE street_locality_pid = {id}''') \
+        .format(id=sql.Placeholder(), dbschema=sql.Identifier(config.DB_SCHEMA)),
+    ['text']
+)
+register_statement(
+    'street_locality_aliases',
+    sql.SQL('''SELECT
+                  street_locality_alias_pid,
+                  street_name,
+                  street_type_code,
+                  street_suffix_code,
+                  alias_type_code
+                FROM {dbschema}.street_locality_alias
+                WHERE street_locality_pid = {id}''') \
+        .format(id=sql.Placeholder(), dbschema=sql.Identifier(config.DB_SCHEMA)),
+    ['text']
+)
+register_statement(
+    'street_locality_view',
+    sql.SQL('''SELECT
+                    street_name,
+                    street_type_code,
+                    street_suffix_code,
+                    latitude,
+                    longitude,
+                    geocode_type,
+                    locality_pid
+                FROM {dbschema}.street_view
+                WHERE street_locality_pid = {id}''') \
+        .format(id=sql.Placeholder(), dbschema=sql.Identifier(config.DB_SCHEMA)),
+    ['text']
+)
+register_statement(
+    'street_locality_last_modified',
+    sql.SQL('''SELECT GREATEST(date_created, date_retired)
+                FROM {dbschema}.street_locality
+                WHERE street_locality_pid = {id}''') \
+        .format(dbschema=sql.Identifier(config.DB_SCHEMA), id=sql.Placeholder()),
+    ['text']
+)
@@ -94,15 +94,20 @@ else:
     m_Worker = None
 
 
-def request_register_query(uri, page=1, per_page=500):
+def request_register_query(uri, page=1, per_page=500, after=None):
     for _i in APP_REGISTERS:
         (r_uri, r_rule, r_endpoint_func) = _i
         if r_uri == str(uri):
             break
     else:
         raise RuntimeError("App does not have endpoint for uri: {}".format(uri))
-    dummy_request_uri = "http://localhost:5000" + str(r_rule) +\
-                     "?_view=reg&_format=_internal&per_page={}&page={}".format(per_page, page)
+    if after is not None:
+        # the page of items after the item with this ID, which the register reads straight from its index
+        dummy_request_uri = "http://localhost:5000" + str(r_rule) +\
+                         "?_view=reg&_format=_internal&per_page={}&after={}".format(per_page, after)
+    else:
+        dummy_request_uri = "http://localhost:5000" + str(r_rule) +\
+                         "?_view=reg&_format=_internal&per_page={}&page={}".format(per_page, page)
     test_context = app.test_request_context(dummy_request_uri)
     with test_context:
         resp = r_endpoint_func()
@@ -294,13 +299,13 @@ def harvest_register(reg_uri):
     else:
         save_register_index = False
     if (not USE_SAVED_REGISTER_INDEX) or save_register_index:
-        page = 1
+        after = ''  # before the first ID
         while True:
             try:
-                new_instances = request_register_query(reg_uri, page=page, per_page=10000)
+                new_instances = request_register_query(reg_uri, per_page=10000, after=after)
                 assert len(new_instances) > 0
                 instances.extend([i[0] for i in new_instances])
-                page += 1
+                after = new_instances[-1][2]
             except (NotFoundError, AssertionError) as e:
                 err(repr(e))
                 break
@@ -0,0 +1,205 @@
+"""
+Writing the graph builders' N-Triples output: buffered, split into files of at most so many records or bytes and,
+optionally, compressed as it's written.
+
+Compression is gzip, or zstd which needs the zstandard package unless it's done by the zstd program. It's done either
+as the data is written, in a thread of its own or by a gzip or zstd process the data is piped to, which keeps it off
+the builder's own thread.
+"""
+import gzip
+import os
+import subprocess
+import threading
+from queue import Queue
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+EXTENSIONS = {None: '.nt', 'gzip': '.nt.gz', 'zstd': '.nt.zst'}
+COMMANDS = {'gzip': ['gzip', '-c', '-6'], 'zstd': ['zstd', '-c', '-q', '-3']}
+# bytes of records gathered before each write, so each write is one large one
+BUFFER_SIZE = 4 * 1024 * 1024
+
+
+def _open_file(path, compression):
+    """Opens a file to write bytes to, compressing them in this thread"""
+    if compression is None:
+        return open(path, 'wb')
+    if compression == 'gzip':
+        return gzip.open(path, 'wb', compresslevel=6)
+    if compression == 'zstd':
+        if zstandard is None:
+            raise ValueError("zstd compression needs the zstandard package, or compress_in='process'")
+        return zstandard.ZstdCompressor(level=3).stream_writer(open(path, 'wb'))
+    raise ValueError('Unknown compression {}'.format(compression))
+
+
+class _ThreadFile(object):
+    """A file written, & so compressed, by a thread of its own, with a few writes queued for it at most"""
+    def __init__(self, f):
+        self._f = f
+        self._queue = Queue(maxsize=4)
+        self._error = None
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def _run(self):
+        while True:
+            data = self._queue.get()
+            if data is None:
+                break
+            if self._error is None:
+                try:
+                    self._f.write(data)
+                except Exception as e:
+                    self._error = e
+        try:
+            self._f.close()
+        except Exception as e:
+            self._error = self._error or e
+
+    def write(self, data):
+        if self._error is not None:
+            raise self._error
+        self._queue.put(data)
+
+    def close(self):
+        self._queue.put(None)
+        self._thread.join()
+        if self._error is not None:
+            raise self._error
+
+
+class _ProcessFile(object):
+    """A file written by a gzip or zstd process, which the data is piped to"""
+    def __init__(self, path, compression):
+        self._f = open(path, 'wb')
+        self._process = subprocess.Popen(COMMANDS[compression], stdin=subprocess.PIPE, stdout=self._f)
+
+    def write(self, data):
+        self._process.stdin.write(data)
+
+    def close(self):
+        self._process.stdin.close()
+        returncode = self._process.wait()
+        self._f.close()
+        if returncode != 0:
+            raise IOError('{} exited with {}'.format(self._process.args[0], returncode))
+
+
+class NTriplesWriter(object):
+    """
+    Writes records, each the N-Triples lines of an instance, to a series of files <stem>NNNN.nt, or .nt.gz or .nt.zst if
+    compressed, starting a new file once the current one has max_records records or max_bytes bytes, before any
+    compression. A record is never split across files.
+
+    Each file is written as <name>.part & renamed to <name> once it's complete, so a file without .part is whole. If
+    the writer is left by an exception, the file being written is left as a .part file.
+
+        with NTriplesWriter('data-locality-1-', max_records=100000, compression='gzip') as w:
+            for triples in ...:
+                w.write(triples)
+        files = w.files
+    """
+    def __init__(self, stem, first_number=1, max_records=None, max_bytes=None, compression=None, compress_in=None):
+        """
+        :param stem: the start of each file's path, to which the file's number & extension are added
+        :param first_number: the number of the first file
+        :param max_records: the most records per file, or None for no limit
+        :param max_bytes: the most bytes per file, before compression, or None for no limit
+        :param compression: None, 'gzip' or 'zstd'
+        :param compress_in: None to compress as the data is written, 'thread' to do so in a thread or 'process' to pipe
+            the data to a gzip or zstd process
+        """
+        if compression not in EXTENSIONS:
+            raise ValueError('Unknown compression {}'.format(compression))
+        if compress_in not in (None, 'thread', 'process'):
+            raise ValueError('Unknown compress_in {}'.format(compress_in))
+        self.stem = stem
+        self.number = first_number
+        self.max_records = max_records
+        self.max_bytes = max_bytes
+        self.compression = compression
+        self.compress_in = compress_in
+        # dicts of the file, & its numbers of records, triples & bytes before compression, of each file completed
+        self.files = []
+        self._f = None
+        self._path = None
+        self._buffer = []
+        self._buffered = 0
+
+    def _open(self):
+        self._path = self.stem + str(self.number).zfill(4) + EXTENSIONS[self.compression]
+        part_path = self._path + '.part'
+        if self.compress_in == 'process' and self.compression is not None:
+            self._f = _ProcessFile(part_path, self.compression)
+        elif self.compress_in == 'thread':
+            self._f = _ThreadFile(_open_file(part_path, self.compression))
+        else:
+            self._f = _open_file(part_path, self.compression)
+        self._records = 0
+        self._triples = 0
+        self._bytes = 0
+
+    def _flush(self):
+        if self._buffer:
+            self._f.write(''.join(self._buffer).encode('utf-8'))
+            self._buffer = []
+            self._buffered = 0
+
+    def _finish(self):
+        self._flush()
+        self._f.close()
+        self._f = None
+        os.replace(self._path + '.part', self._path)
+        self.files.append({
+            'file': self._path,
+            'records': self._records,
+            'triples': self._triples,
+            'bytes': self._bytes
+        })
+        self.number += 1
+
+    def write(self, record):
+        """
+        :param record: str of the N-Triples lines of one instance, each ending in a newline
+        """
+        if self._f is None:
+            self._open()
+        size = len(record)
+        self._buffer.append(record)
+        self._buffered += size
+        self._records += 1
+        self._triples += record.count('\n')
+        self._bytes += size
+        if self._buffered >= BUFFER_SIZE:
+            self._flush()
+        if (self.max_records is not None and self._records >= self.max_records) or \
+                (self.max_bytes is not None and self._bytes >= self.max_bytes):
+            self._finish()
+
+    def close(self):
+        """Completes the file being written, if any"""
+        if self._f is not None:
+            self._finish()
+        return self.files
+
+    def abandon(self):
+        """Stops writing, leaving the file being written, if any, as a .part file"""
+        if self._f is not None:
+            self._buffer = []
+            try:
+                self._f.close()
+            finally:
+                self._f = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        if exc_type is None:
+            self.close()
+        else:
+            self.abandon()
@@ -0,0 +1,51 @@
+"""
+Writing N-Triples as text, for exporting many instances without building an rdflib Graph for each.
+
+The terms are written exactly as rdflib's N-Triples serializer writes the equivalent rdflib terms, so exported triples
+are the same, byte for byte, as those of the models' export_rdf() graphs.
+"""
+import re
+
+XSD = 'http://www.w3.org/2001/XMLSchema#'
+XSD_STRING = XSD + 'string'
+XSD_INTEGER = XSD + 'integer'
+XSD_DATE = XSD + 'date'
+
+_NON_ASCII = re.compile('[^\x00-\x7f]')
+
+
+def _escape_non_ascii(m):
+    c = ord(m.group())
+    return '\\u%04X' % c if c <= 0xFFFF else '\\U%08X' % c
+
+
+def uri(value):
+    """An IRI"""
+    return '<' + value + '>'
+
+
+def bnode(label):
+    """A blank node, labelled to be unique within the file it's written to"""
+    return '_:' + label
+
+
+def literal(value, datatype=XSD_STRING):
+    """
+    A typed literal. Like rdflib, integers given as text are written in their canonical form, e.g. '0800' as 800, and
+    None is written as 'None'.
+
+    :param value: the literal's value, which is written as str(value)
+    :param datatype: the datatype's IRI
+    """
+    if datatype == XSD_INTEGER:
+        try:
+            value = int(value)
+        except (TypeError, ValueError):
+            pass
+    text = str(value).replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"').replace('\r', '\\r')
+    return '"' + _NON_ASCII.sub(_escape_non_ascii, text) + '"^^<' + datatype + '>'
+
+
+def triple(subject, predicate, object):
+    """A line of N-Triples, from terms made by uri(), bnode() & literal()"""
+    return subject + ' ' + predicate + ' ' + object + ' .\n'
@@ -0,0 +1,156 @@
+"""
+Sorted, fixed-width files of all the pids of each class, one per table & dataset release. Every worker memory-maps them
+to tell whether an instance exists without querying the database, so requests for unknown pids can 404 straight away.
+
+Build them after each load, with the database & PID_INDEX_DIR configured in _config:
+
+    python3 pid_index.py
+"""
+import logging
+import mmap
+import os
+import struct
+import threading
+
+logger = logging.getLogger(__name__)
+
+# the tables whose pids are indexed & their pid columns
+PID_TABLES = {
+    'address_detail': 'address_detail_pid',
+    'address_site': 'address_site_pid',
+    'locality': 'locality_pid',
+    'street_locality': 'street_locality_pid',
+}
+
+MAGIC = b'GNAFPIDS'
+# magic, the width each pid is padded to, the number of pids
+HEADER = struct.Struct('<8sII')
+
+
+class PidIndex(object):
+    """
+    A memory-mapped file of pids, sorted bytewise & NUL-padded to the same width, which is binary searched
+    """
+    def __init__(self, path):
+        with open(path, 'rb') as f:
+            self._mmap = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, self.width, self.count = HEADER.unpack_from(self._mmap, 0)
+        if magic != MAGIC or len(self._mmap) != HEADER.size + self.width * self.count:
+            self._mmap.close()
+            raise ValueError('{} is not a pid index'.format(path))
+
+    def _pid_at(self, i):
+        start = HEADER.size + i * self.width
+        return self._mmap[start:start + self.width]
+
+    def __contains__(self, pid):
+        try:
+            key = pid.encode('ascii')
+        except UnicodeEncodeError:
+            return False
+        if len(key) > self.width:
+            return False
+        key = key.ljust(self.width, b'\0')
+        lo, hi = 0, self.count
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if self._pid_at(mid) < key:
+                lo = mid + 1
+            else:
+                hi = mid
+        return lo < self.count and self._pid_at(lo) == key
+
+    def __len__(self):
+        return self.count
+
+    def close(self):
+        self._mmap.close()
+
+
+def index_path(directory, table, release):
+    return os.path.join(directory, '{}-{}.pids'.format(table, release))
+
+
+def write_pid_index(path, pids, width):
+    """
+    Writes a pid index, atomically, so workers that have the old one mapped keep it until they next open it
+
+    :param path: the file to write
+    :param pids: the pids, as str, sorted bytewise
+    :param width: the length of the longest pid
+    :return: the number of pids written
+    """
+    tmp_path = '{}.tmp'.format(path)
+    count = 0
+    with open(tmp_path, 'wb') as f:
+        f.write(HEADER.pack(MAGIC, width, 0))
+        for pid in pids:
+            f.write(pid.encode('ascii').ljust(width, b'\0'))
+            count += 1
+        f.seek(0)
+        f.write(HEADER.pack(MAGIC, width, count))
+    os.replace(tmp_path, path)
+    return count
+
+
+_indexes = {}
+_indexes_lock = threading.Lock()
+
+
+def get_pid_index(directory, table, release):
+    """
+    Gets the index of a table's pids for a dataset release, which is opened once per process
+
+    :return: the PidIndex, or None if there isn't one for this release, in which case every pid might exist
+    """
+    path = index_path(directory, table, release)
+    if path not in _indexes:
+        with _indexes_lock:
+            if path not in _indexes:
+                try:
+                    _indexes[path] = PidIndex(path)
+                except (OSError, ValueError) as e:
+                    logger.warning("No pid index for {} ({}), so all its pids are looked up".format(table, e))
+                    _indexes[path] = None
+    return _indexes[path]
+
+
+def build_pid_indexes(directory, release):
+    """
+    Writes the index of each table's pids, reading them from the database in bytewise order with a server-side cursor
+
+    :param directory: where to write them
+    :param release: the dataset release they're for
+    """
+    from psycopg2 import sql
+    import _config as config
+    from db import get_db_connection
+
+    os.makedirs(directory, exist_ok=True)
+    with get_db_connection() as con:
+        for table, pid_column in PID_TABLES.items():
+            with con.cursor() as cursor:
+                cursor.execute(sql.SQL('SELECT COALESCE(MAX(octet_length({pid})), 1) FROM {dbschema}.{table}').format(
+                    pid=sql.Identifier(pid_column),
+                    dbschema=sql.Identifier(config.DB_SCHEMA),
+                    table=sql.Identifier(table)
+                ))
+                width = cursor.fetchone()[0]
+            with con.cursor(name='pid_index_{}'.format(table)) as cursor:
+                cursor.itersize = 100000
+                cursor.execute(sql.SQL('SELECT {pid} FROM {dbschema}.{table} ORDER BY {pid} COLLATE "C"').format(
+                    pid=sql.Identifier(pid_column),
+                    dbschema=sql.Identifier(config.DB_SCHEMA),
+                    table=sql.Identifier(table)
+                ))
+                path = index_path(directory, table, release)
+                count = write_pid_index(path, (row[0] for row in cursor), width)
+            logger.info('Wrote {} {} pids to {}'.format(count, table, path))
+        con.rollback()
+
+
+if __name__ == '__main__':
+    logging.basicConfig(level=logging.INFO)
+    import _config as config
+    from view.ldapi import DATASET_RELEASE
+    build_pid_indexes(config.PID_INDEX_DIR, DATASET_RELEASE)
@@ -1,12 +1,94 @@
 # -*- coding: utf-8 -*-
-from flask import render_template, Response
+import datetime
+import hashlib
+import json
+import logging
+import time
+from flask import render_template, Response, copy_current_request_context
+from werkzeug.http import http_date, is_resource_modified, unquote_etag
 from psycopg2 import sql
 import pyldapi
+from rdflib import Namespace, URIRef, RDF
 
 import _config as config
-from db import get_db_cursor
+from cache import LRUCache, SingleFlight, make_l2_cache
+from pid_index import get_pid_index
+from db import get_shared_cursor
 from model import NotFoundError
 
+logger = logging.getLogger(__name__)
+
+# identifies the loaded data, so that loading a new release invalidates everything cached from the old one at once
+DATASET_RELEASE = str(getattr(config, 'DATASET_RELEASE', config.DB_SCHEMA))
+# when that release was loaded, as 'YYYY-MM-DD', which no instance response is older than
+DATASET_RELEASE_DATE = getattr(config, 'DATASET_RELEASE_DATE', None)
+if DATASET_RELEASE_DATE is not None:
+    DATASET_RELEASE_DATE = datetime.datetime.strptime(str(DATASET_RELEASE_DATE), '%Y-%m-%d').date()
+# where pid_index.py wrote its files of each class's pids, so unknown pids 404 without a query, or None not to
+PID_INDEX_DIR = getattr(config, 'PID_INDEX_DIR', None)
+# seconds clients & proxies may reuse an instance response for before revalidating it
+RESPONSE_MAX_AGE = getattr(config, 'RESPONSE_MAX_AGE', 24 * 60 * 60)
+
+# rendered instance responses, keyed by (dataset release, renderer class, identifier, view, format)
+response_cache = LRUCache(
+    max_bytes=getattr(config, 'RESPONSE_CACHE_MAX_BYTES', 256 * 1024 * 1024),
+    ttl=getattr(config, 'RESPONSE_CACHE_TTL', 24 * 60 * 60),
+    stale_ttl=getattr(config, 'RESPONSE_CACHE_STALE_TTL', 24 * 60 * 60)
+)
+# the same, shared by all workers: 'sqlite' with a file path, or 'memcached' with a 'host:port', or None
+response_l2_cache = make_l2_cache(
+    getattr(config, 'RESPONSE_CACHE_L2_BACKEND', None),
+    getattr(config, 'RESPONSE_CACHE_L2_LOCATION', None),
+    getattr(config, 'RESPONSE_CACHE_L2_TTL', 7 * 24 * 60 * 60)
+)
+
+
+# the headers _make_validators() adds, which are also sent with 304 Not Modified responses
+VALIDATOR_HEADERS = ('ETag', 'Last-Modified', 'Cache-Control', 'Vary')
+
+# renders in progress, so concurrent requests for the same response wait for one render rather than each doing their own
+response_flights = SingleFlight()
+# seconds to wait for another request's render before rendering anyway
+RESPONSE_FLIGHT_TIMEOUT = getattr(config, 'RESPONSE_FLIGHT_TIMEOUT', 60)
+
+
+def _l2_key(key):
+    return '/'.join(str(part) for part in key)
+
+
+def get_l2_response(key):
+    """
+    :param key: the response_cache key
+    :return: the cached (body, status, headers), or None if it isn't cached or the second-level cache failed
+    """
+    if response_l2_cache is None:
+        return None
+    try:
+        packed = response_l2_cache.get(_l2_key(key))
+    except Exception as e:
+        logger.warning("Couldn't get {} from the second-level cache: {}".format(key, e))
+        return None
+    if packed is None:
+        return None
+    head, _, body = packed.partition(b'\n')
+    status, headers = json.loads(head.decode('utf-8'))
+    return body, status, [tuple(header) for header in headers]
+
+
+def set_l2_response(key, entry):
+    """
+    :param key: the response_cache key
+    :param entry: (body, status, headers) to cache
+    """
+    if response_l2_cache is None:
+        return
+    body, status, headers = entry
+    packed = json.dumps([status, headers]).encode('utf-8') + b'\n' + body
+    try:
+        response_l2_cache.set(_l2_key(key), packed)
+    except Exception as e:
+        logger.warning("Couldn't set {} in the second-level cache: {}".format(key, e))
+
 DCTView = pyldapi.View('dct',
                        "Dublin Core Terms from the Dublin Core Metadata Initiative",
                        ["text/html", "text/turtle", "application/rdf+xml", "application/ld+json", "application/n-triples", "application/xml", "_internal"],
@@ -63,6 +145,7 @@ def render_error(request, e):
 
 class GNAFClassRenderer(pyldapi.Renderer):
     GNAF_CLASS = None
+    MODEL_CLASS = None  # the GNAFModel rendered, which gives instances' last-modified dates for validators
 
     def __init__(self, request, uri, views, default_view_token, *args,
                  gnaf_template=None, dct_template=None, **kwargs):
@@ -82,13 +165,136 @@ class GNAFClassRenderer(pyldapi.Renderer):
         self.gnaf_template = gnaf_template
         self.dct_template = dct_template
         self.identifier = None  # inheriting classes will need to add the Identifier themselves.
-        self.instance = None  # inheriting classes will need to add the Instance themselves.
+        self.instance = None  # loaded by _load_instance() when first needed to render
+
+    def _load_instance(self):
+        """Loads the model instance to render. Inheriting classes must implement this."""
+        raise NotImplementedError()
 
     def render(self):
         response = super(GNAFClassRenderer, self).render()
         if response is not None:
             return response
+        if self.format == '_internal':
+            return self._render_instance()
+        if self._is_unknown():
+            from flask import request
+            return render_error(request, NotFoundError())
+
+        # serve from the caches if possible, refreshing stale responses in the background. Cached responses carry
+        # their validators, so conditional requests for them are answered without going to the database.
+        key = (DATASET_RELEASE, self.__class__.__name__, self.identifier, self.view, self.format)
+        cached = response_cache.get(key)
+        if cached is not None:
+            entry, is_fresh = cached
+            if not is_fresh:
+                response_cache.refresh(key, copy_current_request_context(lambda: self._render_for_cache(key)))
+        else:
+            entry = get_l2_response(key)
+            if entry is not None:
+                response_cache.set(key, entry, len(entry[0]))
+        if entry is None:
+            validators = self._make_validators()
+            if self._is_not_modified(validators):
+                return Response(status=304, headers=validators)
+            # concurrent requests for this response share one render
+            entry = response_flights.do(key, lambda: self._render_to_caches(key, validators),
+                                        timeout=RESPONSE_FLIGHT_TIMEOUT)
+
+        body, status, headers = entry
+        validators = {k: v for k, v in headers if k in VALIDATOR_HEADERS}
+        if self._is_not_modified(validators):
+            return Response(status=304, headers=validators)
+        return Response(body, status=status, headers=headers)
+
+    def _render_entry(self, validators):
+        """
+        :param validators: headers from _make_validators(), for a successful response
+        :return: the rendered response as (body, status, headers)
+        """
+        response = self._render_instance()
+        if response.status_code == 200:
+            response.headers.update(validators)
+        return response.get_data(), response.status_code, list(response.headers)
+
+    def _render_to_caches(self, key, validators):
+        entry = self._render_entry(validators)
+        if entry[1] == 200:
+            response_cache.set(key, entry, len(entry[0]))
+            set_l2_response(key, entry)
+        return entry
+
+    def _render_for_cache(self, key):
+        entry = self._render_entry(self._make_validators())
+        if entry[1] != 200:
+            return None
+        set_l2_response(key, entry)
+        return entry, len(entry[0])
+
+    def _is_unknown(self):
+        """
+        :return: True if the identifier can't be of an instance, going by what the class's pids look like & by its pid
+        index if there is one, so the database needn't be asked
+        """
+        model = self.MODEL_CLASS
+        if model is None:
+            return False
+        if not model.PID_PATTERN.fullmatch(self.identifier or ''):
+            return True
+        if PID_INDEX_DIR is None or model.PID_TABLE is None:
+            return False
+        index = get_pid_index(PID_INDEX_DIR, model.PID_TABLE, DATASET_RELEASE)
+        return index is not None and self.identifier not in index
+
+    def _make_validators(self):
+        """
+        Makes the ETag, Last-Modified & caching headers for this instance in this view & format, from its
+        last-modified date & the dataset release, without loading it
+
+        :return: dict of headers, empty if the instance has no last-modified date or it couldn't be got
+        """
+        if self.MODEL_CLASS is None or self.MODEL_CLASS.LAST_MODIFIED_STATEMENT is None:
+            return {}
         try:
+            last_modified = self.MODEL_CLASS.last_modified(self.identifier)
+        except Exception as e:
+            logger.warning("Couldn't get the last-modified date of {}: {}".format(self.identifier, e))
+            return {}
+        if last_modified is None:
+            return {}  # no such instance, which rendering will 404
+        if DATASET_RELEASE_DATE is not None:
+            last_modified = max(last_modified, DATASET_RELEASE_DATE)
+        etag = hashlib.sha1('/'.join(
+            str(part) for part in (DATASET_RELEASE, self.GNAF_CLASS, self.identifier, self.view, self.format,
+                                   last_modified)
+        ).encode('utf-8')).hexdigest()
+        return {
+            'ETag': '"{}"'.format(etag),
+            'Last-Modified': http_date(last_modified),
+            'Cache-Control': 'public, max-age={}'.format(RESPONSE_MAX_AGE),
+            'Vary': 'Accept, Accept-Profile'
+        }
+
+    def _is_not_modified(self, validators):
+        """
+        :param validators: headers from _make_validators()
+        :return: True if the request's If-None-Match or If-Modified-Since show the client already has this response
+        """
+        if 'ETag' not in validators:
+            return False
+        return not is_resource_modified(
+            self.request.environ,
+            etag=unquote_etag(validators['ETag'])[0],
+            last_modified=validators.get('Last-Modified')
+        )
+
+    def _render_instance(self):
+        try:
+            if self.instance is None:
+                try:
+                    self.instance = self._load_instance()
+                except NotFoundError as nfe:
+                    self.instance = nfe
             if isinstance(self.instance, NotFoundError):
                 raise self.instance  # we have a 404, send it to the render_error catcher below.
             if self.view == 'gnaf':
@@ -187,59 +393,47 @@ class GNAFClassRenderer(pyldapi.Renderer):
         _views['gnaf'] = GNAFView
 
 
+# the table & pid column of each register, keyed by the class of the items it contains, & the label of its items
+REGISTER_TABLES = {
+    'http://linked.data.gov.au/def/gnaf#Address': ('address_detail', 'address_detail_pid', 'Address'),
+    'http://linked.data.gov.au/def/gnaf#Locality': ('locality', 'locality_pid', 'Locality'),
+    'http://linked.data.gov.au/def/gnaf#StreetLocality': ('street_locality', 'street_locality_pid', 'Street Locality'),
+    'http://linked.data.gov.au/def/gnaf#AddressSite': ('address_site', 'address_site_pid', 'Address Site'),
+}
+
+# seconds a finding that the register_page_boundary table doesn't exist is trusted for before it's checked again
+PAGE_BOUNDARIES_RECHECK = getattr(config, 'PAGE_BOUNDARIES_RECHECK', 60)
+_page_boundaries_installed = False
+_page_boundaries_checked_at = None
+
+
+def page_boundaries_installed(cursor):
+    """
+    Finding the table is remembered for good but not finding it only for PAGE_BOUNDARIES_RECHECK seconds, so a table
+    made after the workers have started, e.g. during a deploy, is found soon after rather than after a restart.
+
+    :param cursor: a cursor to check with
+    :return: True if the register_page_boundary table, made by _install/create_register_pages.sql, exists
+    """
+    global _page_boundaries_installed, _page_boundaries_checked_at
+    if not _page_boundaries_installed and (_page_boundaries_checked_at is None or
+                                           time.monotonic() - _page_boundaries_checked_at >= PAGE_BOUNDARIES_RECHECK):
+        cursor.execute(sql.SQL('SELECT to_regclass({table}) IS NOT NULL').format(
+            table=sql.Literal('{}.register_page_boundary'.format(config.DB_SCHEMA))))
+        _page_boundaries_installed = cursor.fetchone()[0]
+        _page_boundaries_checked_at = time.monotonic()
+    return _page_boundaries_installed
+
+
 class GNAFRegisterRenderer(pyldapi.RegisterRenderer):
     def _get_contained_items_from_db(self, page, per_page):
         cic = self.contained_item_classes[0]
         try:
-            with get_db_cursor() as cursor:
-                if cic == 'http://linked.data.gov.au/def/gnaf#Address':
-                    id_query = sql.SQL('''SELECT address_detail_pid
-                                       FROM {dbschema}.address_detail
-                                       ORDER BY address_detail_pid
-                                       LIMIT {limit}
-                                       OFFSET {offset}''').format(
-                        limit=sql.Literal(per_page),
-                        offset=sql.Literal((page - 1) * per_page),
-                        dbschema=sql.Identifier(config.DB_SCHEMA)
-                    )
-                    label_prefix = 'Address'
-                elif cic == 'http://linked.data.gov.au/def/gnaf#Locality':
-                    id_query = sql.SQL('''SELECT locality_pid
-                                       FROM {dbschema}.locality
-                                       ORDER BY locality_pid
-                                       LIMIT {limit}
-                                       OFFSET {offset}''').format(
-                        limit=sql.Literal(per_page),
-                        offset=sql.Literal((page - 1) * per_page),
-                        dbschema=sql.Identifier(config.DB_SCHEMA)
-                    )
-                    label_prefix = 'Locality'
-                elif cic == 'http://linked.data.gov.au/def/gnaf#StreetLocality':
-                    id_query = sql.SQL('''SELECT street_locality_pid
-                                       FROM {dbschema}.street_locality
-                                       ORDER BY street_locality_pid
-                                       LIMIT {limit}
-                                       OFFSET {offset}''').format(
-                        limit=sql.Literal(per_page),
-                        offset=sql.Literal((page - 1) * per_page),
-                        dbschema=sql.Identifier(config.DB_SCHEMA)
-                    )
-                    label_prefix = 'Street Locality'
-                elif cic == 'http://linked.data.gov.au/def/gnaf#AddressSite':
-                    id_query = sql.SQL('''SELECT address_site_pid
-                                       FROM {dbschema}.address_site
-                                       ORDER BY address_site_pid
-                                       LIMIT {limit}
-                                       OFFSET {offset}''').format(
-                        limit=sql.Literal(per_page),
-                        offset=sql.Literal((page - 1) * per_page),
-                        dbschema=sql.Identifier(config.DB_SCHEMA)
-                    )
-                    label_prefix = 'Address Site'
-                else:
-                    raise RuntimeError("Cannot get DB objects for unknown contained item class.")
-
-                cursor.execute(id_query)
+            if cic not in REGISTER_TABLES:
+                raise RuntimeError("Cannot get DB objects for unknown contained item class.")
+            table, pid_column, label_prefix = REGISTER_TABLES[cic]
+            with get_shared_cursor() as cursor:
+                cursor.execute(self._make_id_query(cursor, table, pid_column, page, per_page))
                 rows = cursor.fetchall()
             for row in rows:
                 item_pid = row[0]
@@ -250,6 +444,82 @@ class GNAFRegisterRenderer(pyldapi.RegisterRenderer):
             print("Uh oh, can't connect to DB. Invalid dbname, user or password?")
             print(e)
 
+    def _make_id_query(self, cursor, table, pid_column, page, per_page):
+        """
+        Makes the query for a page of a register's IDs. Pages after a given ID are read by a keyset query, pid > after,
+        along the table's primary key btree. Numbered pages start from the nearest page boundary before them, if the
+        boundaries are installed, so only the rows between that & the page are skipped rather than all those before it.
+        """
+        if self.after is not None:
+            return sql.SQL('''SELECT {pid}
+                              FROM {dbschema}.{table}
+                              WHERE {pid} > {after}
+                              ORDER BY {pid}
+                              LIMIT {limit}''').format(
+                pid=sql.Identifier(pid_column),
+                dbschema=sql.Identifier(config.DB_SCHEMA),
+                table=sql.Identifier(table),
+                after=sql.Literal(self.after),
+                limit=sql.Literal(per_page)
+            )
+        offset = (page - 1) * per_page
+        if offset > 0 and page_boundaries_installed(cursor):
+            cursor.execute(sql.SQL('''SELECT row_offset, pid
+                                      FROM {dbschema}.register_page_boundary
+                                      WHERE register = {register} AND row_offset <= {offset}
+                                      ORDER BY row_offset DESC
+                                      LIMIT 1''').format(
+                dbschema=sql.Identifier(config.DB_SCHEMA),
+                register=sql.Literal(table),
+                offset=sql.Literal(offset)
+            ))
+            boundary = cursor.fetchone()
+            if boundary is not None:
+                row_offset, boundary_pid = boundary
+                return sql.SQL('''SELECT {pid}
+                                  FROM {dbschema}.{table}
+                                  WHERE {pid} >= {boundary_pid}
+                                  ORDER BY {pid}
+                                  LIMIT {limit}
+                                  OFFSET {offset}''').format(
+                    pid=sql.Identifier(pid_column),
+                    dbschema=sql.Identifier(config.DB_SCHEMA),
+                    table=sql.Identifier(table),
+                    boundary_pid=sql.Literal(boundary_pid),
+                    limit=sql.Literal(per_page),
+                    offset=sql.Literal(offset - row_offset)
+                )
+        return sql.SQL('''SELECT {pid}
+                          FROM {dbschema}.{table}
+                          ORDER BY {pid}
+                          LIMIT {limit}
+                          OFFSET {offset}''').format(
+            pid=sql.Identifier(pid_column),
+            dbschema=sql.Identifier(config.DB_SCHEMA),
+            table=sql.Identifier(table),
+            limit=sql.Literal(per_page),
+            offset=sql.Literal(offset)
+        )
+
+    def _keyset_page_uri(self, after):
+        return '{}?per_page={}&after={}'.format(self.uri, self.per_page, after)
+
+    def _set_keyset_links(self):
+        """
+        Replaces the page number Link headers with one to the page after this page's last item, if this page is full,
+        since first, prev, next & last pages by number aren't the pages before & after a page of items after an ID
+        """
+        links = [link for link in self.headers.get('Link', '').split(', ')
+                 if link and not link.endswith(('rel="first"', 'rel="prev"', 'rel="next"', 'rel="last"'))]
+        self.first_page = None
+        self.prev_page = None
+        self.next_page = None
+        self.last_page = None
+        if len(self.register_items) >= self.per_page:
+            self.next_after = self.register_items[-1][2]
+            links.append('<{}>; rel="next"'.format(self._keyset_page_uri(self.next_after)))
+        self.headers['Link'] = ', '.join(links)
+
     def __init__(self, _request, uri, label, comment, contained_item_classes,
                  register_total_count, *args, views=None,
                  default_view_token=None, **kwargs):
@@ -268,10 +538,16 @@ class GNAFRegisterRenderer(pyldapi.RegisterRenderer):
                     self.format = 'text/html'
         except AttributeError:
             pass
+        # the ID to start the page after, given instead of a page number to page through the register by its IDs
+        self.after = _request.args.get('after')
+        # the ID to start the page after this one after, if paging by ID & this page isn't the last
+        self.next_after = None
         if self.view == "alternates":
             pass
         else:
             self._get_contained_items_from_db(self.page, self.per_page)
+            if self.after is not None:
+                self._set_keyset_links()
 
     def render(self):
         try:
@@ -280,6 +556,32 @@ class GNAFRegisterRenderer(pyldapi.RegisterRenderer):
             from flask import request
             return render_error(request, e)
 
+    def _render_reg_view_html(self, template_context=None):
+        _template_context = {'after': self.after}
+        if self.after is not None:
+            # the page number links would all be to this same page, as the after argument decides which items it has
+            _template_context['pagination'] = None
+            if self.next_after is not None:
+                _template_context['next_page_uri'] = self._keyset_page_uri(self.next_after)
+        if template_context is not None and isinstance(template_context, dict):
+            _template_context.update(template_context)
+        return super(GNAFRegisterRenderer, self)._render_reg_view_html(template_context=_template_context)
+
+    def _generate_reg_view_rdf(self):
+        g = super(GNAFRegisterRenderer, self)._generate_reg_view_rdf()
+        if self.after is not None:
+            # describes this page by its after argument, not by its page number, with a next page by ID, if any
+            ldp = Namespace('http://www.w3.org/ns/ldp#')
+            xhv = Namespace('https://www.w3.org/1999/xhtml/vocab#')
+            for page_uri in set(g.subjects(RDF.type, ldp.Page)):
+                g.remove((page_uri, None, None))
+            page_uri = URIRef(self._keyset_page_uri(self.after))
+            g.add((page_uri, RDF.type, ldp.Page))
+            g.add((page_uri, ldp.pageOf, URIRef(self.uri)))
+            if self.next_after is not None:
+                g.add((page_uri, xhv.next, URIRef(self._keyset_page_uri(self.next_after))))
+        return g
+
     def _render_alternates_view_html(self, template_context=None):
         _template_context = {
             'class_uri': "http://purl.org/linked-data/registry#Register",
@@ -1,5 +1,4 @@
 # -*- coding: utf-8 -*-
-from model import NotFoundError
 from model.address import Address
 from view.ldapi import GNAFClassRenderer, SchemaOrgRendererMixin, ISO19160RendererMixin
 import _config as config
@@ -7,6 +6,7 @@ import _config as config
 
 class AddressRenderer(SchemaOrgRendererMixin, ISO19160RendererMixin, GNAFClassRenderer):
     GNAF_CLASS = config.URI_ADDRESS_CLASS
+    MODEL_CLASS = Address
 
     def __init__(self, request, identifier, views, default_view_token, *args, **kwargs):
         _views = views or {}
@@ -15,13 +15,9 @@ class AddressRenderer(SchemaOrgRendererMixin, ISO19160RendererMixin, GNAFClassRe
         kwargs.setdefault('dct_template', 'class_address.html')
         super(AddressRenderer, self).__init__(request, _uri, _views, default_view_token, *args, **kwargs)
         self.identifier = identifier
-        if self.view == 'alternates':
-            self.instance = None
-        else:
-            try:
-                self.instance = Address(self.identifier, focus=True)
-            except NotFoundError as nfe:
-                self.instance = nfe
+
+    def _load_instance(self):
+        return Address(self.identifier, focus=True)
 
     def _render_dct_view_xml(self):
         raise NotImplementedError("DCT XML view of Address is not yet implemented.")
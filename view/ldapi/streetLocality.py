@@ -1,5 +1,4 @@
 # -*- coding: utf-8 -*-
-from model import NotFoundError
 from model.streetLocality import StreetLocality
 from view.ldapi import GNAFClassRenderer
 import _config as config
@@ -7,6 +6,7 @@ import _config as config
 
 class StreetLocalityRenderer(GNAFClassRenderer):
     GNAF_CLASS = config.URI_STREETLOCALITY_CLASS
+    MODEL_CLASS = StreetLocality
 
     def __init__(self, request, identifier, views, default_view_token, *args, **kwargs):
         _views = views or {}
@@ -15,13 +15,9 @@ class StreetLocalityRenderer(GNAFClassRenderer):
         kwargs.setdefault('dct_template', 'class_streetLocality.html')
         super(StreetLocalityRenderer, self).__init__(request, _uri, _views, default_view_token, *args, **kwargs)
         self.identifier = identifier
-        if self.view == 'alternates':
-            self.instance = None
-        else:
-            try:
-                self.instance = StreetLocality(self.identifier)
-            except NotFoundError as nfe:
-                self.instance = nfe
+
+    def _load_instance(self):
+        return StreetLocality(self.identifier)
 
     def _render_dct_view_xml(self):
         raise NotImplementedError("DCT XML view of StreetLocality is not yet implemented.")